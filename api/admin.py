@@ -1,3 +1,5 @@
 from django.contrib import admin
+from .models import IdempotencyKey, OutboxEmail
 
-# Register your models here.
+admin.site.register(OutboxEmail)
+admin.site.register(IdempotencyKey)
@@ -0,0 +1,28 @@
+from django.urls import path
+from django.views.decorators.csrf import csrf_exempt
+
+from .async_views import *
+from .routers import for_venue
+from .views import *
+
+# api.urls with async views for the read paths and the event stream, used by the ASGI application
+venue_routes = [
+    ('tables/', AsyncAvailableTablesView.as_view()),
+    ('tables/matrix', AvailabilityMatrixView.as_view()),
+    ('tables/combinations', TableCombinationsView.as_view()),
+    ('tables/events', AvailabilityEventsView.as_view()),
+    ('tables/index', AvailabilityIndexStatsView.as_view()),
+    ('reservations/', csrf_exempt(AsyncReservationsView.as_view())),
+    ('reservations/export', ExportReservationsView.as_view()),
+    ('reservations/<int:id>', CancelReservationView.as_view()),
+    ('reservations/series', ReservationSeriesView.as_view()),
+    ('reservations/series/<int:id>', CancelReservationSeriesView.as_view()),
+    ('archive', ArchiveView.as_view()),
+    ('analytics/occupancy', OccupancyView.as_view()),
+]
+
+urlpatterns = [path(route, view) for route, view in venue_routes] + [
+    path('venues/<slug:venue>/' + route, for_venue(view)) for route, view in venue_routes
+] + [
+    path('metrics', MetricsView.as_view()),
+]
@@ -0,0 +1,233 @@
+import asyncio
+import math
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.decorators import method_decorator
+from django.utils.http import http_date
+from django.views import View
+from rest_framework.renderers import JSONRenderer
+from rest_framework.throttling import BaseThrottle
+
+from api import metrics
+from api.pagination import after_cursor, encode_cursor
+from api.routers import reads_from_replica
+from api.throttling import throttle_wait
+from api.views import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, STREAM_CHUNK_SIZE, AvailableTablesView, ReservationsView,
+    get_date_from_request, reservations_version_keys, tables_version_keys,
+)
+from tables.availability import availability_index
+from tables.models import Reservation, Table
+from tables.pubsub import RESET, broker
+from tables.serializers import ReservationSerializer, TableSerializer, fast_serializers, serialize_many
+from tables.signals import event_key
+from tables.venues import current_venue
+from tables.versions import aget_versions, day_key
+
+
+# comment line sent to idle subscribers, keeps proxies from closing the connection
+SSE_KEEPALIVE = 15
+
+
+def json_response(data, status=200):
+    """
+        Same bytes as a DRF Response rendered with JSONRenderer.
+    """
+    with metrics.timer('serialization'):
+        return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def aconditional_on_versions(keys_func):
+    """
+        conditional_on_versions for async views, the versions are read with the async ORM.
+    """
+    def decorator(func):
+        @wraps(func)
+        async def inner(self, request, *args, **kwargs):
+            try:
+                keys = keys_func(request)
+            except Http404:
+                return HttpResponse(status=404)
+            if not keys:
+                return await func(self, request, *args, **kwargs)
+            etag, modified = await aget_versions(keys)
+            last_modified = int(modified.timestamp()) if modified else None
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await func(self, request, *args, **kwargs)
+            if last_modified and not response.has_header('Last-Modified'):
+                response.headers['Last-Modified'] = http_date(last_modified)
+            response.headers.setdefault('ETag', etag)
+            return response
+        return inner
+    return decorator
+
+
+def athrottled(scope):
+    """
+        TokenBucketThrottle for async views, answers 429 with Retry-After.
+    """
+    def decorator(func):
+        @wraps(func)
+        async def inner(self, request, *args, **kwargs):
+            wait = await sync_to_async(throttle_wait)(request, scope, BaseThrottle().get_ident(request))
+            if wait:
+                response = HttpResponse(status=429)
+                response['Retry-After'] = str(math.ceil(wait))
+                return response
+            return await func(self, request, *args, **kwargs)
+        return inner
+    return decorator
+
+
+@method_decorator(reads_from_replica, name='get')
+class AsyncAvailableTablesView(View):
+    """
+        AvailableTablesView for the ASGI application.
+    """
+    @athrottled(AvailableTablesView.throttle_scope)
+    @aconditional_on_versions(tables_version_keys)
+    async def get(self, request):
+        try:
+            min_seats = int(request.GET.get('min_seats'))
+            duration = int(request.GET.get('duration'))
+            start_date = get_date_from_request(request.GET.get('start_date'))
+        except (ValueError, TypeError):
+            return HttpResponse(status=400)
+        except Http404:
+            return HttpResponse(status=404)
+        if request.GET.get('status') != "free":
+            return HttpResponse(status=404)
+
+        if availability_index.enabled:
+            tables = await sync_to_async(availability_index.available_tables)(min_seats, start_date, duration)
+        else:
+            tables = [t async for t in AvailableTablesView.get_available_tables(min_seats, start_date, duration, use_index=False)]
+        return json_response(serialize_many(TableSerializer, tables))
+
+
+@method_decorator(reads_from_replica, name='get')
+class AsyncReservationsView(View):
+    """
+        ReservationsView for the ASGI application, listing is async, booking runs the sync view.
+    """
+    @athrottled(ReservationsView.throttle_scope)
+    @aconditional_on_versions(reservations_version_keys)
+    async def get(self, request):
+        try:
+            date = get_date_from_request(request.GET.get('start_date'))
+        except Http404:
+            return HttpResponse(status=404)
+
+        reservations = Reservation.objects.filter(day=date.date()).select_related('table').order_by('date', 'id')
+        if request.GET.get('stream'):
+            reservations = reservations.using(reservations.db)
+            return StreamingHttpResponse(astream_json(reservations, ReservationSerializer), content_type='application/json')
+        if 'limit' in request.GET or 'cursor' in request.GET:
+            return await self.get_page(request, reservations)
+        return json_response(serialize_many(ReservationSerializer, [r async for r in reservations]))
+
+    async def get_page(self, request, reservations):
+        try:
+            limit = min(int(request.GET.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+            if request.GET.get('cursor'):
+                reservations = after_cursor(reservations, request.GET['cursor'])
+        except ValueError:
+            return HttpResponse(status=400)
+        if limit < 1:
+            return HttpResponse(status=400)
+
+        page = [r async for r in reservations[:limit + 1]]
+        next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+        return json_response({'next': next_cursor, 'results': serialize_many(ReservationSerializer, page[:limit])})
+
+    async def post(self, request):
+        # bookings lock rows inside a transaction, which the async ORM cannot span
+        return await sync_to_async(ReservationsView.as_view())(request)
+
+
+async def astream_json(queryset, serializer_class):
+    """
+        stream_json with the async ORM.
+    """
+    renderer = JSONRenderer()
+    if getattr(settings, 'FAST_SERIALIZERS', False) and serializer_class in fast_serializers:
+        fast = fast_serializers[serializer_class]
+        to_representation = fast.compile()
+        rows = (to_representation(row) async for row in queryset.values_list(*fast.lookups()).aiterator(chunk_size=STREAM_CHUNK_SIZE))
+    else:
+        rows = (serializer_class(obj).data async for obj in queryset.aiterator(chunk_size=STREAM_CHUNK_SIZE))
+    yield b'['
+    first = True
+    async for row in rows:
+        if not first:
+            yield b','
+        first = False
+        yield renderer.render(row)
+    yield b']'
+
+
+class AvailabilityEventsView(View):
+    """
+        Server-Sent Events with availability changes of a day, instead of polling GET /tables.
+    """
+    async def get(self, request):
+        """
+            - 4 persons
+            - October 19
+
+            Example:
+                curl -N "localhost:5000/tables/events?min_seats=4&start_date=2021-10-19+00:00:00.000"
+
+            Return (text/event-stream):
+                event: ready      - subscribed, fetch the current state (GET /tables/matrix) now
+                event: booked     - data: {"table": 4, "start": "...", "end": "..."} table busy for the interval
+                event: freed      - the same data, table free again
+                event: reset      - updates were dropped, fetch the state again
+        """
+        try:
+            min_seats = int(request.GET.get('min_seats'))
+            day = get_date_from_request(request.GET.get('start_date')).date()
+        except (ValueError, TypeError):
+            return HttpResponse(status=400)
+        except Http404:
+            return HttpResponse(status=404)
+
+        tables = Table.objects.filter(min_number_of_seats__lte=min_seats, max_number_of_seats__gte=min_seats)
+        numbers = {table_id: number async for table_id, number in tables.values_list('id', 'number')}
+        response = StreamingHttpResponse(availability_events(current_venue(), day, numbers), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+async def availability_events(venue, day, numbers):
+    """
+        Events of the venue's day for the tables in numbers ({table_id: number}), see AvailabilityEventsView.
+    """
+    key = event_key(venue, day_key(day))
+    queue = broker.subscribe(key)
+    renderer = JSONRenderer()
+    try:
+        yield sse('ready', {'day': day.isoformat()})
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield b': keepalive\n\n'
+                continue
+            if event is RESET:
+                yield sse('reset', {'day': day.isoformat()})
+            elif event['table_id'] in numbers:
+                yield sse(event['type'], {
+                    'table': numbers[event['table_id']], 'start': event['start'], 'end': event['end']}, renderer)
+    finally:
+        broker.unsubscribe(key, queue)
+
+
+def sse(event, data, renderer=None):
+    return b'event: ' + event.encode() + b'\ndata: ' + (renderer or JSONRenderer()).render(data) + b'\n\n'
@@ -0,0 +1,84 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import router, transaction
+from django.utils import timezone
+
+from tables.models import FrozenVenue
+from tables.venues import shard_venues
+
+from . import metrics
+from .models import OutboxEmail
+
+
+def queue_email(subject, message, recipient_list):
+    """
+        Store emails in the outbox. Call inside the transaction of the change they
+        describe - they are sent only if it commits.
+    """
+    return queue_emails([(subject, message, recipient_list)])
+
+
+def queue_emails(emails):
+    """
+        queue_email for many (subject, message, recipient_list) at once, in one insert.
+    """
+    return OutboxEmail.objects.bulk_create([
+        OutboxEmail(subject=subject, message=message, from_email=settings.EMAIL_HOST_USER, recipient=recipient)
+        for subject, message, recipient_list in emails
+        for recipient in recipient_list
+    ])
+
+
+def send_queued_emails(batch_size=None):
+    """
+        Send one batch of due emails through a single backend connection.
+        Failed emails are rescheduled with exponential backoff.
+
+        Return:
+            (sent, failed) numbers of emails
+    """
+    config = settings.EMAIL_OUTBOX
+    batch_size = batch_size or config['BATCH_SIZE']
+    now = timezone.now()
+
+    using = router.db_for_write(OutboxEmail)
+    with transaction.atomic(using=using):
+        batch = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True)
+            .filter(sent__isnull=True, next_attempt__lte=now, attempts__lt=config['MAX_ATTEMPTS'])
+            # emails of venues moved in or out of the shard are sent from the other copy
+            .filter(venue__in=shard_venues(using)).exclude(venue__in=FrozenVenue.objects.using(using).values('venue'))
+            .order_by('next_attempt')[:batch_size]
+        )
+        # claim the batch, another worker picks it up again only if this one dies
+        OutboxEmail.objects.filter(id__in=[email.id for email in batch]).update(next_attempt=now + timedelta(minutes=10))
+
+    sent = failed = 0
+    connection = get_connection(fail_silently=False)
+    try:
+        for email in batch:
+            email.attempts += 1
+            try:
+                # no-op while the connection is open, reconnects after a failure
+                with metrics.timer('email'):
+                    connection.open()
+                    connection.send_messages([
+                        EmailMessage(email.subject, email.message, email.from_email, [email.recipient], connection=connection)
+                    ])
+            except Exception as e:
+                email.last_error = repr(e)
+                email.next_attempt = timezone.now() + timedelta(seconds=config['RETRY_BACKOFF'] * 2 ** (email.attempts - 1))
+                connection.close()
+                failed += 1
+            else:
+                email.sent = timezone.now()
+                sent += 1
+    finally:
+        connection.close()
+        OutboxEmail.objects.bulk_update(batch, ['attempts', 'last_error', 'next_attempt', 'sent'])
+        metrics.registry.inc('emails_sent_total', value=sent)
+        metrics.registry.inc('emails_failed_total', value=failed)
+        metrics.registry.maybe_flush()
+    return sent, failed
@@ -0,0 +1,66 @@
+import csv
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+from api.pagination import make_cursor
+from tables.serializers import ExportReservationSerializer
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+class Echo:
+    """
+        File-like object for csv.writer which returns the line instead of buffering it.
+    """
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset):
+    """
+        Yield (output dict, cursor) for every reservation, read with a server-side iterator
+        in EXPORT_CHUNK_SIZE chunks. The cursor resumes the export after that row.
+    """
+    to_representation = ExportReservationSerializer.compile()
+    lookups = ExportReservationSerializer.lookups()
+    id_index, date_index = lookups.index('id'), lookups.index('date')
+    for row in ExportReservationSerializer.rows(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+        yield to_representation(row), make_cursor(row[date_index], row[id_index])
+
+
+def export_csv(queryset):
+    writer = csv.writer(Echo())
+    names = [name for name, _, _ in ExportReservationSerializer.fields]
+    yield writer.writerow(names + ['cursor'])
+    for row, cursor in export_rows(queryset):
+        yield writer.writerow([row[name] for name in names] + [cursor])
+
+
+def export_ndjson(queryset):
+    for row, cursor in export_rows(queryset):
+        row['cursor'] = cursor
+        yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+class ExportRenderer(BaseRenderer):
+    """
+        Selects the export format by ?format= or Accept, the rows are streamed by export.
+        Only bodiless error responses are rendered.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return b''
+
+
+class CSVRenderer(ExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    export = staticmethod(export_csv)
+
+
+class NDJSONRenderer(ExportRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    export = staticmethod(export_ndjson)
@@ -0,0 +1,122 @@
+import hashlib
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, router, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.throttling import BaseThrottle
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+
+
+class Claimed(Exception):
+    """
+        Another request with the same key committed first.
+    """
+
+
+class Discard(Exception):
+    """
+        Roll the claim back together with the view's changes and answer with response.
+    """
+    def __init__(self, response):
+        self.response = response
+
+
+def idempotency_config():
+    return getattr(settings, 'IDEMPOTENCY', {})
+
+
+def idempotent(method):
+    """
+        Answer retries of a request with the same Idempotency-Key header by replaying
+        the first response, without running the view again.
+
+        The key is claimed by inserting its row in the transaction which runs the view,
+        and the response is stored in that transaction as well - a reservation, its
+        email and the stored answer commit together or not at all. A concurrent retry
+        waits on the unique (key, scope) index and then replays. 5xx answers are not
+        stored, the retry runs the view again. Keys are scoped to the client, another
+        client sending the same key does not get the first client's answer.
+    """
+    @wraps(method)
+    def inner(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return method(self, request, *args, **kwargs)
+        if len(key) > IdempotencyKey._meta.get_field('key').max_length:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        scope = "{method} {path} {client}".format(method=request.method, path=request.path, client=client_ident(request))
+        fingerprint = hashlib.sha256(request.body).hexdigest()
+        using = router.db_for_write(IdempotencyKey)
+        stored_keys = IdempotencyKey.objects.using(using).filter(key=key, scope=scope)
+        while True:
+            stored = stored_keys.first()
+            if stored is not None and stored.expires <= timezone.now():
+                stored_keys.filter(expires__lte=timezone.now()).delete()
+                stored = None
+            if stored is not None:
+                return replay(stored, fingerprint)
+
+            try:
+                with transaction.atomic(using=using):
+                    claim = claim_key(using, key, scope, fingerprint)
+                    response = method(self, request, *args, **kwargs)
+                    if response.status_code >= 500:
+                        raise Discard(response)
+                    claim.status_code = response.status_code
+                    claim.data = response.data if isinstance(response, Response) else None
+                    claim.headers = {
+                        header: value for header, value in response.items() if header.lower() != 'content-type'}
+                    claim.save(update_fields=['status_code', 'data', 'headers'])
+                return response
+            except Claimed:
+                continue
+            except Discard as discarded:
+                return discarded.response
+    return inner
+
+
+def client_ident(request):
+    """
+        The user of an authenticated request, otherwise the client address the way the
+        throttles see it (settings.REST_FRAMEWORK['NUM_PROXIES']).
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return 'user:{pk}'.format(pk=user.pk)
+    return BaseThrottle().get_ident(request)
+
+
+def claim_key(using, key, scope, fingerprint):
+    ttl = timedelta(seconds=idempotency_config().get('TTL', 86400))
+    try:
+        with transaction.atomic(using=using):
+            return IdempotencyKey.objects.using(using).create(
+                key=key, scope=scope, fingerprint=fingerprint, expires=timezone.now() + ttl)
+    except IntegrityError:
+        raise Claimed
+
+
+def replay(stored, fingerprint):
+    if stored.fingerprint != fingerprint:
+        # the key was used for a different request
+        return Response(status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    response = Response(stored.data, status=stored.status_code, headers=stored.headers)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def delete_expired_keys():
+    """
+        Return:
+            number of deleted keys
+    """
+    deleted, _ = IdempotencyKey.objects.filter(expires__lte=timezone.now()).delete()
+    return deleted
@@ -0,0 +1,170 @@
+import json
+import logging
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, router, transaction
+from django.db.models import Max, Min
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from api.views import AvailableTablesView
+from tables.models import Reservation, Table
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+# a taken table is a valid outcome of a booking, anything else but 2xx means the timing is off
+EXPECTED_CONFLICT = 409
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Time the reservation hot paths against the current database, see seed_reservations."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Write the results as JSON to this file.")
+        parser.add_argument('--label', default='', help="Free text stored with the results, e.g. a git revision.")
+
+    def handle(self, *args, **options):
+        # every scenario comes from one client, the per client buckets and the
+        # concurrency limit would time 429/503 answers instead of the work
+        with override_settings(THROTTLING={}):
+            self.benchmark(options)
+
+    def benchmark(self, options):
+        self.rng = random.Random(options['seed'])
+        # 409/404 answers are expected, do not log each of them
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        self.client = Client(HTTP_HOST='localhost')
+        self.tables = list(Table.objects.values_list('number', 'min_number_of_seats', 'max_number_of_seats'))
+        if not self.tables:
+            self.stderr.write("No tables, run seed_reservations first.")
+            return
+        bounds = Reservation.objects.aggregate(first=Min('date'), last=Max('date'))
+        self.first_day = (bounds['first'] or timezone.now()).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+        self.days = max(((bounds['last'] or timezone.now()).replace(tzinfo=None) - self.first_day).days, 1)
+
+        # (name, timed function, untimed setup returning its arguments)
+        scenarios = [
+            ('get_available_tables', self.get_available_tables, None),
+            ('GET /tables', self.get_tables, None),
+            ('GET /reservations', self.get_reservations, None),
+            ('POST /reservations', self.post_reservation, None),
+            ('cancel', self.cancel, self.create_future_reservation),
+        ]
+        results = {
+            'label': options['label'],
+            'timestamp': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'tables': len(self.tables),
+            'reservations': Reservation.objects.count(),
+            'scenarios': {},
+        }
+        # everything written by the scenarios is rolled back at the end
+        try:
+            with transaction.atomic(using=router.db_for_write(Reservation)):
+                for name, scenario, setup in scenarios:
+                    results['scenarios'][name] = self.measure(scenario, setup, options['iterations'])
+                    self.report(name, results['scenarios'][name])
+                raise Rollback
+        except Rollback:
+            pass
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write("Results written to {output}".format(output=options['output']))
+
+    def measure(self, scenario, setup, iterations):
+        latencies = []
+        queries = []
+        for _ in range(iterations):
+            args = setup() if setup else ()
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                scenario(*args)
+                latencies.append((time.perf_counter() - start) * 1000)
+            queries.append(len(captured))
+        latencies.sort()
+        return {
+            'iterations': iterations,
+            'mean_ms': statistics.fmean(latencies),
+            'p50_ms': percentile(latencies, 50),
+            'p90_ms': percentile(latencies, 90),
+            'p99_ms': percentile(latencies, 99),
+            'max_ms': latencies[-1],
+            'queries_mean': statistics.fmean(queries),
+            'queries_max': max(queries),
+        }
+
+    def report(self, name, result):
+        self.stdout.write("{name:<24} p50 {p50_ms:8.2f} ms  p90 {p90_ms:8.2f} ms  p99 {p99_ms:8.2f} ms  queries {queries_mean:6.1f}".format(
+            name=name, **result))
+
+    def random_date(self):
+        return self.first_day + timedelta(days=self.rng.randrange(self.days), minutes=15 * self.rng.randrange(10 * 4, 22 * 4))
+
+    def random_request(self):
+        number, min_seats, max_seats = self.rng.choice(self.tables)
+        return number, self.rng.randint(min_seats, max_seats), self.random_date(), self.rng.randint(1, 3)
+
+    def get_available_tables(self):
+        _, seats, date, duration = self.random_request()
+        list(AvailableTablesView.get_available_tables(seats, date, duration, use_index=False))
+
+    def get_tables(self):
+        _, seats, date, duration = self.random_request()
+        check(self.client.get('/tables/', {'min_seats': seats, 'start_date': date.strftime(DATE_FORMAT), 'duration': duration, 'status': 'free'}))
+
+    def get_reservations(self):
+        check(self.client.get('/reservations/', {'start_date': self.random_date().strftime(DATE_FORMAT)}))
+
+    def post_reservation(self):
+        number, seats, date, duration = self.random_request()
+        check(self.client.post('/reservations/', {
+            'date': date.strftime(DATE_FORMAT),
+            'duration': str(duration),
+            'tableNumber': str(number),
+            'fullName': 'Paul Smith',
+            'phone': '997 123 997',
+            'email': 'paul@email.com',
+            'numberOfSeats': str(seats),
+        }, content_type='application/json'))
+
+    def create_future_reservation(self):
+        number, seats, _, _ = self.random_request()
+        reservation = Reservation.objects.create(
+            table=Table.objects.get(number=number), date=datetime.now() + timedelta(days=3650 + self.rng.randrange(3650)),
+            duration=1, full_name='Paul Smith', phone='997 123 997', email='paul@email.com', number_of_seats=seats)
+        return (reservation,)
+
+    def cancel(self, reservation):
+        """
+            Request the verification code and confirm the cancellation.
+        """
+        url = '/reservations/{id}'.format(id=reservation.id)
+        check(self.client.put(url, {'status': 'requested cancellation'}, content_type='application/json'))
+        code = Reservation.objects.values_list('verification_code', flat=True).get(id=reservation.id)
+        check(self.client.delete(url, {'verification_code': str(code)}, content_type='application/json'))
+
+
+def check(response):
+    if not (200 <= response.status_code < 300 or response.status_code == EXPECTED_CONFLICT):
+        raise CommandError("{method} {path} answered {status}, the results would not time the endpoint".format(
+            method=response.request['REQUEST_METHOD'], path=response.request['PATH_INFO'], status=response.status_code))
+    return response
+
+
+def percentile(values, p):
+    """
+        Nearest-rank percentile of sorted values.
+    """
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api.idempotency import delete_expired_keys
+from tables.venues import using_venue, venue_databases
+
+
+class Command(BaseCommand):
+    help = "Delete stored Idempotency-Key responses past their TTL."
+
+    def handle(self, *args, **options):
+        deleted = 0
+        for venue in venue_databases().values():
+            with using_venue(venue):
+                deleted += delete_expired_keys()
+        self.stdout.write(self.style.SUCCESS("Deleted {deleted} expired keys".format(deleted=deleted)))
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from .benchmark import percentile
+
+THROTTLED_STATUSES = {'429', '503'}
+
+
+class Command(BaseCommand):
+    help = (
+        "Send concurrent GET requests to a running server, e.g. compare "
+        "'gunicorn reservations_api.wsgi' with 'uvicorn reservations_api.asgi:application', "
+        "both started with DJANGO_SETTINGS_MODULE=reservations_api.loadtest_settings."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help="Full URL with the query string, e.g. http://127.0.0.1:8000/tables/?...")
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument('--output', help="Write the results as JSON to this file.")
+        parser.add_argument('--label', default='', help="Free text stored with the results, e.g. the server used.")
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http' or not url.hostname:
+            raise CommandError("Only http:// URLs are supported")
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError("--concurrency and --requests must be positive")
+
+        start = time.perf_counter()
+        latencies, statuses = asyncio.run(self.run(url, options))
+        elapsed = time.perf_counter() - start
+
+        latencies.sort()
+        results = {
+            'label': options['label'],
+            'url': options['url'],
+            'concurrency': options['concurrency'],
+            'requests': options['requests'],
+            'seconds': elapsed,
+            'requests_per_second': len(latencies) / elapsed,
+            'statuses': dict(sorted(statuses.items())),
+            'mean_ms': statistics.fmean(latencies) if latencies else None,
+            'p50_ms': percentile(latencies, 50) if latencies else None,
+            'p90_ms': percentile(latencies, 90) if latencies else None,
+            'p99_ms': percentile(latencies, 99) if latencies else None,
+            'max_ms': latencies[-1] if latencies else None,
+        }
+        self.stdout.write("{requests} requests in {seconds:.2f} s, {requests_per_second:.1f} req/s, statuses {statuses}".format(**results))
+        if latencies:
+            self.stdout.write("p50 {p50_ms:.2f} ms  p90 {p90_ms:.2f} ms  p99 {p99_ms:.2f} ms  max {max_ms:.2f} ms".format(**results))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write("Results written to {output}".format(output=options['output']))
+
+        throttled = sum(count for status, count in statuses.items() if status in THROTTLED_STATUSES)
+        if throttled:
+            raise CommandError(
+                "{throttled} requests were throttled (429/503), the numbers do not measure the server. "
+                "Start it with DJANGO_SETTINGS_MODULE=reservations_api.loadtest_settings".format(throttled=throttled))
+
+    async def run(self, url, options):
+        latencies = []
+        statuses = {}
+        remaining = iter(range(options['requests']))
+        target = url.path or '/'
+        if url.query:
+            target += '?' + url.query
+        request = 'GET {target} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n'.format(
+            target=target, host=url.netloc).encode()
+
+        async def worker():
+            # the iterator is shared, so the workers together send exactly --requests
+            for _ in remaining:
+                start = time.perf_counter()
+                try:
+                    status = await asyncio.wait_for(self.fetch(url.hostname, url.port or 80, request), options['timeout'])
+                except (OSError, asyncio.TimeoutError, ValueError):
+                    status = 'error'
+                else:
+                    latencies.append((time.perf_counter() - start) * 1000)
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+        await asyncio.gather(*(worker() for _ in range(options['concurrency'])))
+        return latencies, statuses
+
+    @staticmethod
+    async def fetch(host, port, request):
+        """
+            One request on a new connection, the whole response is read.
+
+            Return:
+                status code
+        """
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            writer.write(request)
+            await writer.drain()
+            status_line = await reader.readline()
+            await reader.read()
+        finally:
+            writer.close()
+        return int(status_line.split()[1])
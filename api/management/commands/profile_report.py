@@ -0,0 +1,70 @@
+import pstats
+
+from django.core.management.base import BaseCommand
+
+from api.profiling import load_dumps, profiling_config, trigger_header
+
+
+class Command(BaseCommand):
+    help = "Sum the profiles and SQL traces written by api.profiling.ProfilingMiddleware into a top-N report per endpoint."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help="Directory of the dumps, PROFILING['DIR'] by default.")
+        parser.add_argument('--top', type=int, default=20)
+        parser.add_argument('--sort', choices=['cumulative', 'tottime'], default='cumulative')
+        parser.add_argument('--route', help="Only this route, e.g. tables/")
+        parser.add_argument('--sign', action='store_true', help="Print a value of the header which profiles a request.")
+
+    def handle(self, *args, **options):
+        if options['sign']:
+            self.stdout.write("{header}: {value}".format(
+                header=profiling_config().get('HEADER', 'X-Profile'), value=trigger_header()))
+            return
+
+        directory = options['dir'] or profiling_config().get('DIR')
+        endpoints = {}
+        for dump, prof in load_dumps(directory) if directory else ():
+            if options['route'] is None or dump['route'] == options['route']:
+                endpoints.setdefault((dump['method'], dump['route']), []).append((dump, prof))
+        if not endpoints:
+            self.stderr.write("No profiles in {directory}".format(directory=directory))
+            return
+
+        for (method, route), dumps in sorted(endpoints.items()):
+            self.report(method, route, dumps, options['top'], options['sort'])
+
+    def report(self, method, route, dumps, top, sort):
+        elapsed = sorted(dump['elapsed'] for dump, _ in dumps)
+        self.stdout.write(self.style.SUCCESS("{method} /{route}".format(method=method, route=route)))
+        self.stdout.write("  requests {count}, mean {mean:.1f} ms, max {max:.1f} ms, {queries:.1f} queries per request".format(
+            count=len(dumps), mean=sum(elapsed) / len(elapsed) * 1000, max=elapsed[-1] * 1000,
+            queries=sum(len(dump['queries']) for dump, _ in dumps) / len(dumps)))
+
+        profiles = [str(prof) for _, prof in dumps if prof is not None]
+        if profiles:
+            stats = pstats.Stats(*profiles)
+            # (primitive calls, calls, own time, cumulative time, callers) by function
+            key = 3 if sort == 'cumulative' else 2
+            rows = sorted(stats.stats.items(), key=lambda item: -item[1][key])[:top]
+            self.stdout.write("  {calls:>10} {tottime:>10} {cumtime:>10}  function (ms per request)".format(
+                calls='calls', tottime='tottime', cumtime='cumtime'))
+            for func, (_, calls, tottime, cumtime, _) in rows:
+                self.stdout.write("  {calls:>10} {tottime:>10.2f} {cumtime:>10.2f}  {func}".format(
+                    calls=calls, tottime=tottime / len(profiles) * 1000, cumtime=cumtime / len(profiles) * 1000,
+                    func=pstats.func_std_string(func)))
+
+        queries = {}
+        for dump, _ in dumps:
+            for query in dump['queries']:
+                count, total, repeats = queries.get(query['sql'], (0, 0, 0))
+                queries[query['sql']] = (count + 1, total + query['time'], repeats)
+            for duplicate in dump['duplicates']:
+                count, total, repeats = queries[duplicate['sql']]
+                queries[duplicate['sql']] = (count, total, max(repeats, duplicate['count']))
+        if queries:
+            self.stdout.write("  {count:>10} {total:>10} {repeats:>10}  sql (total ms, most runs in one request)".format(
+                count='count', total='time', repeats='repeats'))
+            for sql, (count, total, repeats) in sorted(queries.items(), key=lambda item: -item[1][1])[:top]:
+                self.stdout.write("  {count:>10} {total:>10.2f} {repeats:>10}  {sql}".format(
+                    count=count, total=total * 1000, repeats=repeats or 1, sql=sql))
+        self.stdout.write('')
@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.emails import send_queued_emails
+from tables.venues import using_venue, venue_databases
+
+
+class Command(BaseCommand):
+    help = "Send emails waiting in the outboxes of all shards."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.EMAIL_OUTBOX['BATCH_SIZE'])
+        parser.add_argument('--loop', action='store_true', help="Keep draining the outbox until interrupted.")
+        parser.add_argument('--interval', type=float, default=5, help="Seconds to sleep when the outbox is empty.")
+
+    def handle(self, *args, **options):
+        while True:
+            sent = failed = 0
+            # every shard has its own outbox, written together with its reservations
+            for venue in venue_databases().values():
+                with using_venue(venue):
+                    shard_sent, shard_failed = send_queued_emails(options['batch_size'])
+                sent, failed = sent + shard_sent, failed + shard_failed
+            if sent or failed:
+                self.stdout.write("Sent {sent}, failed {failed}".format(sent=sent, failed=failed))
+            if not options['loop']:
+                break
+            if sent + failed < options['batch_size']:
+                time.sleep(options['interval'])
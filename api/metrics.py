@@ -0,0 +1,261 @@
+import contextvars
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from rest_framework.renderers import JSONRenderer
+
+# upper bounds in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+current_request = contextvars.ContextVar('current_request_metrics', default=None)
+
+
+class Registry:
+    """
+        Counters and histograms of this process.
+
+        With settings.METRICS['DIR'] every process also dumps its state to
+        DIR/metrics-<pid>.json at most every FLUSH_INTERVAL seconds and render()
+        sums the dumps of all processes, so any worker can answer /metrics.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.flushed = 0
+
+    @property
+    def config(self):
+        return getattr(settings, 'METRICS', {})
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, tuple(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # counts per bucket, then sum and count
+                histogram = self.histograms[key] = [0] * (len(BUCKETS) + 2)
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+                    break
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, list(labels), list(values)] for (name, labels), values in self.histograms.items()],
+            }
+
+    def maybe_flush(self):
+        directory = self.config.get('DIR')
+        if not directory or time.monotonic() - self.flushed < self.config.get('FLUSH_INTERVAL', 5):
+            return
+        self.flushed = time.monotonic()
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        # write and rename, readers never see a partial file
+        fd, path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path, Path(directory) / 'metrics-{pid}.json'.format(pid=os.getpid()))
+
+    def collect(self):
+        """
+            Return:
+                (counters, histograms) of this process, summed with the other processes' dumps
+        """
+        snapshots = [self.snapshot()]
+        directory = self.config.get('DIR')
+        if directory and Path(directory).is_dir():
+            own = 'metrics-{pid}.json'.format(pid=os.getpid())
+            for path in Path(directory).glob('metrics-*.json'):
+                if path.name == own:
+                    continue
+                try:
+                    snapshots.append(json.loads(path.read_text()))
+                except (OSError, ValueError):
+                    continue
+
+        counters, histograms = {}, {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(tuple(label) for label in labels))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, values in snapshot['histograms']:
+                key = (name, tuple(tuple(label) for label in labels))
+                total = histograms.setdefault(key, [0] * len(values))
+                for i, value in enumerate(values):
+                    total[i] += value
+        return counters, histograms
+
+    def render(self, gauges=()):
+        """
+            Return:
+                metrics in the Prometheus text exposition format
+        """
+        counters, histograms = self.collect()
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            lines.append('# TYPE {name} counter'.format(name=name))
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append('{name}{labels} {value}'.format(name=name, labels=format_labels(labels), value=value))
+        for name in sorted({name for name, _ in histograms}):
+            lines.append('# TYPE {name} histogram'.format(name=name))
+            for (metric, labels), values in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), values[:len(BUCKETS)] + [values[-1] - sum(values[:len(BUCKETS)])]):
+                    cumulative += count
+                    lines.append('{name}_bucket{labels} {value}'.format(
+                        name=name, labels=format_labels(labels + (('le', str(bound)),)), value=cumulative))
+                lines.append('{name}_sum{labels} {value}'.format(name=name, labels=format_labels(labels), value=values[-2]))
+                lines.append('{name}_count{labels} {value}'.format(name=name, labels=format_labels(labels), value=values[-1]))
+        for name, value in gauges:
+            lines.append('# TYPE {name} gauge'.format(name=name))
+            lines.append('{name} {value}'.format(name=name, value=value))
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels) + '}'
+
+
+registry = Registry()
+
+
+@contextmanager
+def timer(name):
+    """
+        Time a part of the request (e.g. 'serialization', 'email'). Inside a request
+        the time, without database queries run meanwhile, is reported per route by
+        MetricsMiddleware; outside a request it is observed directly as <name>_seconds.
+    """
+    request_metrics = current_request.get()
+    query_time = request_metrics.query_time if request_metrics else 0
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if request_metrics is None:
+            registry.observe('{name}_seconds'.format(name=name), (), elapsed)
+        else:
+            elapsed -= request_metrics.query_time - query_time
+            request_metrics.timings[name] = request_metrics.timings.get(name, 0) + elapsed
+
+
+class RequestMetrics:
+    """
+        Collected during one request.
+    """
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0
+        self.timings = {}
+
+
+def count_queries(execute, sql, params, many, context):
+    """
+        Execute wrapper of every connection, charges queries to the current request.
+        The request is found through a context variable, which asgiref carries into
+        the threads running the ORM for async views.
+    """
+    request_metrics = current_request.get()
+    if request_metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        request_metrics.queries += 1
+        request_metrics.query_time += time.perf_counter() - start
+
+
+@receiver(connection_created)
+def install_query_counter(sender, connection, **kwargs):
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+class MetricsMiddleware:
+    """
+        Record count, latency, database queries and timers of every request by route.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not registry.config.get('ENABLED', True):
+            return self.get_response(request)
+
+        request_metrics = RequestMetrics()
+        token = current_request.set(request_metrics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        self.record(request, response.status_code, time.perf_counter() - start, request_metrics)
+        return response
+
+    async def __acall__(self, request):
+        if not registry.config.get('ENABLED', True):
+            return await self.get_response(request)
+
+        request_metrics = RequestMetrics()
+        token = current_request.set(request_metrics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+        self.record(request, response.status_code, time.perf_counter() - start, request_metrics)
+        return response
+
+    def record(self, request, status_code, elapsed, request_metrics):
+        match = getattr(request, 'resolver_match', None)
+        route = match.route if match else 'unmatched'
+        labels = (('route', route), ('method', request.method))
+        registry.inc('http_requests_total', labels + (('status', status_code),))
+        registry.observe('http_request_duration_seconds', labels, elapsed)
+        registry.inc('db_queries_total', labels, request_metrics.queries)
+        registry.observe('db_query_duration_seconds', labels, request_metrics.query_time)
+        for name, value in request_metrics.timings.items():
+            registry.observe('{name}_seconds'.format(name=name), labels, value)
+        registry.maybe_flush()
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """
+        JSONRenderer reporting its time as part of serialization.
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timer('serialization'):
+            return super().render(data, accepted_media_type, renderer_context)
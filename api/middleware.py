@@ -0,0 +1,117 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+
+from api.routers import replica_config
+from api.throttling import bucket_store, throttling_config
+
+
+class ConcurrencyLimitMiddleware:
+    """
+        Answer 503 with Retry-After once settings.THROTTLING['MAX_CONCURRENT_REQUESTS']
+        requests are in flight on the host, before the excess load reaches the database.
+
+        The requests of every worker process are counted in the SQLite file of the token
+        buckets (api.throttling.BucketStore), so the limit holds for the host whatever
+        the number of workers.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        entered = self.enter()
+        if entered is False:
+            return self.overloaded()
+        try:
+            return self.get_response(request)
+        finally:
+            if entered:
+                bucket_store.leave()
+
+    async def __acall__(self, request):
+        entered = await sync_to_async(self.enter)()
+        if entered is False:
+            return self.overloaded()
+        try:
+            return await self.get_response(request)
+        finally:
+            if entered:
+                await sync_to_async(bucket_store.leave)()
+
+    @staticmethod
+    def enter():
+        """
+            Return:
+                True if the request was counted, False if over the limit, None if it runs uncounted
+        """
+        limit = throttling_config().get('MAX_CONCURRENT_REQUESTS')
+        if not limit:
+            return None
+        return bucket_store.enter(limit)
+
+    @staticmethod
+    def overloaded():
+        response = HttpResponse(status=503)
+        response['Retry-After'] = '1'
+        return response
+
+
+class ASGIUrlconfMiddleware:
+    """
+        Route requests served by the ASGI application to settings.ASGI_ROOT_URLCONF,
+        so its read paths run as native async views instead of in the sync thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        request.urlconf = settings.ASGI_ROOT_URLCONF
+        return await self.get_response(request)
+
+
+class ReplicaPinningMiddleware:
+    """
+        Set the pin cookie for settings.DATABASE_REPLICAS['PIN_SECONDS'] after a
+        successful write, so the client's next reads see its own changes even when
+        the replicas lag behind.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(request, await self.get_response(request))
+
+    @staticmethod
+    def process_response(request, response):
+        config = replica_config()
+        pin_seconds = config.get('PIN_SECONDS', 0)
+        if config.get('ALIASES') and pin_seconds and request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            response.set_cookie(config.get('COOKIE', 'pin_primary'), '1', max_age=pin_seconds, httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:16
+
+import tables.venues
+from django.db import migrations, models
+
+
+def assign_shard_venue(apps, schema_editor):
+    # like tables 0014_venue, the rows of a shard which served one restaurant belong to its venue
+    alias = schema_editor.connection.alias
+    venue = tables.venues.venue_databases().get(alias)
+    if venue is None or venue == tables.venues.current_venue():
+        return
+    for model in ('OutboxEmail', 'IdempotencyKey'):
+        apps.get_model('api', model).objects.using(alias).update(venue=venue)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='venue',
+            field=models.CharField(default=tables.venues.current_venue, max_length=31),
+        ),
+        migrations.AddField(
+            model_name='outboxemail',
+            name='venue',
+            field=models.CharField(default=tables.venues.current_venue, max_length=31),
+        ),
+        migrations.RunPython(assign_shard_venue, migrations.RunPython.noop),
+    ]
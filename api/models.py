@@ -1,3 +1,60 @@
 from django.db import models
+from django.db.models.fields import CharField, DateTimeField, EmailField, IntegerField, TextField
+from django.db.models.fields.json import JSONField
+from django.utils import timezone
 
-# Create your models here.
+from tables.venues import current_venue
+
+
+class OutboxEmail(models.Model):
+    """
+        Email waiting for delivery by the send_queued_emails command.
+        Written in the same transaction as the change it notifies about.
+    """
+    # the venue whose change it notifies about, moved with it to another shard
+    venue = CharField(max_length=31, default=current_venue)
+    subject = CharField(max_length=255)
+    message = TextField()
+    from_email = CharField(max_length=255)
+    recipient = EmailField()
+    created = DateTimeField(auto_now_add=True)
+    next_attempt = DateTimeField(default=timezone.now)
+    attempts = IntegerField(default=0)
+    sent = DateTimeField(null=True, blank=True)
+    last_error = TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['sent', 'next_attempt'], name='outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        return "{subject} to {recipient}".format(subject=self.subject, recipient=self.recipient)
+
+
+class IdempotencyKey(models.Model):
+    """
+        Response to a request sent with an Idempotency-Key header, replayed to its
+        retries until expires, see api.idempotency.
+    """
+    venue = CharField(max_length=31, default=current_venue)
+    key = CharField(max_length=255)
+    # method, path and client the key was used for
+    scope = CharField(max_length=255)
+    # sha256 of the body, a key reused for another request is rejected
+    fingerprint = CharField(max_length=64)
+    status_code = IntegerField(null=True)
+    data = JSONField(null=True)
+    headers = JSONField(default=dict)
+    expires = DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['key', 'scope'], name='idempotency_key_scope_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['expires'], name='idempotency_expires_idx'),
+        ]
+
+    def __str__(self):
+        return "{scope} {key}".format(scope=self.scope, key=self.key)
@@ -0,0 +1,40 @@
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+
+
+def encode_cursor(reservation):
+    """
+        Opaque position after the reservation in (date, id) order.
+    """
+    return make_cursor(reservation.date, reservation.id)
+
+
+def make_cursor(date, id):
+    raw = "{date}|{id}".format(date=date.isoformat(), id=id)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+        Return:
+            (date, id) encoded by encode_cursor
+        Raise:
+            ValueError for a malformed cursor
+    """
+    try:
+        date, id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(date), int(id)
+    except (TypeError, UnicodeDecodeError, binascii.Error) as e:
+        raise ValueError(cursor) from e
+
+
+def after_cursor(queryset, cursor):
+    """
+        Keyset filter - rows after the cursor in (date, id) order, served from an index
+        instead of an OFFSET scan.
+    """
+    date, id = decode_cursor(cursor)
+    return queryset.filter(Q(date__gt=date) | Q(date=date, id__gt=id))
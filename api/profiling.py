@@ -0,0 +1,212 @@
+import contextvars
+import cProfile
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.signing import BadSignature, TimestampSigner
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+SIGNED_VALUE = 'profile'
+
+current_trace = contextvars.ContextVar('current_profiling_trace', default=None)
+
+# numbers the dumps of this process
+dump_counter = itertools.count()
+
+# the profiler active in this thread, cProfile cannot nest
+local = threading.local()
+
+
+def profiling_config():
+    return getattr(settings, 'PROFILING', {})
+
+
+def signer():
+    return TimestampSigner(salt='api.profiling')
+
+
+def trigger_header():
+    """
+        Return:
+            value of the profiling header, valid for PROFILING['MAX_AGE'] seconds
+    """
+    return signer().sign(SIGNED_VALUE)
+
+
+def is_triggered(request):
+    value = request.headers.get(profiling_config().get('HEADER', 'X-Profile'))
+    if not value:
+        return False
+    try:
+        return signer().unsign(value, max_age=profiling_config().get('MAX_AGE', 600)) == SIGNED_VALUE
+    except BadSignature:
+        return False
+
+
+def trace_queries(execute, sql, params, many, context):
+    """
+        Execute wrapper of every connection, records the queries of a profiled request.
+        Only the SQL is kept, the parameters may hold customers' data.
+    """
+    trace = current_trace.get()
+    if trace is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        trace.append((sql, time.perf_counter() - start))
+
+
+@receiver(connection_created)
+def install_query_tracer(sender, connection, **kwargs):
+    if trace_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(trace_queries)
+
+
+class ProfilingMiddleware:
+    """
+        Profile PROFILING['SAMPLE_RATE'] of the requests and every request carrying
+        the signed PROFILING['HEADER'] (manage.py profile_report --sign). Each one
+        leaves <stem>.prof with the cProfile stats and <stem>.json with its SQL trace
+        in PROFILING['DIR'], of which the newest MAX_FILES requests are kept.
+
+        cProfile sees only the thread it runs in: on ASGI that is the event loop, so
+        the profile also holds other requests served meanwhile and misses the ORM work
+        done in sync_to_async threads - the SQL trace has all of the queries. A request
+        arriving while its thread is being profiled gets the SQL trace only.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        trace = []
+        token = current_trace.set(trace)
+        profiler = start_profiler()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            stop_profiler(profiler)
+            current_trace.reset(token)
+        write_dump(request, response.status_code, time.perf_counter() - start, profiler, trace)
+        return response
+
+    async def __acall__(self, request):
+        if not self.should_profile(request):
+            return await self.get_response(request)
+
+        trace = []
+        token = current_trace.set(trace)
+        profiler = start_profiler()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            stop_profiler(profiler)
+            current_trace.reset(token)
+        write_dump(request, response.status_code, time.perf_counter() - start, profiler, trace)
+        return response
+
+    @staticmethod
+    def should_profile(request):
+        config = profiling_config()
+        if not config.get('DIR'):
+            return False
+        return random.random() < config.get('SAMPLE_RATE', 0) or is_triggered(request)
+
+
+def start_profiler():
+    if getattr(local, 'profiler', None) is not None:
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # another profiler is active (sys.monitoring is process wide since Python 3.12)
+        return None
+    local.profiler = profiler
+    return profiler
+
+
+def stop_profiler(profiler):
+    if profiler is not None:
+        profiler.disable()
+        local.profiler = None
+
+
+def write_dump(request, status_code, elapsed, profiler, trace):
+    directory = Path(profiling_config()['DIR'])
+    directory.mkdir(parents=True, exist_ok=True)
+    stem = '{time}-{pid}-{n}'.format(time=int(time.time() * 1000), pid=os.getpid(), n=next(dump_counter))
+    if profiler is not None:
+        profiler.dump_stats(directory / '{stem}.prof'.format(stem=stem))
+
+    repeated = {}
+    for sql, duration in trace:
+        count, total = repeated.get(sql, (0, 0))
+        repeated[sql] = (count + 1, total + duration)
+    match = getattr(request, 'resolver_match', None)
+    dump = {
+        'method': request.method,
+        'path': request.path,
+        'route': match.route if match else 'unmatched',
+        'status': status_code,
+        'elapsed': elapsed,
+        'profiled': profiler is not None,
+        'query_time': sum(duration for _, duration in trace),
+        'queries': [{'sql': sql, 'time': duration} for sql, duration in trace],
+        'duplicates': sorted(
+            ({'sql': sql, 'count': count, 'time': total} for sql, (count, total) in repeated.items() if count > 1),
+            key=lambda duplicate: -duplicate['count']),
+    }
+    (directory / '{stem}.json'.format(stem=stem)).write_text(json.dumps(dump, indent=1))
+    rotate(directory, profiling_config().get('MAX_FILES', 200))
+
+
+def rotate(directory, max_files):
+    """
+        Delete the dumps of all but the newest max_files requests.
+    """
+    dumps = sorted(directory.glob('*.json'), key=lambda path: path.name)
+    for path in dumps[:max(len(dumps) - max_files, 0)]:
+        for old in (path, path.with_suffix('.prof')):
+            try:
+                old.unlink()
+            except FileNotFoundError:
+                # removed by another worker
+                continue
+
+
+def load_dumps(directory):
+    """
+        Return:
+            [(trace dict, path of the .prof file or None)] of the requests in directory
+    """
+    dumps = []
+    for path in sorted(Path(directory).glob('*.json')):
+        try:
+            dump = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        prof = path.with_suffix('.prof')
+        dumps.append((dump, prof if prof.exists() else None))
+    return dumps
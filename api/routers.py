@@ -0,0 +1,131 @@
+import contextvars
+import random
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.http import Http404
+
+from tables.venues import is_venue, venue, venue_database
+
+# apps whose models live in the shard of a venue; the outbox and idempotency keys
+# commit in the same transactions as the reservations
+VENUE_APPS = {'tables', 'api'}
+
+# set while a view marked with reads_from_replica runs
+replica_reads = contextvars.ContextVar('replica_reads', default=False)
+
+
+def replica_config():
+    return getattr(settings, 'DATABASE_REPLICAS', {})
+
+
+def replicas_of(alias):
+    return replica_config().get('ALIASES', {}).get(alias, ())
+
+
+class ReplicaRouter:
+    """
+        Send reads of views marked with reads_from_replica to a random replica of the
+        primary, settings.DATABASE_REPLICAS['ALIASES'] maps primaries to their replicas.
+
+        Reads inside a transaction on the primary stay there, so the availability
+        check of a booking always sees the latest committed rows.
+    """
+    def db_for_read(self, model, **hints):
+        primary = self.db_for_write(model, **hints)
+        aliases = replicas_of(primary)
+        if not aliases or not replica_reads.get() or connections[primary].in_atomic_block:
+            return primary
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas receive the schema from the primary
+        return not any(db in aliases for aliases in replica_config().get('ALIASES', {}).values())
+
+
+class VenueRouter(ReplicaRouter):
+    """
+        ReplicaRouter with the models of VENUE_APPS on the shard of the current venue
+        (tables.venues.venue_database), everything else on the default database.
+    """
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label in VENUE_APPS:
+            return venue_database()
+        return DEFAULT_DB_ALIAS
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if not super().allow_migrate(db, app_label, model_name, **hints):
+            return False
+        return db == DEFAULT_DB_ALIAS or app_label in VENUE_APPS
+
+
+def pinned_to_primary(request):
+    """
+        Read-your-writes: a client which wrote recently carries the pin cookie,
+        set by api.middleware.ReplicaPinningMiddleware, and reads from the primary meanwhile.
+    """
+    return replica_config().get('COOKIE', 'pin_primary') in request.COOKIES
+
+
+def reads_from_replica(view):
+    """
+        Let the view's reads go to a replica, unless the client is pinned to the primary.
+        Wraps sync and async views; use method_decorator on class based views.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            token = replica_reads.set(not pinned_to_primary(request))
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                replica_reads.reset(token)
+    else:
+        @wraps(view)
+        def inner(request, *args, **kwargs):
+            token = replica_reads.set(not pinned_to_primary(request))
+            try:
+                return view(request, *args, **kwargs)
+            finally:
+                replica_reads.reset(token)
+    return inner
+
+
+def for_venue(view):
+    """
+        Serve the view under a venue prefix: the venue URL argument is taken out of
+        the view's kwargs and selects the venue, and with it the shard, meanwhile.
+        Wraps sync and async views.
+    """
+    def enter(kwargs):
+        name = kwargs.pop('venue')
+        if not is_venue(name):
+            raise Http404
+        return venue.set(name)
+
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            token = enter(kwargs)
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                venue.reset(token)
+    else:
+        @wraps(view)
+        def inner(request, *args, **kwargs):
+            token = enter(kwargs)
+            try:
+                return view(request, *args, **kwargs)
+            finally:
+                venue.reset(token)
+    return inner
@@ -1,3 +1,923 @@
-from django.test import TestCase
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+import json
+from io import StringIO
+from pathlib import Path
+import sqlite3
+import tempfile
+import time
 
-# Create your tests here.
+from django.conf import settings
+from django.core import mail
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.http import HttpResponse
+from asgiref.sync import sync_to_async
+from django.test import AsyncClient, Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from api.emails import queue_email, send_queued_emails
+from api.middleware import ConcurrencyLimitMiddleware
+from api.profiling import trigger_header
+from api.throttling import IN_FLIGHT_STALE_AFTER
+from api.routers import VenueRouter, reads_from_replica
+from api.views import AvailableTablesView
+from api.models import OutboxEmail
+from tables.models import FrozenVenue, OccupancyRollup, Reservation, ReservationSeries, Table
+from tables.pubsub import broker
+from tables.venues import using_venue
+
+
+@override_settings(THROTTLING={})
+class ConcurrentBookingTest(TransactionTestCase):
+    def setUp(self):
+        self.tables = [Table.objects.create(number=n, min_number_of_seats=1, max_number_of_seats=4) for n in range(1, 21)]
+
+    def book(self, table_number, **headers):
+        try:
+            return Client(headers=headers).post('/reservations/', {
+                'date': '2030-10-19 16:00:00.000',
+                'duration': '2',
+                'tableNumber': str(table_number) if table_number else '',
+                'fullName': 'Paul Smith',
+                'phone': '997 123 997',
+                'email': 'paul@email.com',
+                'numberOfSeats': '2',
+            }, content_type='application/json').status_code
+        finally:
+            connection.close()
+
+    def test_same_slot_is_booked_once(self):
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            codes = list(executor.map(self.book, [1] * 300))
+
+        self.assertEqual(codes.count(201), 1)
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    def test_different_tables_are_booked_in_parallel(self):
+        with ThreadPoolExecutor(max_workers=20) as executor:
+            codes = list(executor.map(self.book, [table.number for table in self.tables]))
+
+        self.assertEqual(codes, [201] * len(self.tables))
+        self.assertEqual(Reservation.objects.count(), len(self.tables))
+
+    def test_retries_with_idempotency_key_book_once(self):
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            codes = list(executor.map(lambda _: self.book(None, idempotency_key='booking-1'), range(50)))
+
+        self.assertEqual(codes, [201] * 50)
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    def test_assigned_tables_do_not_collide(self):
+        with ThreadPoolExecutor(max_workers=20) as executor:
+            codes = list(executor.map(self.book, [None] * (len(self.tables) + 5)))
+
+        self.assertEqual(codes.count(201), len(self.tables))
+        self.assertEqual(codes.count(409), 5)
+        self.assertEqual(Reservation.objects.values('table').distinct().count(), len(self.tables))
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', THROTTLING={})
+class EmailOutboxTest(TestCase):
+    def setUp(self):
+        Table.objects.create(number=1, min_number_of_seats=1, max_number_of_seats=4)
+
+    def test_confirmation_is_sent_by_worker(self):
+        response = Client().post('/reservations/', {
+            'date': '2030-10-19 16:00:00.000',
+            'duration': '2',
+            'tableNumber': '1',
+            'fullName': 'Paul Smith',
+            'phone': '997 123 997',
+            'email': 'paul@email.com',
+            'numberOfSeats': '2',
+        }, content_type='application/json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(mail.outbox), 0)
+        call_command('send_queued_emails', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['paul@email.com'])
+        self.assertIsNotNone(OutboxEmail.objects.get().sent)
+
+    def test_retried_cancellation_request_sends_one_code(self):
+        reservation = Reservation.objects.create(
+            table=Table.objects.get(number=1), date=timezone.make_aware(datetime(2030, 10, 19, 16)), duration=2,
+            full_name='Paul Smith', phone='997 123 997', email='paul@email.com', number_of_seats=2)
+        url = '/reservations/{id}'.format(id=reservation.id)
+        client = Client(headers={'idempotency-key': 'cancel-1'})
+
+        first = client.put(url, {'status': 'requested cancellation'}, content_type='application/json')
+        code = Reservation.objects.get(id=reservation.id).verification_code
+        retry = client.put(url, {'status': 'requested cancellation'}, content_type='application/json')
+
+        self.assertEqual((first.status_code, retry.status_code), (200, 200))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Reservation.objects.get(id=reservation.id).verification_code, code)
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+        other = client.put(url, {'status': 'something else'}, content_type='application/json')
+        self.assertEqual(other.status_code, 422)
+
+    def test_failed_email_is_retried_later(self):
+        queue_email("Subject", "Message", ['paul@email.com'])
+
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend', EMAIL_HOST='localhost', EMAIL_PORT=1):
+            self.assertEqual(send_queued_emails(), (0, 1))
+        email = OutboxEmail.objects.get()
+        self.assertIsNone(email.sent)
+        self.assertEqual(email.attempts, 1)
+        self.assertGreater(email.next_attempt, timezone.now())
+
+        self.assertEqual(send_queued_emails(), (0, 0))
+
+
+@override_settings(THROTTLING={})
+class ReservationPagesTest(TestCase):
+    query = {'start_date': '2030-10-19 00:00:00.000'}
+
+    def setUp(self):
+        tables = [Table.objects.create(number=n, min_number_of_seats=1, max_number_of_seats=4) for n in (1, 2, 3)]
+        for i in range(8):
+            # three bookings at each hour, the id breaks the tie
+            Reservation.objects.create(
+                table=tables[i % 3], date=timezone.make_aware(datetime(2030, 10, 19, 12 + i // 3)), duration=1,
+                full_name='Paul Smith', phone='997', email='paul@email.com', number_of_seats=2)
+
+    def test_pages_follow_the_list(self):
+        everything = Client().get('/reservations/', self.query).json()
+        self.assertEqual(len(everything), 8)
+
+        paged, cursor = [], None
+        while True:
+            page = Client().get('/reservations/', dict(self.query, limit=2, **({'cursor': cursor} if cursor else {}))).json()
+            paged += page['results']
+            cursor = page['next']
+            if cursor is None:
+                break
+            # a booking before the cursor does not shift the following pages
+            Reservation.objects.create(
+                table=Table.objects.get(number=1), date=timezone.make_aware(datetime(2030, 10, 19, 8)), duration=1,
+                full_name='Paul Smith', phone='997', email='paul@email.com', number_of_seats=2)
+        self.assertEqual(paged, everything)
+
+        self.assertEqual(Client().get('/reservations/', dict(self.query, cursor='not a cursor')).status_code, 400)
+        self.assertEqual(Client().get('/reservations/', dict(self.query, limit=0)).status_code, 400)
+
+    def test_stream_has_the_bytes_of_the_list(self):
+        response = Client().get('/reservations/', dict(self.query, stream=1))
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.streaming_content), Client().get('/reservations/', self.query).content)
+
+
+@override_settings(THROTTLING={})
+class AvailabilityMatrixTest(TestCase):
+    def setUp(self):
+        tables = [Table.objects.create(number=n, min_number_of_seats=1, max_number_of_seats=4) for n in (1, 2, 3)]
+        Table.objects.create(number=4, min_number_of_seats=6, max_number_of_seats=8)
+        for table, hour, duration in [(tables[0], 12, 2), (tables[1], 13, 3), (tables[0], 23, 3), (tables[2], 18, 1)]:
+            Reservation.objects.create(
+                table=table, date=timezone.make_aware(datetime(2030, 10, 18, hour)), duration=duration,
+                full_name='Paul Smith', phone='997', email='paul@email.com', number_of_seats=2)
+
+    def test_every_slot_matches_the_single_time_search(self):
+        response = Client().get('/tables/matrix', {
+            'min_seats': 2, 'duration': 2, 'slot': 20,
+            'start_date': '2030-10-18 10:00:00.000', 'end_date': '2030-10-19 02:00:00.000'})
+        self.assertEqual(len(response.data), 48)
+        for row in response.data:
+            start_date = datetime.fromisoformat(row['start'].replace('Z', '+00:00'))
+            expected = AvailableTablesView.get_available_tables(2, start_date, 2, use_index=False)
+            self.assertEqual(row['tables'], sorted(table.number for table in expected), row['start'])
+
+    def test_too_fine_or_too_long_matrix_is_refused(self):
+        query = {'min_seats': 2, 'duration': 2, 'start_date': '2030-10-18 00:00:00.000'}
+        self.assertEqual(Client().get('/tables/matrix', dict(query, slot=1)).status_code, 400)
+        self.assertEqual(Client().get('/tables/matrix', dict(query, end_date='2030-10-26 00:00:00.000')).status_code, 400)
+        self.assertEqual(Client().get('/tables/matrix', dict(query, end_date='2030-10-17 00:00:00.000')).status_code, 400)
+
+
+@override_settings(THROTTLING={})
+class FastSerializersTest(TestCase):
+    def setUp(self):
+        tables = [Table.objects.create(number=n, min_number_of_seats=1, max_number_of_seats=2 * n) for n in (1, 2, 3)]
+        for i, name in enumerate(['Paul Smith', 'Zoë Łukasiewicz', 'Anna "Ania" Nowak']):
+            Reservation.objects.create(
+                table=tables[i], date=timezone.make_aware(datetime(2030, 10, 19, 12 + i, 15, 30, 123456)), duration=1 + i,
+                full_name=name, phone='997 123 997', email='guest{i}@email.com'.format(i=i), number_of_seats=2)
+
+    def test_fast_serializers_send_the_same_bytes(self):
+        requests = [
+            ('/reservations/', {'start_date': '2030-10-19 00:00:00.000'}),
+            ('/reservations/', {'start_date': '2030-10-19 00:00:00.000', 'limit': 2}),
+            ('/reservations/', {'start_date': '2030-10-19 00:00:00.000', 'stream': 1}),
+            ('/tables/', {'min_seats': 2, 'start_date': '2030-10-19 12:00:00.000', 'duration': 2, 'status': 'free'}),
+        ]
+
+        def content(url, query):
+            response = Client().get(url, query)
+            return b''.join(response.streaming_content) if response.streaming else response.content
+
+        for time_zone in ('UTC', 'Europe/Warsaw'):
+            for url, query in requests:
+                with self.settings(TIME_ZONE=time_zone, FAST_SERIALIZERS=False):
+                    expected = content(url, query)
+                with self.settings(TIME_ZONE=time_zone, FAST_SERIALIZERS=True):
+                    self.assertEqual(content(url, query), expected, (time_zone, url, query))
+
+
+@override_settings(THROTTLING={})
+class ConditionalGetTest(TestCase):
+    query = {'min_seats': 2, 'start_date': '2030-10-19 12:00:00.000', 'duration': 2, 'status': 'free'}
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Table.objects.create(number=1, min_number_of_seats=1, max_number_of_seats=4)
+
+    def book(self, date):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Client().post('/reservations/', {
+                'date': date, 'duration': '2', 'fullName': 'Paul Smith', 'phone': '997 123 997',
+                'email': 'paul@email.com', 'numberOfSeats': '2', 'tableNumber': '1',
+            }, content_type='application/json')
+
+    def test_unchanged_tables_are_not_sent_again(self):
+        response = Client().get('/tables/', self.query)
+        etag, modified = response['ETag'], response['Last-Modified']
+        self.assertEqual([table['number'] for table in response.json()], [1])
+
+        self.assertEqual(Client().get('/tables/', self.query, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(Client().get('/tables/', self.query, HTTP_IF_MODIFIED_SINCE=modified).status_code, 304)
+
+        # a booking on another day leaves the answer as it was
+        self.assertEqual(self.book('2030-10-21 12:00:00.000').status_code, 201)
+        self.assertEqual(Client().get('/tables/', self.query, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.assertEqual(self.book('2030-10-19 13:00:00.000').status_code, 201)
+        response = Client().get('/tables/', self.query, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.json()), (200, []))
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(Client().get('/tables/', self.query, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+@override_settings(THROTTLING={})
+class MetricsTest(TestCase):
+    def setUp(self):
+        Table.objects.create(number=1, min_number_of_seats=1, max_number_of_seats=4)
+
+    def scrape(self):
+        response = Client().get('/metrics')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4')
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_requests_are_counted_by_route(self):
+        requests = 'http_requests_total{route="tables/",method="GET",status="200"}'
+        queries = 'db_queries_total{route="tables/",method="GET"}'
+        serialization = 'serialization_seconds_count{route="tables/",method="GET"}'
+        before = self.scrape()
+        for _ in range(3):
+            Client().get('/tables/', {'min_seats': 2, 'start_date': '2030-10-19 12:00:00.000', 'duration': 2, 'status': 'free'})
+        Client().get('/tables/', {'min_seats': 'two'})
+        after = self.scrape()
+
+        self.assertEqual(after[requests] - before.get(requests, 0), 3)
+        self.assertEqual(after['http_requests_total{route="tables/",method="GET",status="400"}']
+            - before.get('http_requests_total{route="tables/",method="GET",status="400"}', 0), 1)
+        self.assertGreaterEqual(after[queries] - before.get(queries, 0), 3)
+        # the empty body of the 400 is rendered as well
+        self.assertEqual(after[serialization] - before.get(serialization, 0), 4)
+        self.assertIn('availability_index_hits', after)
+
+    def test_every_worker_answers_for_all_of_them(self):
+        with tempfile.TemporaryDirectory() as directory, self.settings(METRICS={'ENABLED': True, 'DIR': directory, 'FLUSH_INTERVAL': 0}):
+            # the dump of another worker process
+            Path(directory, 'metrics-1.json').write_text(json.dumps({
+                'counters': [['http_requests_total', [['route', 'metrics'], ['method', 'GET'], ['status', 200]], 40]],
+                'histograms': [],
+            }))
+            before = self.scrape()
+            after = self.scrape()
+            # this process dumped its own counters next to it
+            self.assertEqual(len(list(Path(directory).glob('metrics-*.json'))), 2)
+        key = 'http_requests_total{route="metrics",method="GET",status="200"}'
+        self.assertEqual(after[key] - before[key], 1)
+        self.assertGreaterEqual(before[key], 40)
+
+
+@override_settings(THROTTLING={})
+class AsyncViewsTest(TransactionTestCase):
+    # the stream picks its database outside the thread of the ORM and reads from the replica,
+    # which sees committed rows only
+    databases = {'default', 'replica'}
+    requests = [
+        ('/tables/', {'min_seats': 2, 'start_date': '2030-10-19 12:00:00.000', 'duration': 2, 'status': 'free'}),
+        ('/reservations/', {'start_date': '2030-10-19 00:00:00.000'}),
+        ('/reservations/', {'start_date': '2030-10-19 00:00:00.000', 'limit': 1}),
+        ('/reservations/', {'start_date': '2030-10-19 00:00:00.000', 'stream': 1}),
+    ]
+
+    def setUp(self):
+        tables = [Table.objects.create(number=n, min_number_of_seats=1, max_number_of_seats=4) for n in (1, 2)]
+        for table, hour in [(tables[0], 12), (tables[1], 18)]:
+            Reservation.objects.create(
+                table=table, date=timezone.make_aware(datetime(2030, 10, 19, hour)), duration=2,
+                full_name='Paul Smith', phone='997', email='paul@email.com', number_of_seats=2)
+
+    @staticmethod
+    def sync_get(url, query):
+        response = Client().get(url, query)
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        return content, response.get('ETag')
+
+    async def test_async_views_answer_like_the_sync_ones(self):
+        client = AsyncClient()
+        for url, query in self.requests:
+            content, etag = await sync_to_async(self.sync_get)(url, query)
+            response = await client.get(url, query)
+            self.assertTrue(response.resolver_match.func.view_class.__name__.startswith('Async'), url)
+            self.assertEqual(response.status_code, 200)
+            if response.streaming:
+                self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), content)
+            else:
+                self.assertEqual((response.content, response['ETag']), (content, etag), query)
+                self.assertEqual((await client.get(url, query, headers={'If-None-Match': response['ETag']})).status_code, 304)
+
+        self.assertEqual((await client.get('/tables/', {'min_seats': 'two'})).status_code, 400)
+
+    async def test_bookings_go_through_the_sync_view(self):
+        response = await AsyncClient().post('/reservations/', {
+            'date': '2030-10-19 15:00:00.000', 'duration': '2', 'fullName': 'Paul Smith', 'phone': '997 123 997',
+            'email': 'paul@email.com', 'numberOfSeats': '2', 'tableNumber': '1',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(await Reservation.objects.filter(table__number=1).acount(), 2)
+
+
+@override_settings(THROTTLING={})
+class TableAssignmentTest(TestCase):
+    def setUp(self):
+        for number, max_seats in [(1, 8), (2, 4), (3, 4)]:
+            Table.objects.create(number=number, min_number_of_seats=1, max_number_of_seats=max_seats)
+        Reservation.objects.create(
+            table=Table.objects.get(number=3), date=timezone.make_aware(datetime(2030, 10, 19, 12)), duration=2,
+            full_name='Paul Smith', phone='997 123 997', email='paul@email.com', number_of_seats=2)
+
+    def book(self, hour):
+        return Client().post('/reservations/', {
+            'date': '2030-10-19 {hour}:00:00.000'.format(hour=hour),
+            'duration': '2',
+            'fullName': 'Paul Smith',
+            'phone': '997 123 997',
+            'email': 'paul@email.com',
+            'numberOfSeats': '3',
+        }, content_type='application/json')
+
+    def test_smallest_table_next_to_a_booking_is_picked(self):
+        # table 3 is free an hour after its booking, table 1 has spare seats
+        self.assertEqual(self.book(15).data, {'tableNumber': 3})
+        self.assertEqual(self.book(15).data, {'tableNumber': 2})
+        self.assertEqual(self.book(15).data, {'tableNumber': 1})
+        self.assertEqual(self.book(15).status_code, 409)
+
+
+@override_settings(THROTTLING={})
+class CombinedTablesTest(TestCase):
+    def setUp(self):
+        for number, max_seats in [(1, 4), (2, 6), (3, 6), (4, 8)]:
+            Table.objects.create(number=number, min_number_of_seats=1, max_number_of_seats=max_seats, join_group='hall')
+        Table.objects.create(number=5, min_number_of_seats=1, max_number_of_seats=10)
+
+    def book(self, **data):
+        return Client().post('/reservations/', dict({
+            'date': '2030-10-19 19:00:00.000',
+            'duration': '2',
+            'fullName': 'Paul Smith',
+            'phone': '997 123 997',
+            'email': 'paul@email.com',
+            'numberOfSeats': '12',
+        }, **data), content_type='application/json')
+
+    def test_party_gets_smallest_combination(self):
+        response = Client().get('/tables/combinations', {'min_seats': 12, 'start_date': '2030-10-19 19:00:00.000', 'duration': 2})
+        self.assertEqual(response.data, [{'tables': [1, 4], 'seats': 12}])
+
+        self.assertEqual(self.book().data, {'tableNumbers': [1, 4]})
+        self.assertEqual(self.book().data, {'tableNumbers': [2, 3]})
+        self.assertEqual(self.book().status_code, 409)
+
+    def test_combined_booking_is_cancelled_as_whole(self):
+        self.assertEqual(self.book(tableNumbers=[1, 4]).status_code, 201)
+        self.assertEqual(self.book(tableNumbers=[4, 5]).status_code, 409)
+        secondary = Reservation.objects.get(combined_with__isnull=False)
+        self.assertEqual((secondary.table.number, secondary.number_of_seats), (4, 8))
+
+        Client().put('/reservations/{id}'.format(id=secondary.id), {'status': 'requested cancellation'}, content_type='application/json')
+        code = Reservation.objects.get(combined_with__isnull=True).verification_code
+        Client().delete('/reservations/{id}'.format(id=secondary.id), {'verification_code': code}, content_type='application/json')
+        self.assertFalse(Reservation.objects.exists())
+
+
+class ReplicaRoutingTest(SimpleTestCase):
+    def read_from(self, **cookies):
+        @reads_from_replica
+        def view(request):
+            return HttpResponse(VenueRouter().db_for_read(Reservation))
+
+        request = RequestFactory().get('/reservations/')
+        request.COOKIES.update(cookies)
+        return view(request).content.decode()
+
+    def test_marked_views_read_from_a_replica_unless_pinned(self):
+        self.assertEqual(VenueRouter().db_for_read(Reservation), 'default')
+        self.assertEqual(self.read_from(), 'replica')
+        self.assertEqual(self.read_from(pin_primary='1'), 'default')
+        with self.settings(DATABASE_REPLICAS={}):
+            self.assertEqual(self.read_from(), 'default')
+
+
+@override_settings(THROTTLING={})
+class ReplicaPinningTest(TestCase):
+    def setUp(self):
+        Table.objects.create(number=1, min_number_of_seats=1, max_number_of_seats=4)
+
+    def book(self, client):
+        return client.post('/reservations/', {
+            'date': '2030-10-19 12:00:00.000', 'duration': '2', 'fullName': 'Paul Smith', 'phone': '997 123 997',
+            'email': 'paul@email.com', 'numberOfSeats': '2', 'tableNumber': '1',
+        }, content_type='application/json')
+
+    def test_writers_are_pinned_to_the_primary(self):
+        client = Client()
+        response = client.get('/reservations/', {'start_date': '2030-10-19 00:00:00.000'})
+        self.assertNotIn('pin_primary', response.cookies)
+
+        response = self.book(client)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.cookies['pin_primary']['max-age'], settings.DATABASE_REPLICAS['PIN_SECONDS'])
+
+        # a refused write changed nothing to read back
+        response = self.book(Client())
+        self.assertEqual(response.status_code, 409)
+        self.assertNotIn('pin_primary', response.cookies)
+
+
+@override_settings(THROTTLING={})
+class AvailabilityEventsTest(TransactionTestCase):
+    def setUp(self):
+        self.table = Table.objects.create(number=7, min_number_of_seats=1, max_number_of_seats=4)
+
+    async def subscribe(self, client, min_seats):
+        response = await client.get('/tables/events', {'min_seats': min_seats, 'start_date': '2030-10-19 00:00:00.000'})
+        stream = aiter(response.streaming_content)
+        self.assertIn(b'event: ready', await anext(stream))
+        return stream
+
+    async def test_booking_reaches_hundreds_of_subscribers(self):
+        client = AsyncClient()
+        fitting = await asyncio.gather(*(self.subscribe(client, 2) for _ in range(300)))
+        too_small = await asyncio.gather(*(self.subscribe(client, 10) for _ in range(20)))
+        self.assertEqual(broker.stats()['subscribers'], 320)
+
+        reservation = await sync_to_async(Reservation.objects.create)(
+            table=self.table, date=timezone.make_aware(datetime(2030, 10, 19, 18)), duration=2,
+            full_name='Paul Smith', phone='997 123 997', email='paul@email.com', number_of_seats=2)
+        events = await asyncio.wait_for(asyncio.gather(*(anext(stream) for stream in fitting)), 10)
+        self.assertEqual(set(events), {
+            b'event: booked\ndata: {"table":7,"start":"2030-10-19T18:00:00Z","end":"2030-10-19T20:00:00Z"}\n\n'})
+
+        await sync_to_async(reservation.delete)()
+        events = await asyncio.wait_for(asyncio.gather(*(anext(stream) for stream in fitting)), 10)
+        self.assertTrue(all(event.startswith(b'event: freed') for event in events))
+
+        # nothing else was sent, not even to the subscribers whose party the table does not fit
+        pending = [asyncio.ensure_future(anext(stream)) for stream in fitting + too_small]
+        await asyncio.sleep(0.1)
+        self.assertFalse(any(task.done() for task in pending))
+        # the ASGI handler cancels the response on disconnect
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self.assertEqual(broker.stats()['subscribers'], 0)
+
+
+@override_settings(THROTTLING={})
+class ExportTest(TestCase):
+    def setUp(self):
+        table = Table.objects.create(number=1, min_number_of_seats=1, max_number_of_seats=4)
+        start = timezone.make_aware(datetime(2030, 10, 19, 12))
+        for day in range(3):
+            for hour in range(0, 9, 3):
+                Reservation.objects.create(
+                    table=table, date=start + timedelta(days=day, hours=hour), duration=2,
+                    full_name='Paul Smith', phone='997 123 997', email='paul@email.com', number_of_seats=2)
+
+    def export(self, **params):
+        response = Client().get('/reservations/export', dict({
+            'start_date': '2030-10-19 00:00:00.000', 'end_date': '2030-10-21 00:00:00.000'}, **params))
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_csv_covers_range(self):
+        response, body = self.export(format='csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        lines = body.splitlines()
+        self.assertEqual(lines[0], 'id,table,date,duration,full_name,phone,email,number_of_seats,cursor')
+        self.assertEqual(len(lines), 1 + 6)
+
+    def test_ndjson_resumes_from_cursor(self):
+        _, body = self.export(format='ndjson')
+        rows = [json.loads(line) for line in body.splitlines()]
+        _, rest = self.export(format='ndjson', cursor=rows[3]['cursor'])
+        self.assertEqual([json.loads(line)['id'] for line in rest.splitlines()], [row['id'] for row in rows[4:]])
+
+
+@override_settings(THROTTLING={})
+class BatchReservationTest(TestCase):
+    def setUp(self):
+        Table.objects.create(number=1, min_number_of_seats=1, max_number_of_seats=4)
+        Table.objects.create(number=2, min_number_of_seats=1, max_number_of_seats=4)
+        Reservation.objects.create(table=Table.objects.get(number=2), date=datetime(2030, 10, 19, 17), duration=2,
+                                   full_name='Anna Smith', phone='997', email='anna@email.com', number_of_seats=2)
+
+    def item(self, table_number, date, **kwargs):
+        return dict({
+            'date': date,
+            'duration': '2',
+            'tableNumber': str(table_number),
+            'fullName': 'Paul Smith',
+            'phone': '997 123 997',
+            'email': 'paul@email.com',
+            'numberOfSeats': '2',
+        }, **kwargs)
+
+    def test_batch_reports_result_per_item(self):
+        response = Client().post('/reservations/', [
+            self.item(1, '2030-10-19 16:00:00.000'),
+            self.item(1, '2030-10-19 17:00:00.000'),
+            self.item(2, '2030-10-19 16:00:00.000'),
+            self.item(1, '2030-10-19 20:00:00.000', numberOfSeats='6'),
+            self.item(1, 'tomorrow'),
+            self.item(3, '2030-10-19 16:00:00.000'),
+        ], content_type='application/json')
+
+        self.assertEqual(response.status_code, 207)
+        statuses = [result['status'] for result in response.json()]
+        self.assertEqual(statuses, ['created', 'conflict', 'conflict', 'conflict', 'invalid', 'invalid'])
+        self.assertEqual(Reservation.objects.count(), 2)
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+
+
+@override_settings(THROTTLING={})
+class IdempotencyTest(TestCase):
+    def setUp(self):
+        Table.objects.create(number=1, min_number_of_seats=1, max_number_of_seats=4)
+
+    def book(self, address):
+        return Client(headers={'idempotency-key': 'booking-1'}, REMOTE_ADDR=address).post('/reservations/', {
+            'date': '2030-10-19 16:00:00.000', 'duration': '2', 'tableNumber': '1', 'fullName': 'Paul Smith',
+            'phone': '997 123 997', 'email': 'paul@email.com', 'numberOfSeats': '2',
+        }, content_type='application/json')
+
+    def test_key_of_another_client_is_not_replayed(self):
+        first = self.book('10.0.0.1')
+        retry = self.book('10.0.0.1')
+        other = self.book('10.0.0.2')
+
+        self.assertEqual((first.status_code, retry.status_code, retry['Idempotent-Replayed']), (201, 201, 'true'))
+        # the other client's request runs and finds the table taken
+        self.assertEqual(other.status_code, 409)
+        self.assertNotIn('Idempotent-Replayed', other)
+        self.assertEqual(Reservation.objects.count(), 1)
+
+
+class ThrottleTest(TestCase):
+    def setUp(self):
+        Table.objects.create(number=1, min_number_of_seats=1, max_number_of_seats=4)
+        path = Path(self.enterContext(tempfile.TemporaryDirectory())) / 'throttling.sqlite3'
+        self.enterContext(self.settings(THROTTLING={'PATH': path, 'RATES': {'tables': (0.1, 3)}}))
+
+    def get_tables(self, client_address):
+        return Client(REMOTE_ADDR=client_address).get(
+            '/tables/', {'min_seats': 2, 'start_date': '2030-10-19 16:00:00.000', 'duration': 2, 'status': 'free'})
+
+    def test_burst_over_capacity_is_throttled_per_client(self):
+        codes = [self.get_tables('10.0.0.1').status_code for _ in range(3)]
+        throttled = self.get_tables('10.0.0.1')
+
+        self.assertEqual(codes, [200] * 3)
+        self.assertEqual(throttled.status_code, 429)
+        self.assertEqual(int(throttled['Retry-After']), 10)
+        self.assertEqual(self.get_tables('10.0.0.2').status_code, 200)
+
+    def test_forwarded_for_header_does_not_pick_the_bucket(self):
+        codes = [
+            Client(REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='192.0.2.{n}'.format(n=n)).get('/tables/', {
+                'min_seats': 2, 'start_date': '2030-10-19 16:00:00.000', 'duration': 2, 'status': 'free'}).status_code
+            for n in range(4)
+        ]
+        self.assertEqual(codes, [200] * 3 + [429])
+
+    def test_no_shows_do_not_take_cancellation_tokens(self):
+        reservation = Reservation.objects.create(
+            table=Table.objects.get(number=1), date=timezone.make_aware(datetime(2021, 10, 19, 18)), duration=2,
+            full_name='Paul Smith', phone='997', email='paul@email.com', number_of_seats=2)
+        url = '/reservations/{id}'.format(id=reservation.id)
+        with self.settings(THROTTLING=dict(settings.THROTTLING, RATES={'cancel.put': (0.1, 3), 'cancel': (0.1, 1)})):
+            codes = [Client().put(url, {'status': 'no show'}, content_type='application/json').status_code for _ in range(3)]
+            cancel = Client().delete(url, {'verification_code': 1}, content_type='application/json')
+
+        self.assertEqual(codes, [200] * 3)
+        self.assertEqual(cancel.status_code, 401)
+
+    @override_settings(ALLOWED_HOSTS=['localhost'])
+    def test_benchmark_times_the_endpoints_not_the_throttle(self):
+        output = StringIO()
+        call_command('benchmark', iterations=10, stdout=output)
+        self.assertIn('GET /tables', output.getvalue())
+
+    def in_flight(self):
+        with closing(sqlite3.connect(settings.THROTTLING['PATH'])) as store:
+            return store.execute('SELECT process, requests FROM in_flight').fetchall()
+
+    def test_requests_over_concurrency_limit_are_shed(self):
+        nested = []
+
+        def get_response(request):
+            nested.append(middleware(request))
+            return HttpResponse()
+
+        middleware = ConcurrencyLimitMiddleware(get_response)
+        with self.settings(THROTTLING=dict(settings.THROTTLING, MAX_CONCURRENT_REQUESTS=1)):
+            response = middleware(RequestFactory().get('/tables'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(nested[0].status_code, 503)
+        self.assertEqual(nested[0]['Retry-After'], '1')
+        self.assertEqual([requests for _, requests in self.in_flight()], [0])
+
+    def test_concurrency_limit_counts_every_worker(self):
+        middleware = ConcurrencyLimitMiddleware(lambda request: HttpResponse())
+        with self.settings(THROTTLING=dict(settings.THROTTLING, MAX_CONCURRENT_REQUESTS=2)):
+            self.assertEqual(middleware(RequestFactory().get('/tables')).status_code, 200)
+            # two requests in flight in other worker processes, one of them gone quiet long ago
+            with closing(sqlite3.connect(settings.THROTTLING['PATH'])) as store, store:
+                store.executemany('INSERT INTO in_flight VALUES (?, ?, ?)', [
+                    ('1:worker', 2, time.time()), ('2:worker', 5, time.time() - IN_FLIGHT_STALE_AFTER - 1)])
+            self.assertEqual(middleware(RequestFactory().get('/tables')).status_code, 503)
+
+            with closing(sqlite3.connect(settings.THROTTLING['PATH'])) as store, store:
+                store.execute("UPDATE in_flight SET requests = 1 WHERE process = '1:worker'")
+            self.assertEqual(middleware(RequestFactory().get('/tables')).status_code, 200)
+
+
+@override_settings(THROTTLING={})
+class ProfilingTest(TestCase):
+    def setUp(self):
+        Table.objects.create(number=1, min_number_of_seats=1, max_number_of_seats=4)
+        self.directory = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(self.settings(PROFILING={'DIR': self.directory, 'SAMPLE_RATE': 0, 'HEADER': 'X-Profile', 'MAX_FILES': 2}))
+
+    def get_tables(self, header=None):
+        return Client(headers={'X-Profile': header} if header else {}).get(
+            '/tables/', {'min_seats': 2, 'start_date': '2030-10-19 16:00:00.000', 'duration': 2, 'status': 'free'})
+
+    def test_signed_header_writes_profile_and_sql_trace(self):
+        self.get_tables()
+        self.get_tables('profile:forged:signature')
+        self.assertEqual(list(self.directory.glob('*')), [])
+
+        self.assertEqual(self.get_tables(trigger_header()).status_code, 200)
+        trace = json.loads(next(self.directory.glob('*.json')).read_text())
+        self.assertEqual((trace['method'], trace['route'], trace['status']), ('GET', 'tables/', 200))
+        self.assertTrue(trace['queries'])
+        self.assertEqual(len(list(self.directory.glob('*.prof'))), 1)
+
+        out = StringIO()
+        call_command('profile_report', dir=str(self.directory), top=200, stdout=out)
+        self.assertIn('GET /tables/', out.getvalue())
+        self.assertIn('get_ongoing_reservations', out.getvalue())
+
+    def test_only_newest_dumps_are_kept(self):
+        for _ in range(3):
+            self.get_tables(trigger_header())
+
+        self.assertEqual(len(list(self.directory.glob('*.json'))), 2)
+        self.assertEqual(len(list(self.directory.glob('*.prof'))), 2)
+
+
+@override_settings(THROTTLING={})
+class OccupancyTest(TestCase):
+    def setUp(self):
+        self.table = Table.objects.create(number=1, min_number_of_seats=1, max_number_of_seats=4)
+
+    def reserve(self, date, **kwargs):
+        return Reservation.objects.create(**dict(
+            table=self.table, date=date, duration=2, full_name='Paul Smith', phone='997',
+            email='paul@email.com', number_of_seats=2), **kwargs)
+
+    def occupancy(self, year):
+        return Client().get('/analytics/occupancy', {
+            'start_date': '{year}-10-01 00:00:00.000'.format(year=year),
+            'end_date': '{year}-11-01 00:00:00.000'.format(year=year)}).json()
+
+    def test_rollups_follow_bookings_and_cancellations(self):
+        self.reserve(timezone.make_aware(datetime(2030, 10, 19, 16, 30)))
+        cancelled = self.reserve(timezone.make_aware(datetime(2030, 10, 20, 12)))
+
+        url = '/reservations/{id}'.format(id=cancelled.id)
+        Client().put(url, {'status': 'requested cancellation'}, content_type='application/json')
+        code = Reservation.objects.get(id=cancelled.id).verification_code
+        self.assertEqual(Client().delete(url, {'verification_code': code}, content_type='application/json').status_code, 200)
+
+        occupancy = self.occupancy(2030)
+        self.assertEqual(occupancy['seat_hours'], 4)
+        self.assertEqual((occupancy['bookings'], occupancy['cancellations'], occupancy['cancellation_rate']), (2, 1, 0.5))
+        heatmap = {(cell['weekday'], cell['hour']): cell['seat_hours'] for cell in occupancy['heatmap']}
+        # Saturday 16:30-18:30, the cancelled Sunday booking counts no seat hours
+        self.assertEqual(heatmap, {(6, 16): 1, (6, 17): 2, (6, 18): 1, (7, 12): 0, (7, 13): 0})
+
+        call_command('backfill_occupancy', stdout=StringIO())
+        self.assertEqual(self.occupancy(2030), occupancy)
+
+    def test_no_shows_are_counted_once(self):
+        url = '/reservations/{id}'.format(id=self.reserve(timezone.make_aware(datetime(2021, 10, 19, 18))).id)
+        future_url = '/reservations/{id}'.format(id=self.reserve(timezone.make_aware(datetime(2030, 10, 19, 18))).id)
+
+        codes = [Client().put(url, {'status': 'no show'}, content_type='application/json').status_code for _ in range(2)]
+        self.assertEqual(codes, [200, 200])
+        self.assertEqual(Client().put(future_url, {'status': 'no show'}, content_type='application/json').status_code, 405)
+        occupancy = self.occupancy(2021)
+        self.assertEqual((occupancy['bookings'], occupancy['no_shows'], occupancy['seat_hours']), (1, 1, 4))
+
+    def test_deletes_outside_the_cancellation_flow_free_their_seat_hours(self):
+        reservation = Reservation.objects.get(id=self.reserve(timezone.make_aware(datetime(2030, 10, 19, 16))).id)
+        reservation.date = timezone.make_aware(datetime(2030, 10, 20, 16))
+        reservation.delete()
+
+        rollup = OccupancyRollup.objects.get(hour=timezone.make_aware(datetime(2030, 10, 19, 16)))
+        self.assertEqual((rollup.seat_minutes, rollup.bookings, rollup.cancellations), (0, 1, 1))
+
+        self.reserve(timezone.make_aware(datetime(2030, 10, 21, 16)))
+        self.table.delete()
+        self.assertFalse(OccupancyRollup.objects.exists())
+
+    def test_reservations_moved_between_tables_move_their_seat_hours(self):
+        other = Table.objects.create(number=2, min_number_of_seats=1, max_number_of_seats=4)
+        reservation = Reservation.objects.get(id=self.reserve(timezone.make_aware(datetime(2030, 10, 19, 16))).id)
+        reservation.table = other
+        reservation.save()
+
+        tables = {row['table']: row['seat_hours'] for row in self.occupancy(2030)['tables']}
+        self.assertEqual(tables, {1: 0, 2: 4})
+
+
+@override_settings(THROTTLING={}, VENUES={'DEFAULT': 'main', 'SHARDS': {'main': 'default', 'harbour': 'default'}})
+class VenueTest(TestCase):
+    def setUp(self):
+        Table.objects.create(number=1, min_number_of_seats=1, max_number_of_seats=4)
+        with using_venue('harbour'):
+            Table.objects.create(number=1, min_number_of_seats=1, max_number_of_seats=8)
+
+    def available(self, prefix=''):
+        response = Client().get(prefix + '/tables/', {
+            'start_date': '2030-10-19 18:00:00.000', 'duration': 2, 'min_seats': 6, 'status': 'free'})
+        return [t['number'] for t in response.json()] if response.status_code == 200 else []
+
+    def test_tables_are_scoped_to_the_venue(self):
+        self.assertEqual(self.available(), [])
+        self.assertEqual(self.available('/venues/main'), [])
+        self.assertEqual(self.available('/venues/harbour'), [1])
+        self.assertEqual(Table.objects.count(), 1)
+        self.assertEqual(Table._base_manager.count(), 2)
+
+    def test_bookings_go_to_the_venue(self):
+        response = Client().post('/venues/harbour/reservations/', {
+            'date': '2030-10-19 18:00:00.000', 'duration': '2', 'fullName': 'Paul Smith', 'phone': '997',
+            'email': 'paul@email.com', 'numberOfSeats': '6'}, content_type='application/json')
+
+        self.assertEqual(response.data, {'tableNumber': 1})
+        self.assertFalse(Reservation.objects.exists())
+        with using_venue('harbour'):
+            self.assertEqual(Reservation.objects.get().table.max_number_of_seats, 8)
+
+    def test_venue_frozen_for_a_move_is_read_only(self):
+        FrozenVenue.objects.create(venue='harbour')
+        with using_venue('harbour'):
+            queue_email("Reservation confirmation", "Table: 1", ['paul@email.com'])
+        queue_email("Reservation confirmation", "Table: 1", ['anna@email.com'])
+
+        booking = {'date': '2030-10-19 18:00:00.000', 'duration': '2', 'fullName': 'Paul Smith', 'phone': '997',
+            'email': 'paul@email.com', 'numberOfSeats': '2'}
+        frozen = Client().post('/venues/harbour/reservations/', booking, content_type='application/json')
+        self.assertEqual((frozen.status_code, frozen['Retry-After']), (503, '5'))
+        self.assertEqual(self.available('/venues/harbour'), [1])
+        self.assertEqual(Client().post('/reservations/', booking, content_type='application/json').status_code, 201)
+        # the copy in the new shard sends the frozen venue's emails
+        self.assertEqual(send_queued_emails(), (2, 0))
+        self.assertEqual(OutboxEmail.objects.filter(sent__isnull=True).get().venue, 'harbour')
+
+    @override_settings(VENUES={'DEFAULT': 'main', 'SHARDS': {'main': 'default', 'harbour': 'harbour_shard'}})
+    def test_emails_are_sent_from_the_shard_of_their_venue(self):
+        # left in default by a move of harbour, its copy is sent from harbour_shard
+        OutboxEmail.objects.create(venue='harbour', subject="Reservation confirmation", message="Table: 1",
+            from_email='noreply@email.com', recipient='paul@email.com')
+        self.assertEqual(send_queued_emails(), (0, 0))
+
+    def test_unknown_venue_is_not_found(self):
+        self.assertEqual(Client().get('/venues/nowhere/tables/').status_code, 404)
+
+    @override_settings(VENUES={'DEFAULT': 'main', 'SHARDS': {'main': 'default', 'harbour': 'harbour_shard'}})
+    def test_writes_are_routed_to_the_shard_of_the_venue(self):
+        router = VenueRouter()
+        self.assertEqual(router.db_for_write(Table), 'default')
+        with using_venue('harbour'):
+            self.assertEqual(router.db_for_write(Reservation), 'harbour_shard')
+            self.assertEqual(router.db_for_write(OutboxEmail), 'harbour_shard')
+        self.assertTrue(router.allow_migrate('harbour_shard', 'tables'))
+        self.assertFalse(router.allow_migrate('harbour_shard', 'auth'))
+
+
+@override_settings(THROTTLING={})
+class ReservationSeriesTest(TestCase):
+    def setUp(self):
+        self.tables = [Table.objects.create(number=n, min_number_of_seats=1, max_number_of_seats=4 + n) for n in (1, 2)]
+
+    def book(self, **data):
+        return Client().post('/reservations/series', dict({
+            'date': '2030-10-01 12:00:00.000', 'duration': '2', 'repeat': {'frequency': 'weekly', 'count': 13},
+            'fullName': 'Paul Smith', 'phone': '997 123 997', 'email': 'paul@email.com', 'numberOfSeats': '4',
+        }, **data), content_type='application/json')
+
+    @override_settings(TIME_ZONE='Europe/Warsaw')
+    def test_series_is_booked_whole_or_not_at_all(self):
+        taken = Reservation.objects.create(
+            table=self.tables[0], date=timezone.make_aware(datetime(2030, 11, 5, 13)), duration=2,
+            full_name='Anna Smith', phone='997', email='anna@email.com', number_of_seats=2)
+
+        response = self.book(tableNumber='1')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data, {'conflicts': ['2030-11-05 12:00']})
+        self.assertEqual((ReservationSeries.objects.count(), Reservation.objects.count()), (0, 1))
+
+        taken = Reservation.objects.get(id=taken.id)
+        taken.table = self.tables[1]
+        taken.save()
+        response = self.book(tableNumber='1')
+        self.assertEqual(response.status_code, 201)
+        occurrences = Reservation.objects.filter(series_id=response.data['id']).order_by('date')
+        self.assertEqual([r.id for r in occurrences], response.data['reservations'])
+        # weekly at the same local time across the end of DST
+        self.assertEqual({timezone.localtime(r.date).strftime('%a %H:%M') for r in occurrences}, {'Tue 12:00'})
+        # which is 10:00 UTC in summer time until October 27 and 11:00 UTC after it
+        self.assertEqual(
+            {(r.date.date() < date(2030, 10, 27), r.date.astimezone(dt_timezone.utc).hour) for r in occurrences},
+            {(True, 10), (False, 11)})
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+        self.assertEqual(OccupancyRollup.objects.filter(table=self.tables[0]).aggregate(bookings=Sum('bookings'))['bookings'], 13)
+
+    def test_free_table_is_assigned_for_every_date(self):
+        Reservation.objects.create(
+            table=self.tables[0], date=timezone.make_aware(datetime(2030, 10, 9, 12)), duration=2,
+            full_name='Anna Smith', phone='997', email='anna@email.com', number_of_seats=2)
+
+        response = self.book(dates=['2030-10-08 12:00:00.000', '2030-10-09 12:00:00.000'], repeat=None)
+        self.assertEqual((response.status_code, response.data['tableNumber']), (201, 2))
+        self.assertEqual(self.book(repeat={'frequency': 'daily', 'count': 2}, duration='25').status_code, 400)
+        self.assertEqual(self.book(repeat={'frequency': 'weekly', 'until': '2045-01-01'}).status_code, 400)
+
+    def test_conflict_check_does_not_grow_with_the_series(self):
+        def reads(count):
+            with CaptureQueriesContext(connection) as context:
+                self.assertEqual(self.book(tableNumber='2', repeat={'frequency': 'daily', 'count': count}).status_code, 201)
+            ReservationSeries.objects.all().delete()
+            return len([query for query in context.captured_queries if query['sql'].startswith('SELECT')])
+
+        self.assertEqual(reads(2), reads(300))
+
+    def test_upcoming_occurrences_are_cancelled_together(self):
+        past = self.book(dates=['2021-10-19 12:00:00.000'], repeat=None).data['id']
+        series = self.book(repeat={'frequency': 'weekly', 'count': 3}).data
+        single = '/reservations/{id}'.format(id=series['reservations'][0])
+        Client().put(single, {'status': 'requested cancellation'}, content_type='application/json')
+        code = Reservation.objects.get(id=series['reservations'][0]).verification_code
+        self.assertEqual(Client().delete(single, {'verification_code': code}, content_type='application/json').status_code, 200)
+
+        url = '/reservations/series/{id}'.format(id=series['id'])
+        self.assertEqual(Client().delete(url, {'verification_code': 0}, content_type='application/json').status_code, 401)
+        self.assertEqual(Client().put(url, {'status': 'requested cancellation'}, content_type='application/json').status_code, 200)
+        code = ReservationSeries.objects.get(id=series['id']).verification_code
+        response = Client().delete(url, {'verification_code': code}, content_type='application/json')
+
+        self.assertEqual(response.data, {'cancelled': 2})
+        self.assertEqual(list(Reservation.objects.values_list('series_id', flat=True)), [past])
+        past_url = '/reservations/series/{id}'.format(id=past)
+        self.assertEqual(Client().put(past_url, {'status': 'requested cancellation'}, content_type='application/json').status_code, 405)
+        self.assertEqual(OccupancyRollup.objects.aggregate(cancellations=Sum('cancellations'))['cancellations'], 3)
@@ -0,0 +1,153 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+# buckets untouched for this long are full again and are deleted
+STALE_AFTER = 3600
+# in-flight counts of a process untouched for this long are not counted, the process is gone or hung
+IN_FLIGHT_STALE_AFTER = 60
+
+
+def throttling_config():
+    return getattr(settings, 'THROTTLING', {})
+
+
+class BucketStore:
+    """
+        Token buckets and requests in flight per process in a local SQLite file, shared
+        by all worker processes of the host.
+
+        Every take is one short write transaction; the file runs in WAL mode without
+        fsync, losing counters in a crash only lets a few requests more through.
+        Errors of the store let the request through - throttling must not take the
+        API down with it.
+    """
+    def __init__(self):
+        self.local = threading.local()
+        self.process = (None, None)
+
+    def connection(self, path):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or self.local.path != path:
+            connection = sqlite3.connect(str(path), timeout=1, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute('CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS in_flight (process TEXT PRIMARY KEY, requests INTEGER, updated REAL)')
+            self.local.connection, self.local.path = connection, path
+        return connection
+
+    def process_key(self):
+        # a new key after fork, and for a later process reusing the pid of a dead one
+        if self.process[0] != os.getpid():
+            self.process = (os.getpid(), '{pid}:{token}'.format(pid=os.getpid(), token=uuid.uuid4().hex))
+        return self.process[1]
+
+    def write(self, statements):
+        """
+            Run statements(connection, now) in one write transaction of the store.
+
+            Return:
+                its result, None if the store failed
+        """
+        now = time.time()
+        try:
+            connection = self.connection(throttling_config()['PATH'])
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                result = statements(connection, now)
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+        except sqlite3.Error:
+            return None
+        return result
+
+    def enter(self, limit):
+        """
+            Count a request of this process in flight unless limit requests of all the
+            processes of the host are in flight already.
+
+            Return:
+                True if counted, False if over the limit, None if the store failed
+                (the request runs uncounted)
+        """
+        def statements(connection, now):
+            in_flight = connection.execute(
+                'SELECT COALESCE(SUM(requests), 0) FROM in_flight WHERE updated >= ?',
+                (now - IN_FLIGHT_STALE_AFTER,)).fetchone()[0]
+            if in_flight >= limit:
+                return False
+            connection.execute(
+                'INSERT INTO in_flight (process, requests, updated) VALUES (?, 1, ?) '
+                'ON CONFLICT (process) DO UPDATE SET requests = requests + 1, updated = excluded.updated',
+                (self.process_key(), now))
+            if random.random() < 0.001:
+                connection.execute('DELETE FROM in_flight WHERE updated < ?', (now - STALE_AFTER,))
+            return True
+        return self.write(statements)
+
+    def leave(self):
+        self.write(lambda connection, now: connection.execute(
+            'UPDATE in_flight SET requests = MAX(requests - 1, 0), updated = ? WHERE process = ?',
+            (now, self.process_key())))
+
+    def take(self, key, rate, capacity):
+        """
+            Take a token from the bucket of key, refilled with rate tokens per second up to capacity.
+
+            Return:
+                0 if taken, otherwise seconds until a token is available
+        """
+        def statements(connection, now):
+            row = connection.execute('SELECT tokens, updated FROM bucket WHERE key = ?', (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            connection.execute(
+                'INSERT INTO bucket (key, tokens, updated) VALUES (?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+                (key, tokens - 1 if not wait else tokens, now))
+            if random.random() < 0.001:
+                connection.execute('DELETE FROM bucket WHERE updated < ?', (now - STALE_AFTER,))
+            return wait
+        return self.write(statements) or 0
+
+
+bucket_store = BucketStore()
+
+
+def throttle_wait(request, scope, ident):
+    """
+        Take a token for the client from the bucket of scope, settings.THROTTLING['RATES']
+        has (tokens per second, capacity) by '<scope>.<method>' or by '<scope>'.
+
+        Return:
+            0 if the request may run, otherwise seconds to wait
+    """
+    rates = throttling_config().get('RATES', {})
+    method_scope = '{scope}.{method}'.format(scope=scope, method=request.method.lower())
+    rate = rates.get(method_scope) or rates.get(scope)
+    if not scope or not rate:
+        return 0
+    return bucket_store.take('{scope}:{ident}'.format(scope=method_scope, ident=ident), *rate)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+        Per client and per endpoint token bucket, the view sets throttle_scope.
+        Unlike the rate throttles of DRF a client may burst up to the bucket capacity
+        and is then held to the refill rate.
+    """
+    def allow_request(self, request, view):
+        self.wait_seconds = throttle_wait(request, getattr(view, 'throttle_scope', None), self.get_ident(request))
+        return not self.wait_seconds
+
+    def wait(self):
+        return self.wait_seconds
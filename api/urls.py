@@ -1,8 +1,25 @@
 from .views import *
 from django.urls import path
 
-urlpatterns = [
-    path('tables/', AvailableTablesView.as_view()),
-    path('reservations/', ReservationsView.as_view()),
-    path('reservations/<int:id>', CancelReservationView.as_view()),
-]
\ No newline at end of file
+from .routers import for_venue
+
+# served for the default venue and under /venues/<venue>/ for every venue of settings.VENUES
+venue_routes = [
+    ('tables/', AvailableTablesView.as_view()),
+    ('tables/matrix', AvailabilityMatrixView.as_view()),
+    ('tables/combinations', TableCombinationsView.as_view()),
+    ('tables/index', AvailabilityIndexStatsView.as_view()),
+    ('reservations/', ReservationsView.as_view()),
+    ('reservations/export', ExportReservationsView.as_view()),
+    ('reservations/<int:id>', CancelReservationView.as_view()),
+    ('reservations/series', ReservationSeriesView.as_view()),
+    ('reservations/series/<int:id>', CancelReservationSeriesView.as_view()),
+    ('archive', ArchiveView.as_view()),
+    ('analytics/occupancy', OccupancyView.as_view()),
+]
+
+urlpatterns = [path(route, view) for route, view in venue_routes] + [
+    path('venues/<slug:venue>/' + route, for_venue(view)) for route, view in venue_routes
+] + [
+    path('metrics', MetricsView.as_view()),
+]
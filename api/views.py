@@ -1,9 +1,14 @@
 from typing import Type
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.core.mail import send_mail
-from django.http import Http404
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from django.db import OperationalError, connections, router, transaction
 from django.db.models import Q
+from django.utils import timezone
 
+from rest_framework.renderers import JSONRenderer
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
@@ -12,24 +17,116 @@ from datetime import datetime, time, timedelta, tzinfo
 import random
 from rich import print
 
-from tables.models import Table, Reservation
-from tables.serializers import ReservationSerializer, TableSerializer
-from reservations_api import settings
+from api import metrics
+from api.emails import queue_email, queue_emails
+from api.export import CSVRenderer, NDJSONRenderer
+from api.idempotency import idempotent
+from api.pagination import after_cursor, encode_cursor
+from api.routers import reads_from_replica
+from tables.availability import (
+    TableSchedule, as_aware, availability_index, availability_matrix, best_fit, day_bounds, service_days,
+    smallest_combinations,
+)
+from tables.models import ArchivedReservation, Table, Reservation, ReservationSeries, service_day
+from tables.pubsub import broker
+from tables.rollups import occupancy_summary
+from tables.serializers import (
+    ArchivedReservationSerializer, AvailabilitySlotSerializer, CombinationSerializer, ReservationSerializer, TableSerializer, fast_serializers, serialize_many,
+)
+from tables.signals import reservations_bulk_created, reservations_bulk_deleted
+from tables.versions import TABLES_KEY, day_key, get_versions, reservation_keys
 
 
+MAX_BATCH_SIZE = 500
+MAX_SERIES_OCCURRENCES = 500
+CANCELLATION_NOTICE = timedelta(hours=2)
+MAX_COMBINATION_SIZE = 4
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK_SIZE = 2000
+MIN_MATRIX_SLOT = timedelta(minutes=5)
+MAX_MATRIX_RANGE = timedelta(days=7)
+MAX_OCCUPANCY_RANGE = timedelta(days=366)
+
+
+def conditional_on_versions(keys_func):
+    """
+        Answer If-None-Match / If-Modified-Since of GET from tables.versions counters,
+        without running the view. keys_func(request) returns the version keys the
+        response depends on, or None when the request is invalid and the view should answer.
+    """
+    def versions(request):
+        if not hasattr(request, 'data_versions'):
+            keys = keys_func(request)
+            request.data_versions = get_versions(keys) if keys else (None, None)
+        return request.data_versions
+
+    return method_decorator(condition(
+        etag_func=lambda request, *args, **kwargs: versions(request)[0],
+        last_modified_func=lambda request, *args, **kwargs: versions(request)[1],
+    ), name='get')
+
+
+def reservations_version_keys(request):
+    date = get_date_from_request(request.GET.get('start_date'))
+    return [TABLES_KEY, day_key(date.date())]
+
+
+def tables_version_keys(request):
+    try:
+        duration = int(request.GET.get('duration'))
+    except (ValueError, TypeError):
+        return None
+    start_date = get_date_from_request(request.GET.get('start_date'))
+    return [TABLES_KEY] + reservation_keys(start_date, start_date + timedelta(hours=duration))
+
+
+@method_decorator(reads_from_replica, name='get')
+@conditional_on_versions(reservations_version_keys)
 class ReservationsView(APIView):
+    throttle_scope = 'reservations'
+
     def get(self, request):
         """
             Return list of reservations for the day.
             Example:
                 curl -L 'localhost:5000/reservations?start_date=2021-10-18+00:00:00.000'
+
+            Pages ordered by (date, id) when limit or cursor is given:
+                curl -L 'localhost:5000/reservations?start_date=2021-10-18+00:00:00.000&limit=100'
+                Return: {"next": "<cursor>", "results": [...]}, pass next as cursor for the following page
+
+            Streamed in constant memory with stream=1, the response is the same list:
+                curl -L 'localhost:5000/reservations?start_date=2021-10-18+00:00:00.000&stream=1'
         """
         date = get_date_from_request(request.GET.get('start_date'))
 
-        reservations = Reservation.objects.filter(date__date=date)
-        serializer = ReservationSerializer(reservations, many=True)
-        return Response(serializer.data)
+        reservations = Reservation.objects.filter(day=date.date()).select_related('table').order_by('date', 'id')
+        if request.GET.get('stream'):
+            # the stream is read after the view returns, keep the database chosen for the view
+            reservations = reservations.using(reservations.db)
+            return StreamingHttpResponse(stream_json(reservations, ReservationSerializer), content_type='application/json')
+        if 'limit' in request.GET or 'cursor' in request.GET:
+            return self.get_page(request, reservations)
+        with metrics.timer('serialization'):
+            return Response(serialize_many(ReservationSerializer, reservations))
+
+    def get_page(self, request, reservations):
+        try:
+            limit = min(int(request.GET.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+            if request.GET.get('cursor'):
+                reservations = after_cursor(reservations, request.GET['cursor'])
+        except ValueError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
 
+        page = list(reservations[:limit + 1])
+        next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+        with metrics.timer('serialization'):
+            return Response({'next': next_cursor, 'results': serialize_many(ReservationSerializer, page[:limit])})
+
+    @idempotent
     def post(self, request):
         """
             Create new reservation for a table.
@@ -46,22 +143,74 @@ class ReservationsView(APIView):
                         }" -X POST
 
             curl -L localhost:5000/reservations/ -H "Content-Type: application/json" -d '{"date": "2021-10-19 16:22:50.123", "duration": "3", "tableNumber": "53", "fullName": "Paul Smith", "phone": "997 123 997", "email": "paul@email.com", "numberOfSeats": "2"}' -X POST
+
+            Without tableNumber the best fitting free table is assigned, see assign_table.
+            "tableNumbers": [4, 5] books tables of one join group pushed together, see book_combination.
+
+            A list of such objects creates reservations in batch, see make_reservations.
+
+            Retries sent with the same Idempotency-Key header get the first response, see api.idempotency.
         """
+        if isinstance(request.data, list):
+            return self.make_reservations(request.data)
+
         date = get_date_from_request(request.data['date'])
         duration = int(request.data['duration'])
         full_name = request.data['fullName']
         phone = request.data['phone']
         email = request.data['email']
         number_of_seats = int(request.data['numberOfSeats'])
+        if request.data.get('tableNumbers'):
+            return self.book_combination(request.data['tableNumbers'], date, duration, full_name, phone, email, number_of_seats)
+        if request.data.get('tableNumber') in (None, ''):
+            return self.assign_table(date, duration, full_name, phone, email, number_of_seats)
         try:
             table = Table.objects.get(number=request.data['tableNumber'])
-        except (Reservation.DoesNotExist, ValueError):
+        except (Table.DoesNotExist, ValueError):
             return Response(status=status.HTTP_404_NOT_FOUND)
 
-        if table in AvailableTablesView.get_available_tables(number_of_seats, date, duration):
-            return self.make_reservation(date, duration, table, full_name, phone, email, number_of_seats)
-        else:
+        if not table.min_number_of_seats <= number_of_seats <= table.max_number_of_seats:
             return Response(status=status.HTTP_409_CONFLICT)
+        return self.make_reservation(date, duration, table, full_name, phone, email, number_of_seats)
+
+    def book_combination(self, table_numbers, date, duration, full_name, phone, email, number_of_seats):
+        """
+            Book tables of one join group pushed together for a larger party.
+            The first table holds the reservation, the others get rows combined_with it.
+        """
+        try:
+            table_numbers = sorted({int(number) for number in table_numbers})
+        except (TypeError, ValueError):
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        if not 2 <= len(table_numbers) <= MAX_COMBINATION_SIZE:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        tables = list(Table.objects.filter(number__in=table_numbers).order_by('number'))
+        if len(tables) != len(table_numbers):
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        if not tables[0].join_group or any(table.join_group != tables[0].join_group for table in tables):
+            return Response(status=status.HTTP_409_CONFLICT)
+        if sum(table.max_number_of_seats for table in tables) < number_of_seats:
+            return Response(status=status.HTTP_409_CONFLICT)
+
+        try:
+            r = Reservation(
+                table = tables[0],
+                date = date,
+                duration = duration,
+                full_name = full_name,
+                phone = phone,
+                email = email,
+                number_of_seats = number_of_seats
+            )
+            r.full_clean()
+        except ValidationError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        try:
+            if not ReservationsView.book_table(r, tables[1:]):
+                return Response(status=status.HTTP_409_CONFLICT)
+        except OperationalError:
+            return Response(status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'})
+        return Response(status=status.HTTP_201_CREATED)
 
     def make_reservation(self, date, duration, table, full_name, phone, email, number_of_seats):
         try:
@@ -78,25 +227,226 @@ class ReservationsView(APIView):
         except ValidationError:
             return Response(status=status.HTTP_400_BAD_REQUEST)
         try:
-            r.save()
-            self.send_confirmation_email(table, date, duration, full_name, phone, number_of_seats, email, r)
-            return Response(status=status.HTTP_201_CREATED)
-        except:
+            if not ReservationsView.book_table(r):
+                return Response(status=status.HTTP_409_CONFLICT)
+        except OperationalError:
+            # database stayed locked longer than its timeout
+            return Response(status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'})
+        return Response(status=status.HTTP_201_CREATED)
+
+    def assign_table(self, date, duration, full_name, phone, email, number_of_seats):
+        """
+            Book the best fitting free table for the party, or the smallest free
+            combination of tables when no single table can seat it.
+            Candidates are ranked without locks, then booked in that order with book_table,
+            which locks the tables and checks them again - a table taken in the meantime
+            moves the booking to the next candidate instead of failing it.
+
+            Return (201):
+                {"tableNumber": 4} or {"tableNumbers": [4, 5]}
+        """
+        try:
+            r = Reservation(
+                date = date,
+                duration = duration,
+                full_name = full_name,
+                phone = phone,
+                email = email,
+                number_of_seats = number_of_seats
+            )
+            r.full_clean(exclude=['table'])
+        except ValidationError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        r.fill_derived_fields()
+        try:
+            for table in ReservationsView.table_candidates(r):
+                r.table = table
+                if ReservationsView.book_table(r):
+                    return Response({'tableNumber': table.number}, status=status.HTTP_201_CREATED)
+            start_date = as_aware(r.date)
+            for combination in AvailableTablesView.get_available_combinations(number_of_seats, start_date, duration):
+                r.table = combination[0]
+                if ReservationsView.book_table(r, combination[1:]):
+                    return Response({'tableNumbers': [table.number for table in combination]}, status=status.HTTP_201_CREATED)
+        except OperationalError:
+            return Response(status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'})
+        return Response(status=status.HTTP_409_CONFLICT)
+
+    @staticmethod
+    def table_candidates(reservation):
+        """
+            Free tables for the reservation, best fit first (tables.availability.best_fit).
+            Bookings of the fitting tables on the reservation's days are read in one query.
+        """
+        start_date, finish_date = as_aware(reservation.date), as_aware(reservation.end_date)
+        tables = list(Table.objects.filter(
+            min_number_of_seats__lte=reservation.number_of_seats, max_number_of_seats__gte=reservation.number_of_seats))
+        days = list(service_days(start_date, finish_date))
+        schedules = {table.id: TableSchedule() for table in tables}
+        existing = Reservation.objects.filter(table__in=tables).overlapping(day_bounds(days[0])[0], day_bounds(days[-1])[1])
+        for reservation_id, table_id, start, finish in existing.values_list('id', 'table_id', 'date', 'end_date'):
+            schedules[table_id].add(start, finish, reservation_id)
+        return best_fit(tables, schedules, start_date, finish_date, reservation.number_of_seats)
+
+    @staticmethod
+    def book_table(reservation, combined_tables=()):
+        """
+            Save the reservation if its table is still free, atomically.
+            The confirmation email is queued in the same transaction.
+
+            The table row is locked (SELECT ... FOR UPDATE) for the time of the check and
+            the insert, so bookings of the same table are serialized while other tables
+            are booked in parallel. SQLite has no row locks - there the transaction takes
+            the database write lock up front (transaction_mode IMMEDIATE in settings).
+
+            combined_tables are booked together with the reservation's table, each with a
+            row combined_with the reservation; the party's seats are spread over them.
+
+            Return:
+                True if saved, False if a table is taken
+        """
+        table_ids = sorted({reservation.table_id} | {table.id for table in combined_tables})
+        with transaction.atomic(using=router.db_for_write(Reservation)):
+            list(Table.objects.select_for_update().filter(id__in=table_ids).order_by('id').values_list('id'))
+            taken = Reservation.objects.filter(table_id__in=table_ids).overlapping(
+                reservation.date, reservation.finish_hour()).exists()
+            if taken:
+                return False
+            if combined_tables:
+                seats = ReservationsView.split_seats(reservation, combined_tables)
+                reservation.number_of_seats = seats[0]
+            reservation.save()
+            for table, number_of_seats in zip(combined_tables, seats[1:] if combined_tables else ()):
+                Reservation(
+                    table=table, date=reservation.date, duration=reservation.duration, full_name=reservation.full_name,
+                    phone=reservation.phone, email=reservation.email, number_of_seats=number_of_seats,
+                    combined_with=reservation).save()
+            queue_email(*ReservationsView.confirmation_email(reservation, combined_tables))
+            return True
+
+    @staticmethod
+    def split_seats(reservation, combined_tables):
+        """
+            Seats of the party per table, filling the tables in order.
+        """
+        seats = []
+        left = reservation.number_of_seats
+        for table in [reservation.table] + list(combined_tables):
+            seats.append(min(left, table.max_number_of_seats))
+            left -= seats[-1]
+        return seats
+
+    def make_reservations(self, items):
+        """
+            Create many reservations at once.
+            Tables are resolved in one query, every interval is checked against existing
+            bookings and the rest of the batch in one pass, the reservations are inserted
+            with bulk_create and their emails queued together.
+
+            Return (207):
+                [{"status": "created", "id": 15}, {"status": "conflict"}, {"status": "invalid"}, ...]
+                in the order of the request
+        """
+        if not items or len(items) > MAX_BATCH_SIZE:
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
-    def send_confirmation_email(self, table, date, duration, full_name, phone, number_of_seats, email, reservation):
+        results = [{'status': 'invalid'} for _ in items]
+        candidates = []
+        for i, data in enumerate(items):
+            try:
+                table_number = int(data['tableNumber'])
+                r = Reservation(
+                    date = get_date_from_request(data['date']),
+                    duration = int(data['duration']),
+                    full_name = data['fullName'],
+                    phone = data['phone'],
+                    email = data['email'],
+                    number_of_seats = int(data['numberOfSeats'])
+                )
+                r.full_clean(exclude=['table'])
+            except (KeyError, TypeError, ValueError, ValidationError, Http404):
+                continue
+            candidates.append((i, table_number, r))
+
+        tables = {t.number: t for t in Table.objects.filter(number__in={number for _, number, _ in candidates})}
+        try:
+            with transaction.atomic(using=router.db_for_write(Reservation)):
+                created = ReservationsView.book_tables(candidates, tables, results)
+        except OperationalError:
+            return Response(status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'})
+        for i, r in created:
+            results[i] = {'status': 'created', 'id': r.id}
+        return Response(results, status=status.HTTP_207_MULTI_STATUS)
+
+    @staticmethod
+    def book_tables(candidates, tables, results):
+        """
+            Insert the candidates which fit their table and do not overlap existing
+            reservations or earlier candidates. Must run inside a transaction.
+
+            Return:
+                [(index, Reservation)] of created reservations
+        """
+        booked = []
+        for i, table_number, r in candidates:
+            table = tables.get(table_number)
+            if table is None:
+                continue
+            if not table.min_number_of_seats <= r.number_of_seats <= table.max_number_of_seats:
+                results[i] = {'status': 'conflict'}
+                continue
+            r.table = table
+            r.fill_derived_fields()
+            booked.append((i, r))
+        if not booked:
+            return []
+
+        table_ids = {r.table_id for _, r in booked}
+        list(Table.objects.select_for_update().filter(id__in=table_ids).order_by('id').values_list('id'))
+        schedules = {table_id: TableSchedule() for table_id in table_ids}
+        existing = Reservation.objects.filter(table_id__in=table_ids).overlapping(
+            min(r.date for _, r in booked), max(r.end_date for _, r in booked))
+        for reservation_id, table_id, start, finish in existing.values_list('id', 'table_id', 'date', 'end_date'):
+            schedules[table_id].add(start, finish, reservation_id)
+
+        created = []
+        for i, r in booked:
+            start, finish = as_aware(r.date), as_aware(r.end_date)
+            if schedules[r.table_id].is_free(start, finish):
+                schedules[r.table_id].add(start, finish, None)
+                created.append((i, r))
+            else:
+                results[i] = {'status': 'conflict'}
+
+        Reservation.objects.bulk_create([r for _, r in created])
+        queue_emails([ReservationsView.confirmation_email(r) for _, r in created])
+        reservations_bulk_created.send(sender=Reservation, reservations=[r for _, r in created])
+        return created
+
+    @staticmethod
+    def confirmation_email(reservation, combined_tables=()):
+        """
+            Return:
+                (subject, message, recipient_list) for queue_email
+        """
+        table = " + ".join(str(table) for table in [reservation.table] + list(combined_tables))
         message = "Reservation details:\n Table: {table}\n Date: {date}\n Duration: {duration}\n"\
                     "Full name: {full_name}\n Phone: {phone}\n Number of seats: {number_of_seats}\n"\
                     "Unique reservation number: {reservation_id}".format(
-                        table=table, date=date.strftime("%Y-%m-%d %H:%M"), duration=duration, full_name=full_name, phone=phone, number_of_seats=number_of_seats,
+                        table=table, date=reservation.date.strftime("%Y-%m-%d %H:%M"), duration=reservation.duration,
+                        full_name=reservation.full_name, phone=reservation.phone, number_of_seats=reservation.number_of_seats,
                         reservation_id=reservation.id)
-        send_mail(subject="Reservation confirmation", message=message, from_email=settings.EMAIL_HOST_USER, recipient_list=[email], fail_silently=False)
+        return "Reservation confirmation", message, [reservation.email]
 
 
+@method_decorator(reads_from_replica, name='get')
+@conditional_on_versions(tables_version_keys)
 class AvailableTablesView(APIView):
     """
         List available tables at a certain time.
     """
+    throttle_scope = 'tables'
+
     def get(self, request):
         """
             - 3 persons, 
@@ -118,63 +468,275 @@ class AvailableTablesView(APIView):
         request_status = request.GET.get('status')
         if request_status == "free":
             available_tables = AvailableTablesView.get_available_tables(min_seats, start_date, duration)
-            serializer = TableSerializer(available_tables, many=True)
-            return Response(serializer.data)
+            with metrics.timer('serialization'):
+                return Response(serialize_many(TableSerializer, available_tables))
         else:
             return Response(status=status.HTTP_404_NOT_FOUND)
     
     @staticmethod
-    def get_available_tables(min_seats, start_date, duration):
+    def get_available_tables(min_seats, start_date, duration, use_index=True):
         """
             Auxliary function to check free tables.
+            Answered from the in-process availability index when it is enabled,
+            use_index=False forces a database read.
 
             Return:
                 Table objects
                     * satisfied min_seats condition
                     * excluded reserved tables
         """
+        if use_index and availability_index.enabled:
+            return availability_index.available_tables(min_seats, start_date, duration)
+
         finish_date = start_date + timedelta(hours=duration)
         reservations = AvailableTablesView.get_ongoing_reservations(start_date, finish_date)
         seat_filter = Q(min_number_of_seats__lte=min_seats) & Q(max_number_of_seats__gte=min_seats)
-        return Table.objects.filter(seat_filter).exclude(id__in=reservations.values_list('table'))
+        return Table.objects.filter(seat_filter).exclude(id__in=reservations.values('table'))
 
     @staticmethod
-    def get_ongoing_reservations(start_date, finish_date):
-        ongoing_reservations_ids = []
+    def get_available_combinations(min_seats, start_date, duration):
+        """
+            Smallest free combination of every join group seating min_seats,
+            see tables.availability.smallest_combinations.
+
+            Return:
+                [[Table]] best first
+        """
+        finish_date = start_date + timedelta(hours=duration)
+        reservations = AvailableTablesView.get_ongoing_reservations(start_date, finish_date)
+        tables = Table.objects.exclude(join_group='').exclude(id__in=reservations.values('table'))
+        return smallest_combinations(tables, min_seats, MAX_COMBINATION_SIZE)
 
-        for r in Reservation.objects.filter(date__date=start_date):
-            if AvailableTablesView.duration_overlap(r, start_date, finish_date):
-                ongoing_reservations_ids.append(r.id)
-        return Reservation.objects.filter(id__in=ongoing_reservations_ids)
-    
     @staticmethod
-    def duration_overlap(reservation, start_date, finish_date):
-        # naive aware confilct
-        reservation.date = reservation.date.replace(tzinfo=None)
-        # check every possibility
-        if start_date <= reservation.date <= finish_date:
-            return True
-        elif start_date <= reservation.finish_hour() <= finish_date:
-            return True
-        elif reservation.date < start_date and reservation.finish_hour() > finish_date:
-            return True
+    def get_ongoing_reservations(start_date, finish_date):
+        """
+            Reservations overlapping <start_date, finish_date>, including the ones
+            which started the previous day and run past midnight.
+            Lazy queryset - used as a subquery it keeps the whole check in one SQL query.
+        """
+        return Reservation.objects.overlapping(start_date, finish_date)
+
+
+@method_decorator(reads_from_replica, name='get')
+@conditional_on_versions(tables_version_keys)
+class TableCombinationsView(APIView):
+    """
+        List free combinations of tables for parties no single table can seat.
+    """
+    throttle_scope = 'tables'
+
+    def get(self, request):
+        """
+            - 14 persons
+            - booking at 19 on October 19
+            - reservation for 3 hours
+
+            Example:
+                curl -L "localhost:5000/tables/combinations?min_seats=14&start_date=2021-10-19+19:00:00.000&duration=3"
+
+            Return:
+                Array: [{"tables": [4, 5, 6], "seats": 14}, ...] the smallest combination of every join group, best first
+        """
+        try:
+            min_seats = int(request.GET.get('min_seats'))
+            duration = int(request.GET.get('duration'))
+        except (ValueError, TypeError):
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        start_date = get_date_from_request(request.GET.get('start_date'))
+        combinations = AvailableTablesView.get_available_combinations(min_seats, start_date, duration)
+        serializer = CombinationSerializer([
+            {'tables': [table.number for table in combination], 'seats': sum(table.max_number_of_seats for table in combination)}
+            for combination in combinations
+        ], many=True)
+        return Response(serializer.data)
+
+
+class AvailabilityMatrixView(APIView):
+    """
+        List available tables for every time slot of a day or a week.
+    """
+    def get(self, request):
+        """
+            - 4 persons
+            - reservation for 2 hours
+            - starting every 15 minutes on October 19
+
+            Example:
+                curl -L "localhost:5000/tables/matrix?min_seats=4&duration=2&slot=15&start_date=2021-10-19+00:00:00.000&end_date=2021-10-20+00:00:00.000"
+
+            Return:
+                Array: [{"start": "2021-10-19T00:00:00Z", "tables": [1, 4]}, ...]
+        """
+        try:
+            min_seats = int(request.GET.get('min_seats'))
+            duration = timedelta(hours=int(request.GET.get('duration')))
+            slot = timedelta(minutes=int(request.GET.get('slot', 15)))
+        except (ValueError, TypeError):
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        start_date = as_aware(get_date_from_request(request.GET.get('start_date')))
+        if request.GET.get('end_date'):
+            end_date = as_aware(get_date_from_request(request.GET.get('end_date')))
+        else:
+            end_date = start_date + timedelta(days=1)
+        if slot < MIN_MATRIX_SLOT or not start_date < end_date <= start_date + MAX_MATRIX_RANGE:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        tables = Table.objects.filter(min_number_of_seats__lte=min_seats, max_number_of_seats__gte=min_seats)
+        reservations = Reservation.objects.filter(table__in=tables).overlapping(start_date, end_date + duration)
+        matrix = availability_matrix(
+            list(tables.order_by('id').values_list('id', 'number')),
+            reservations.values_list('table_id', 'date', 'end_date'),
+            start_date, end_date, slot, duration)
+        serializer = AvailabilitySlotSerializer([{'start': start, 'tables': numbers} for start, numbers in matrix], many=True)
+        return Response(serializer.data)
+
+
+@method_decorator(reads_from_replica, name='get')
+class ExportReservationsView(APIView):
+    """
+        Export of reservations for staff, streamed in constant memory.
+    """
+    renderer_classes = [CSVRenderer, NDJSONRenderer]
+
+    def get(self, request):
+        """
+            Return reservations starting in <start_date, end_date) as CSV or NDJSON,
+            ordered by (date, id), optionally of one table.
+            Example:
+                curl -L 'localhost:5000/reservations/export?start_date=2021-10-01+00:00:00.000&end_date=2021-11-01+00:00:00.000&format=csv'
+                curl -L 'localhost:5000/reservations/export?start_date=2021-10-01+00:00:00.000&end_date=2021-11-01+00:00:00.000&table=4&format=ndjson'
+
+            Every row ends with its cursor; after a dropped connection pass the last
+            received one as cursor=<cursor> to continue after that row.
+        """
+        start_date = as_aware(get_date_from_request(request.GET.get('start_date')))
+        if request.GET.get('end_date'):
+            end_date = as_aware(get_date_from_request(request.GET.get('end_date')))
         else:
-            return False
+            end_date = start_date + timedelta(days=1)
+        if start_date >= end_date:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        # the service day narrows the scan to the (day, date) index, date gives the exact bounds
+        reservations = Reservation.objects.filter(
+            day__gte=service_day(start_date), day__lte=service_day(end_date), date__gte=start_date, date__lt=end_date)
+        try:
+            if request.GET.get('table'):
+                reservations = reservations.filter(table__number=int(request.GET['table']))
+            if request.GET.get('cursor'):
+                reservations = after_cursor(reservations, request.GET['cursor'])
+        except ValueError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        # the stream is read after the view returns, keep the database chosen for the view
+        reservations = reservations.order_by('day', 'date', 'id').using(reservations.db)
+
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(renderer.export(reservations), content_type='{media_type}; charset={charset}'.format(
+            media_type=renderer.media_type, charset=renderer.charset))
+        response['Content-Disposition'] = 'attachment; filename="reservations-{start}.{format}"'.format(
+            start=start_date.strftime("%Y-%m-%d"), format=renderer.format)
+        return response
+
+
+@method_decorator(reads_from_replica, name='get')
+@conditional_on_versions(reservations_version_keys)
+class ArchiveView(APIView):
+    """
+        Read-only list of archived reservations, see manage.py archive_reservations.
+    """
+    def get(self, request):
+        """
+            Return archived reservations of the day, paged by (date, id) like GET /reservations.
+            Example:
+                curl -L 'localhost:5000/archive?start_date=2021-10-18+00:00:00.000&limit=100'
+
+            Return:
+                {"next": "<cursor>", "results": [...]}
+        """
+        date = get_date_from_request(request.GET.get('start_date'))
+        try:
+            limit = min(int(request.GET.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+            reservations = ArchivedReservation.objects.filter(day=date.date()).order_by('date', 'id')
+            if request.GET.get('cursor'):
+                reservations = after_cursor(reservations, request.GET['cursor'])
+        except ValueError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        page = list(reservations[:limit + 1])
+        next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+        with metrics.timer('serialization'):
+            return Response({'next': next_cursor, 'results': ArchivedReservationSerializer(page[:limit], many=True).data})
+
+
+@method_decorator(reads_from_replica, name='get')
+class OccupancyView(APIView):
+    """
+        Utilization of the tables, answered from tables.OccupancyRollup instead of the reservations.
+    """
+    def get(self, request):
+        """
+            Return booked seat hours, cancellation and no-show rates between start_date
+            and end_date (whole hours), per table and as a weekday x hour heatmap.
+            Example:
+                curl -L "localhost:5000/analytics/occupancy?start_date=2021-10-01+00:00:00.000&end_date=2021-11-01+00:00:00.000"
+
+            Return:
+                {"seat_hours": 1520.5, "bookings": 412, "cancellations": 12, "no_shows": 7,
+                 "cancellation_rate": 0.029, "no_show_rate": 0.017,
+                 "tables": [{"table": 1, "seat_hours": 96.0, "utilization": 0.032, ...}, ...],
+                 "heatmap": [{"weekday": 1, "hour": 18, "seat_hours": 40.0}, ...]}
+        """
+        start_date = as_aware(get_date_from_request(request.GET.get('start_date')))
+        end_date = as_aware(get_date_from_request(request.GET.get('end_date')))
+        if not start_date < end_date <= start_date + MAX_OCCUPANCY_RANGE:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        return Response(occupancy_summary(start_date, end_date))
+
+
+class AvailabilityIndexStatsView(APIView):
+    def get(self, request):
+        """
+            Return hit/miss counters of the availability index in this process.
+            Example:
+                curl -L 'localhost:5000/tables/index'
+        """
+        return Response(availability_index.stats())
+
+
+class MetricsView(APIView):
+    def get(self, request):
+        """
+            Return request, database, serialization and email metrics in the Prometheus text format.
+            Example:
+                curl -L 'localhost:5000/metrics'
+        """
+        stats = availability_index.stats()
+        gauges = [('availability_index_{}'.format(key), int(value)) for key, value in stats.items()]
+        gauges += [('events_{}'.format(key), value) for key, value in broker.stats().items()]
+        return HttpResponse(metrics.registry.render(gauges), content_type='text/plain; version=0.0.4')
 
 
 class CancelReservationView(APIView):
+    throttle_scope = 'cancel'
+
+    @idempotent
     def put(self, request, *args, **kwargs):
         """
             Create task for cancel reservation.
             Send generated verification code in email for cancel reservation.
+            Retries with the same Idempotency-Key header do not generate a new code or email.
 
             Example:
                 curl -L 'localhost:5000/reservations/15' -H "Content-Type: application/json" -d '{"status": "requested cancellation"}' -X PUT
+
+            Staff mark a started reservation whose guests did not come with {"status": "no show"}.
         """
         reservation_status = request.data['status']
         if reservation_status == 'requested cancellation':
             try:
-                reservation = Reservation.objects.get(id=kwargs['id'])
+                reservation = get_booking(kwargs['id'])
             except (Reservation.DoesNotExist, ValueError):
                 return Response(status=status.HTTP_404_NOT_FOUND)
 
@@ -183,12 +745,32 @@ class CancelReservationView(APIView):
                 return Response(status.HTTP_405_METHOD_NOT_ALLOWED)
 
             reservation.verification_code = random.randint(100000, 999999)
-            reservation.save()
+            with transaction.atomic(using=router.db_for_write(Reservation)):
+                # every write of a venue takes its tables' locks, see manage.py copy_venue
+                list(Table.objects.select_for_update().filter(id=reservation.table_id).values_list('id'))
+                reservation.save()
+                queue_email("Confirmation of the cancellation of the reservation",
+                "Code: {verification_code}".format(verification_code=reservation.verification_code),
+                recipient_list=[reservation.email])
+
+            return Response(status=status.HTTP_200_OK)
+        elif reservation_status == 'no show':
+            try:
+                reservation = get_booking(kwargs['id'])
+            except (Reservation.DoesNotExist, ValueError):
+                return Response(status=status.HTTP_404_NOT_FOUND)
 
-            send_mail("Confirmation of the cancellation of the reservation",
-            "Code: {verification_code}".format(verification_code=reservation.verification_code),
-            from_email=settings.EMAIL_HOST_USER, recipient_list=[reservation.email], fail_silently=False)
+            # staff mark a guest who did not come, once the reservation has started
+            if reservation.date.replace(tzinfo=None) > datetime.now():
+                return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
+            with transaction.atomic(using=router.db_for_write(Reservation)):
+                rows = [reservation, *reservation.combined_tables.all()]
+                list(Table.objects.select_for_update().filter(id__in=[row.table_id for row in rows]).order_by('id').values_list('id'))
+                for row in rows:
+                    if not row.no_show:
+                        row.no_show = True
+                        row.save(update_fields=['no_show'])
             return Response(status=status.HTTP_200_OK)
         else:
             return Response(status=status.HTTP_404_NOT_FOUND)
@@ -203,7 +785,7 @@ class CancelReservationView(APIView):
                 curl -l localhost:5000/reservations/15 -H "Content-Type: application/json" -d '{"verification_code": "123456"}' -X DELETE
         """
         try:
-            reservation = Reservation.objects.get(id=kwargs['id'])
+            reservation = get_booking(kwargs['id'])
         except (Reservation.DoesNotExist, ValueError):
             return Response(status=status.HTTP_404_NOT_FOUND)
 
@@ -213,12 +795,305 @@ class CancelReservationView(APIView):
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
         if  v_code == reservation.verification_code:
-            reservation.delete()
+            with transaction.atomic(using=router.db_for_write(Reservation)):
+                rows = [reservation, *reservation.combined_tables.all()]
+                # like bookings, so a venue being copied to another shard (manage.py copy_venue) misses no cancellation
+                list(Table.objects.select_for_update().filter(id__in=[row.table_id for row in rows]).order_by('id').values_list('id'))
+                # the post_delete receivers count the cancellation of every row
+                reservation.delete()
             return Response(status=status.HTTP_200_OK)
         else:
             return Response(status=status.HTTP_401_UNAUTHORIZED)
 
 
+class ReservationSeriesView(APIView):
+    """
+        Recurring and multi-date bookings of one table, see tables.models.ReservationSeries.
+    """
+    throttle_scope = 'reservations'
+
+    @idempotent
+    def post(self, request):
+        """
+            Book a table for every date of a rule or of a list, all or nothing.
+            Example:
+                curl -L localhost:5000/reservations/series -H "Content-Type: application/json" -d '{"date": "2030-10-01 12:00:00.000", "duration": "2", "repeat": {"frequency": "weekly", "count": 13}, "tableNumber": "4", "fullName": "Paul Smith", "phone": "997 123 997", "email": "paul@email.com", "numberOfSeats": "6"}' -X POST
+
+            "repeat" takes a frequency (daily or weekly), an interval (default 1) and a count or
+            the last day ("until": "2030-12-31"). "dates": ["2030-10-01 12:00:00.000", ...] lists
+            the dates instead. Without tableNumber the best fitting table free on every date is assigned.
+
+            Single occurrences are cancelled like other reservations (/reservations/{id}),
+            the upcoming ones all at once with PUT and DELETE /reservations/series/{id}.
+
+            Return (201):
+                {"id": 3, "tableNumber": 4, "reservations": [15, 16, ...]}
+            Return (409), with tableNumber:
+                {"conflicts": ["2030-10-15 12:00", ...]} dates the table is taken on
+        """
+        try:
+            series = ReservationSeries(
+                date = get_date_from_request(request.data['date']),
+                duration = int(request.data['duration']),
+                full_name = request.data['fullName'],
+                phone = request.data['phone'],
+                email = request.data['email'],
+                number_of_seats = int(request.data['numberOfSeats'])
+            )
+            dates = series_dates(series, request.data)
+            series.full_clean(exclude=['table'])
+        except (KeyError, TypeError, ValueError, ValidationError, Http404):
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        table = None
+        if request.data.get('tableNumber') not in (None, ''):
+            try:
+                table = Table.objects.get(number=request.data['tableNumber'])
+            except (Table.DoesNotExist, ValueError):
+                return Response(status=status.HTTP_404_NOT_FOUND)
+            if not table.min_number_of_seats <= series.number_of_seats <= table.max_number_of_seats:
+                return Response(status=status.HTTP_409_CONFLICT)
+
+        occurrences = []
+        for date in dates:
+            r = Reservation(
+                date=date, duration=series.duration, full_name=series.full_name, phone=series.phone,
+                email=series.email, number_of_seats=series.number_of_seats)
+            r.fill_derived_fields()
+            occurrences.append(r)
+        try:
+            if table is not None:
+                conflicts = ReservationSeriesView.book_series(series, occurrences, table)
+                if conflicts:
+                    return Response({'conflicts': [
+                        timezone.localtime(r.date).strftime("%Y-%m-%d %H:%M") for r in conflicts
+                    ]}, status=status.HTTP_409_CONFLICT)
+            elif not ReservationSeriesView.assign_table(series, occurrences):
+                return Response(status=status.HTTP_409_CONFLICT)
+        except OperationalError:
+            return Response(status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'})
+        return Response({
+            'id': series.id,
+            'tableNumber': series.table.number,
+            'reservations': [r.id for r in occurrences],
+        }, status=status.HTTP_201_CREATED)
+
+    @staticmethod
+    def assign_table(series, occurrences):
+        """
+            Book the series on the best fitting table free on every occurrence.
+            Like ReservationsView.assign_table, candidates are ranked without locks and
+            book_series checks each of them again under the table's lock.
+
+            Return:
+                True if booked
+        """
+        tables = list(Table.objects.filter(
+            min_number_of_seats__lte=series.number_of_seats, max_number_of_seats__gte=series.number_of_seats))
+        schedules = series_schedules([table.id for table in tables], occurrences)
+        candidates = sorted(
+            (table for table in tables if not series_conflicts(schedules[table.id], occurrences)),
+            key=lambda table: (table.max_number_of_seats, table.number))
+        for table in candidates:
+            if not ReservationSeriesView.book_series(series, occurrences, table):
+                return True
+        return False
+
+    @staticmethod
+    def book_series(series, occurrences, table):
+        """
+            Save the series and all its occurrences on the table if it is free on every one
+            of them, atomically - the series is booked whole or not at all.
+
+            The table is locked as in ReservationsView.book_table, its bookings between the
+            first and the last occurrence are read in one range query and checked in memory.
+            The occurrences are inserted with one bulk_create, a single email lists them.
+
+            Return:
+                occurrences the table is taken on, empty if booked
+        """
+        with transaction.atomic(using=router.db_for_write(Reservation)):
+            list(Table.objects.select_for_update().filter(id=table.id).values_list('id'))
+            conflicts = series_conflicts(series_schedules([table.id], occurrences)[table.id], occurrences)
+            if conflicts:
+                return conflicts
+            series.table = table
+            series.save()
+            for r in occurrences:
+                r.table = table
+                r.series = series
+            Reservation.objects.bulk_create(occurrences)
+            queue_email(*ReservationSeriesView.confirmation_email(series, occurrences))
+            reservations_bulk_created.send(sender=Reservation, reservations=occurrences)
+            return []
+
+    @staticmethod
+    def confirmation_email(series, occurrences):
+        """
+            Return:
+                (subject, message, recipient_list) for queue_email
+        """
+        dates = "\n".join(
+            "  {date} (reservation number {id})".format(date=timezone.localtime(r.date).strftime("%Y-%m-%d %H:%M"), id=r.id)
+            for r in occurrences)
+        message = "Reservation details:\n Table: {table}\n Dates:\n{dates}\n Duration: {duration}\n"\
+                    "Full name: {full_name}\n Phone: {phone}\n Number of seats: {number_of_seats}\n"\
+                    "Unique series number: {series_id}".format(
+                        table=series.table, dates=dates, duration=series.duration, full_name=series.full_name,
+                        phone=series.phone, number_of_seats=series.number_of_seats, series_id=series.id)
+        return "Reservation confirmation", message, [series.email]
+
+
+class CancelReservationSeriesView(APIView):
+    throttle_scope = 'cancel'
+
+    @idempotent
+    def put(self, request, *args, **kwargs):
+        """
+            Send a verification code for cancelling the upcoming occurrences of a series.
+
+            Example:
+                curl -L 'localhost:5000/reservations/series/3' -H "Content-Type: application/json" -d '{"status": "requested cancellation"}' -X PUT
+        """
+        if request.data.get('status') != 'requested cancellation':
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        try:
+            series = ReservationSeries.objects.get(id=kwargs['id'])
+        except ReservationSeries.DoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        if not upcoming_occurrences(series).exists():
+            return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+        series.verification_code = random.randint(100000, 999999)
+        with transaction.atomic(using=router.db_for_write(ReservationSeries)):
+            list(Table.objects.select_for_update().filter(id=series.table_id).values_list('id'))
+            series.save(update_fields=['verification_code'])
+            queue_email("Confirmation of the cancellation of the reservation series",
+            "Code: {verification_code}".format(verification_code=series.verification_code),
+            recipient_list=[series.email])
+        return Response(status=status.HTTP_200_OK)
+
+    def delete(self, request, *args, **kwargs):
+        """
+            Confirm with the verification code, cancels every occurrence starting at least
+            CANCELLATION_NOTICE from now. Past occurrences stay.
+
+            Example:
+                curl -l localhost:5000/reservations/series/3 -H "Content-Type: application/json" -d '{"verification_code": "123456"}' -X DELETE
+
+            Return:
+                {"cancelled": 12}
+        """
+        try:
+            series = ReservationSeries.objects.get(id=kwargs['id'])
+        except ReservationSeries.DoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            v_code = int(request.data['verification_code'])
+        except (KeyError, TypeError, ValueError):
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        if not series.verification_code or v_code != series.verification_code:
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+
+        using = router.db_for_write(Reservation)
+        with transaction.atomic(using=using):
+            list(Table.objects.select_for_update().filter(id=series.table_id).values_list('id'))
+            rows = list(upcoming_occurrences(series))
+            if rows:
+                # one DELETE for the whole series, the signal counts the cancellations and bumps every touched day once
+                with connections[using].cursor() as cursor:
+                    cursor.execute("DELETE FROM {table} WHERE id IN ({ids})".format(
+                        table=Reservation._meta.db_table, ids=', '.join(['%s'] * len(rows))), [r.id for r in rows])
+                reservations_bulk_deleted.send(sender=Reservation, reservations=rows)
+            series.verification_code = 0
+            series.save(update_fields=['verification_code'])
+        return Response({'cancelled': len(rows)}, status=status.HTTP_200_OK)
+
+
+def series_dates(series, data):
+    """
+        Dates of the occurrences of a new series from "repeat" or "dates" of the request, in order.
+        Fills the rule fields of series.
+
+        Raises ValueError when there are none or more than MAX_SERIES_OCCURRENCES,
+        or when occurrences would overlap each other.
+    """
+    if data.get('dates'):
+        dates = sorted({as_aware(get_date_from_request(date)) for date in data['dates']})
+    else:
+        repeat = data['repeat']
+        series.frequency = repeat['frequency']
+        series.interval = int(repeat.get('interval', 1))
+        if series.frequency not in ReservationSeries.FREQUENCIES or series.interval < 1:
+            raise ValueError
+        if repeat.get('count') is not None:
+            dates = series.rule_dates(max(0, min(int(repeat['count']), MAX_SERIES_OCCURRENCES + 1)))
+        else:
+            until = datetime.strptime(repeat['until'], "%Y-%m-%d").date()
+            dates = [date for date in series.rule_dates(MAX_SERIES_OCCURRENCES + 1) if timezone.localtime(date).date() <= until]
+    if not 0 < len(dates) <= MAX_SERIES_OCCURRENCES:
+        raise ValueError
+    series.date = dates[0]
+    # boundaries are inclusive like Reservation.objects.overlapping
+    length = timedelta(hours=series.duration)
+    if any(later - earlier <= length for earlier, later in zip(dates, dates[1:])):
+        raise ValueError
+    return dates
+
+
+def series_schedules(table_ids, occurrences):
+    """
+        Bookings of the tables between the first and the last occurrence, read in one range query.
+
+        Return:
+            {table_id: TableSchedule}
+    """
+    schedules = {table_id: TableSchedule() for table_id in table_ids}
+    existing = Reservation.objects.filter(table_id__in=table_ids).overlapping(occurrences[0].date, occurrences[-1].end_date)
+    for reservation_id, table_id, start, finish in existing.values_list('id', 'table_id', 'date', 'end_date'):
+        schedules[table_id].add(start, finish, reservation_id)
+    return schedules
+
+
+def series_conflicts(schedule, occurrences):
+    return [r for r in occurrences if not schedule.is_free(as_aware(r.date), as_aware(r.end_date))]
+
+
+def upcoming_occurrences(series):
+    return series.reservations.filter(date__gte=timezone.now() + CANCELLATION_NOTICE).order_by('date')
+
+
+def get_booking(reservation_id):
+    """
+        The reservation, or the one it is combined with - a combined booking is
+        cancelled as a whole, deleting it deletes the rows of the other tables.
+    """
+    reservation = Reservation.objects.get(id=reservation_id)
+    if reservation.combined_with_id:
+        return Reservation.objects.get(id=reservation.combined_with_id)
+    return reservation
+
+
+def stream_json(queryset, serializer_class):
+    """
+        Yield a JSON array of serialized rows, fetched with a server-side iterator.
+        The bytes are the same as JSONRenderer output of the whole list.
+    """
+    renderer = JSONRenderer()
+    if getattr(settings, 'FAST_SERIALIZERS', False) and serializer_class in fast_serializers:
+        fast = fast_serializers[serializer_class]
+        rows = map(fast.compile(), fast.rows(queryset, chunk_size=STREAM_CHUNK_SIZE))
+    else:
+        rows = (serializer_class(obj).data for obj in queryset.iterator(chunk_size=STREAM_CHUNK_SIZE))
+    yield b'['
+    for i, row in enumerate(rows):
+        if i:
+            yield b','
+        yield renderer.render(row)
+    yield b']'
+
+
 def get_date_from_request(date):
     try:
         return datetime.strptime(date, "%Y-%m-%d %H:%M:%S.%f")
@@ -0,0 +1,14 @@
+"""reservations_api URL Configuration of the ASGI application
+
+The same as reservations_api.urls with the async read views of api.async_urls,
+selected by api.middleware.ASGIUrlconfMiddleware.
+"""
+from django.contrib import admin
+from django.urls import path
+from django.conf.urls import include
+
+urlpatterns = [
+    path('admin/', admin.site.urls),
+    path('', include('api.async_urls')),
+    path('api-auth/', include('rest_framework.urls'))
+]
@@ -0,0 +1,5 @@
+# Settings of the servers compared with manage.py loadtest. All its requests come from one
+# client, the token buckets and the concurrency limit would answer most of them with 429/503.
+from .settings import *
+
+THROTTLING = {}
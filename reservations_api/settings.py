@@ -42,9 +42,15 @@ INSTALLED_APPS = [
     'rest_framework',
     # my apps
     'tables',
+    'api',
 ]
 
 MIDDLEWARE = [
+    'api.profiling.ProfilingMiddleware',
+    'api.metrics.MetricsMiddleware',
+    'api.middleware.ConcurrencyLimitMiddleware',
+    'api.middleware.ASGIUrlconfMiddleware',
+    'api.middleware.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -74,6 +80,22 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'reservations_api.wsgi.application'
 
+# URLs of requests served by reservations_api.asgi, with native async read views
+ASGI_ROOT_URLCONF = 'reservations_api.asgi_urls'
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.metrics.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'api.throttling.TokenBucketThrottle',
+    ],
+    # throttled clients are told apart by REMOTE_ADDR; behind load balancers set the number
+    # of proxies, X-Forwarded-For is then read from the right by that many hops
+    'NUM_PROXIES': 0,
+}
+
 
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
@@ -82,7 +104,56 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'OPTIONS': {
+            # take the write lock at BEGIN, concurrent bookings wait instead of failing on lock upgrade
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # the in-memory test database fails fast on locks instead of waiting for the timeout
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+        # keep connections open between requests
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+    },
+    # read replica, locally a read-only connection to the same file
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': 'file:{path}?mode=ro'.format(path=BASE_DIR / 'db.sqlite3'),
+        'OPTIONS': {
+            'timeout': 20,
+        },
+        'TEST': {
+            'MIRROR': 'default',
+        },
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+    },
+}
+
+DATABASE_ROUTERS = ['api.routers.VenueRouter']
+
+# Venues served under /venues/<venue>/..., the unprefixed URLs serve DEFAULT. SHARDS maps every
+# venue to the database holding its tables, reservations, outbox and idempotency keys; venues may
+# share one. Locally a shard is another SQLite file in DATABASES, e.g.
+#   DATABASES['shard_2'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'shard_2.sqlite3'}
+# created with python manage.py migrate --database shard_2. manage.py copy_venue moves a venue.
+VENUES = {
+    'DEFAULT': 'main',
+    'SHARDS': {
+        'main': 'default',
+    },
+}
+
+# GET /reservations and GET /tables read from a random replica of their primary in ALIASES, see api.routers
+DATABASE_REPLICAS = {
+    'ALIASES': {
+        'default': ['replica'],
+    },
+    # after a write the client reads from the primary for this long (read-your-writes)
+    'PIN_SECONDS': 5,
+    'COOKIE': 'pin_primary',
 }
 
 
@@ -134,3 +205,73 @@ EMAIL_PORT = DJANGO_EMAIL_PORT
 EMAIL_HOST_USER = DJANGO_EMAIL_HOST_USER
 EMAIL_HOST_PASSWORD = DJANGO_EMAIL_HOST_PASSWORD
 EMAIL_USE_TLS = True
+
+# Delivery of queued emails (api.emails, manage.py send_queued_emails).
+# Failed emails are retried after RETRY_BACKOFF * 2 ** (attempt - 1) seconds.
+EMAIL_OUTBOX = {
+    'BATCH_SIZE': 100,
+    'MAX_ATTEMPTS': 8,
+    'RETRY_BACKOFF': 30,
+}
+
+# Responses to requests with an Idempotency-Key header are replayed to retries for TTL seconds
+# (api.idempotency), manage.py delete_expired_idempotency_keys removes the old ones.
+IDEMPOTENCY = {
+    'TTL': 24 * 60 * 60,
+}
+
+# Reservations which ended more than HORIZON_DAYS ago are moved to the archive
+# (tables.archive, manage.py archive_reservations), BATCH_SIZE bookings per transaction.
+ARCHIVE = {
+    'HORIZON_DAYS': 365,
+    'BATCH_SIZE': 1000,
+}
+
+# Token buckets per client of the views with a throttle_scope (api.throttling), kept in the
+# SQLite file PATH shared by the workers of the host. RATES maps '<scope>.<method>' or '<scope>'
+# to (tokens per second, capacity). Above MAX_CONCURRENT_REQUESTS requests in flight on the host,
+# counted over all its workers in the same file, the rest is answered with 503 (api.middleware.ConcurrencyLimitMiddleware).
+THROTTLING = {
+    'PATH': BASE_DIR / 'throttling.sqlite3',
+    'RATES': {
+        'tables': (5, 20),
+        'reservations.get': (5, 20),
+        'reservations.post': (1, 10),
+        # staff mark no shows of a whole floor at once
+        'cancel.put': (1, 20),
+        'cancel': (0.2, 5),
+    },
+    'MAX_CONCURRENT_REQUESTS': 64,
+}
+
+# Request metrics served at /metrics (api.metrics). With several worker processes set DIR
+# to a local directory shared by them, each one dumps its counters there every FLUSH_INTERVAL seconds.
+METRICS = {
+    'ENABLED': True,
+    'DIR': None,
+    'FLUSH_INTERVAL': 5,
+}
+
+# Profile SAMPLE_RATE of the requests, and requests with the HEADER signed by
+# manage.py profile_report --sign for MAX_AGE seconds (api.profiling). The cProfile stats and
+# SQL traces of the newest MAX_FILES requests are kept in DIR, manage.py profile_report sums them.
+PROFILING = {
+    'DIR': BASE_DIR / 'profiles',
+    'SAMPLE_RATE': 0,
+    'HEADER': 'X-Profile',
+    'MAX_AGE': 600,
+    'MAX_FILES': 200,
+}
+
+# Serialize list responses from .values_list() rows (tables.serializers.FastSerializer),
+# the JSON is the same as with the DRF serializers.
+FAST_SERIALIZERS = False
+
+# In-process cache of booked intervals used by GET /tables (tables.availability).
+# It is kept up to date from model signals of the process which made the write,
+# so enable it only when every write goes through the same process.
+AVAILABILITY_INDEX = {
+    'ENABLED': False,
+    'MAX_DAYS': 64,
+    'MAX_INTERVALS': 200000,
+}
@@ -1,6 +1,7 @@
 from django.contrib import admin
-from .models import Table, Reservation
+from .models import ArchivedReservation, DataVersion, Table, Reservation
 
 admin.site.register(Table)
 admin.site.register(Reservation)
-
+admin.site.register(DataVersion)
+admin.site.register(ArchivedReservation)
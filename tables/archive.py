@@ -0,0 +1,91 @@
+import time
+from functools import partial
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Q
+
+from .availability import availability_index
+from .models import ArchivedReservation, Reservation
+from .venues import current_venue
+from .versions import bump, reservation_keys
+
+
+def archive_config():
+    return getattr(settings, 'ARCHIVE', {})
+
+
+def archive_reservations(before, batch_size=None, pause=0):
+    """
+        Move reservations which ended before the given datetime into ArchivedReservation.
+
+        Every batch is copied and deleted in its own short transaction, so bookings
+        wait for at most one batch. A combined booking moves in the batch of its main
+        row, together with the rows of its other tables. Rows are deleted with plain
+        DELETE statements, without collecting and signalling them one by one; the
+        versions of the archived days are bumped once per batch instead. Occupancy
+        rollups keep counting archived reservations.
+
+        A reservation whose id the archive of the shard holds already (e.g. a row of a
+        venue moved in from another shard) stays in place with its combined booking.
+
+        Return:
+            (number of archived rows, ids of the reservations left in place)
+    """
+    batch_size = batch_size or archive_config().get('BATCH_SIZE', 1000)
+    using = router.db_for_write(Reservation)
+    main_rows = Reservation.objects.using(using).filter(end_date__lt=before, combined_with__isnull=True).order_by('id')
+    archived = 0
+    skipped = []
+    last_id = 0
+    while True:
+        ids = list(main_rows.filter(id__gt=last_id).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return archived, skipped
+        batch_archived, batch_skipped = archive_batch(ids, using)
+        archived += batch_archived
+        skipped += batch_skipped
+        last_id = ids[-1]
+        if pause:
+            time.sleep(pause)
+
+
+def archive_batch(ids, using):
+    """
+        Return:
+            (number of archived rows, ids of the rows left in place)
+    """
+    with transaction.atomic(using=using):
+        rows = list(
+            Reservation.objects.using(using).filter(Q(id__in=ids) | Q(combined_with__in=ids)).values_list(
+                'id', 'table__number', 'date', 'duration', 'end_date', 'day', 'full_name', 'phone', 'email',
+                'number_of_seats', 'no_show', 'combined_with', 'series', 'venue')
+        )
+        # ids held in the archive by any venue of the shard, the rows of their bookings are not moved
+        taken = set(ArchivedReservation._base_manager.using(using).filter(
+            id__in=[row[0] for row in rows]).values_list('id', flat=True))
+        kept_bookings = {row[11] or row[0] for row in rows if row[0] in taken}
+        skipped = [row[0] for row in rows if (row[11] or row[0]) in kept_bookings]
+        reservations = [row for row in rows if (row[11] or row[0]) not in kept_bookings]
+        if not reservations:
+            return 0, skipped
+
+        ArchivedReservation.objects.using(using).bulk_create([
+            ArchivedReservation(
+                id=id, table_number=table_number, date=date, duration=duration, end_date=end_date, day=day,
+                full_name=full_name, phone=phone, email=email, number_of_seats=number_of_seats, no_show=no_show,
+                combined_with_id=combined_with, series_id=series, venue=venue)
+            for id, table_number, date, duration, end_date, day, full_name, phone, email, number_of_seats, no_show,
+            combined_with, series, venue in reservations
+        ])
+        archived_ids = [row[0] for row in reservations]
+        with connections[using].cursor() as cursor:
+            cursor.execute("DELETE FROM {table} WHERE id IN ({ids})".format(
+                table=Reservation._meta.db_table, ids=', '.join(['%s'] * len(archived_ids))), archived_ids)
+
+        keys = sorted({key for row in reservations for key in reservation_keys(row[2], row[4])})
+        transaction.on_commit(partial(bump, keys), using=using)
+        if availability_index.enabled:
+            for reservation_id in archived_ids:
+                transaction.on_commit(partial(availability_index.reservation_deleted, current_venue(), reservation_id), using=using)
+    return len(reservations), skipped
@@ -0,0 +1,377 @@
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import router
+from django.utils import timezone
+
+from .models import Reservation, Table
+from .venues import current_venue
+
+
+def as_aware(value):
+    """
+        Naive datetimes come from the API; treat them like the ORM does (default timezone).
+    """
+    if timezone.is_naive(value):
+        return timezone.make_aware(value)
+    return value
+
+
+def service_days(start_date, finish_date):
+    """
+        Days (in the default timezone) touched by <start_date, finish_date>.
+    """
+    day = timezone.localtime(as_aware(start_date)).date()
+    last_day = timezone.localtime(as_aware(finish_date)).date()
+    while day <= last_day:
+        yield day
+        day += timedelta(days=1)
+
+
+def day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def availability_matrix(tables, reservations, start_date, end_date, slot, duration):
+    """
+        Free tables for every slot start in <start_date, end_date), one sweep over the reservations.
+
+        A booking for <t, t + duration> collides with a reservation <start, finish> when
+        start - duration <= t <= finish, so each reservation marks a contiguous run of
+        slots busy in a per-table difference array.
+
+        Args:
+            tables: [(table_id, number)]
+            reservations: [(table_id, start, finish)]
+            slot, duration: timedelta
+        Return:
+            [(slot_start, [table numbers])]
+    """
+    slots = -(-(end_date - start_date) // slot)
+    busy = {table_id: [0] * (slots + 1) for table_id, _ in tables}
+    for table_id, start, finish in reservations:
+        diff = busy.get(table_id)
+        if diff is None:
+            continue
+        first = max(-(-(start - duration - start_date) // slot), 0)
+        last = min((finish - start_date) // slot, slots - 1)
+        if first <= last:
+            diff[first] += 1
+            diff[last + 1] -= 1
+
+    free = [[] for _ in range(slots)]
+    for table_id, number in tables:
+        diff = busy[table_id]
+        running = 0
+        for k in range(slots):
+            running += diff[k]
+            if not running:
+                free[k].append(number)
+    return [(start_date + k * slot, numbers) for k, numbers in enumerate(free)]
+
+
+class TableSchedule:
+    """
+        Booked intervals of a single table sorted by start.
+        Boundaries are inclusive, the same as Reservation.objects.overlapping.
+    """
+    def __init__(self):
+        self.starts = []
+        self.intervals = []
+        self.longest = timedelta(0)
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def add(self, start_date, finish_date, reservation_id):
+        i = bisect_right(self.starts, start_date)
+        self.starts.insert(i, start_date)
+        self.intervals.insert(i, (start_date, finish_date, reservation_id))
+        self.longest = max(self.longest, finish_date - start_date)
+
+    def remove(self, reservation_id):
+        for i, interval in enumerate(self.intervals):
+            if interval[2] == reservation_id:
+                del self.starts[i]
+                del self.intervals[i]
+                return True
+        return False
+
+    def is_free(self, start_date, finish_date):
+        # only intervals starting no later than finish_date and no earlier than
+        # start_date - longest can reach into the requested range
+        i = bisect_right(self.starts, finish_date)
+        earliest = start_date - self.longest
+        while i > 0:
+            i -= 1
+            interval_start, interval_finish, _ = self.intervals[i]
+            if interval_start < earliest:
+                break
+            if interval_finish >= start_date:
+                return False
+        return True
+
+    def gaps(self, start_date, finish_date):
+        """
+            Free time between a free <start_date, finish_date> and the nearest bookings
+            before and after it, None when there is none on that side.
+        """
+        i = bisect_right(self.starts, finish_date)
+        after = self.starts[i] - finish_date if i < len(self.starts) else None
+        previous_finish = None
+        while i > 0:
+            i -= 1
+            interval_start, interval_finish, _ = self.intervals[i]
+            if previous_finish is not None and interval_start + self.longest < previous_finish:
+                break
+            if previous_finish is None or interval_finish > previous_finish:
+                previous_finish = interval_finish
+        before = start_date - previous_finish if previous_finish is not None else None
+        return before, after
+
+
+def best_fit(tables, schedules, start_date, finish_date, number_of_seats):
+    """
+        Free tables for <start_date, finish_date> ordered from the best fit.
+
+        The tightest seat range comes first, so big tables stay for big parties; ties go
+        to the table where the booking lands closest to an existing one, which keeps the
+        rest of the tables' free time in long runs instead of scattered gaps.
+
+        Args:
+            tables: Table objects fitting number_of_seats
+            schedules: {table_id: TableSchedule} of bookings around the requested time
+        Return:
+            [Table]
+    """
+    ranked = []
+    for table in tables:
+        schedule = schedules.get(table.id)
+        if schedule is None:
+            gap = None
+        elif not schedule.is_free(start_date, finish_date):
+            continue
+        else:
+            gap = min((gap for gap in schedule.gaps(start_date, finish_date) if gap is not None), default=None)
+        slack = table.max_number_of_seats - number_of_seats
+        # no neighbouring booking ranks after any gap
+        ranked.append(((slack, gap is None, gap or timedelta(0), table.number), table))
+    ranked.sort(key=lambda item: item[0])
+    return [table for _, table in ranked]
+
+
+def smallest_combination(tables, number_of_seats, max_size):
+    """
+        Fewest tables seating number_of_seats together, then fewest spare seats.
+
+        Branch and bound over the tables sorted by capacity: a branch stops when even
+        its largest remaining tables cannot seat the party or its smallest ones cannot
+        beat the best total found, and tables of equal capacity are tried only once
+        per position, as swapping them gives the same total.
+
+        Args:
+            tables: free Table objects which can be pushed together
+        Return:
+            [Table] or None
+    """
+    tables = sorted(tables, key=lambda table: (-table.max_number_of_seats, table.number))
+    capacities = [table.max_number_of_seats for table in tables]
+    for size in range(2, min(max_size, len(tables)) + 1):
+        if sum(capacities[:size]) < number_of_seats:
+            continue
+        best = [None, None]
+
+        def search(first, chosen, seats):
+            left = size - len(chosen)
+            if not left:
+                if seats >= number_of_seats and (best[0] is None or seats < best[0]):
+                    best[:] = seats, list(chosen)
+                return
+            smallest_rest = sum(capacities[len(capacities) - left + 1:]) if left > 1 else 0
+            for i in range(first, len(tables) - left + 1):
+                if i > first and capacities[i] == capacities[i - 1]:
+                    continue
+                if seats + sum(capacities[i:i + left]) < number_of_seats:
+                    break
+                if best[0] is not None and seats + capacities[i] + smallest_rest >= best[0]:
+                    continue
+                chosen.append(i)
+                search(i + 1, chosen, seats + capacities[i])
+                chosen.pop()
+                if best[0] == number_of_seats:
+                    return
+
+        search(0, [], 0)
+        if best[1] is not None:
+            return sorted((tables[i] for i in best[1]), key=lambda table: table.number)
+    return None
+
+
+def smallest_combinations(tables, number_of_seats, max_size):
+    """
+        The smallest combination of every join group, best first.
+
+        Args:
+            tables: free Table objects
+        Return:
+            [[Table]]
+    """
+    groups = {}
+    for table in tables:
+        if table.join_group:
+            groups.setdefault(table.join_group, []).append(table)
+    combinations = filter(None, (smallest_combination(group, number_of_seats, max_size) for group in groups.values()))
+    return sorted(combinations, key=lambda combination: (
+        len(combination), sum(table.max_number_of_seats for table in combination), combination[0].number))
+
+
+class DayIndex:
+    def __init__(self):
+        self.schedules = {}
+        self.table_ids = {}
+
+    def __len__(self):
+        return len(self.table_ids)
+
+    def add(self, table_id, start_date, finish_date, reservation_id):
+        self.schedules.setdefault(table_id, TableSchedule()).add(start_date, finish_date, reservation_id)
+        self.table_ids[reservation_id] = table_id
+
+    def remove(self, reservation_id):
+        table_id = self.table_ids.pop(reservation_id, None)
+        if table_id is None:
+            return False
+        return self.schedules[table_id].remove(reservation_id)
+
+    def is_free(self, table_id, start_date, finish_date):
+        schedule = self.schedules.get(table_id)
+        return schedule is None or schedule.is_free(start_date, finish_date)
+
+
+class AvailabilityIndex:
+    """
+        In-process cache of booked intervals per (venue, day, table).
+
+        Days are loaded from the database on first use and kept up to date from
+        model signals, the least recently used days are evicted once MAX_DAYS or
+        MAX_INTERVALS is exceeded. Signals only fire in the process which made the
+        write, so the index is opt-in (settings.AVAILABILITY_INDEX['ENABLED']).
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        # (venue, day) -> DayIndex
+        self.days = OrderedDict()
+        # venue -> {table id: (number, min seats, max seats)}
+        self.tables = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def config(self):
+        return getattr(settings, 'AVAILABILITY_INDEX', {})
+
+    @property
+    def enabled(self):
+        return self.config.get('ENABLED', False)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'enabled': self.enabled,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'days': len(self.days),
+                'intervals': self.size,
+            }
+
+    def clear(self):
+        with self.lock:
+            self.days.clear()
+            self.tables.clear()
+            self.size = 0
+
+    def available_tables(self, min_seats, start_date, duration):
+        start_date = as_aware(start_date)
+        finish_date = start_date + timedelta(hours=duration)
+        venue = current_venue()
+        with self.lock:
+            tables = self.get_tables(venue)
+            days = [self.get_day(venue, day) for day in service_days(start_date, finish_date)]
+            return [
+                Table(id=table_id, number=number, min_number_of_seats=min_seats_, max_number_of_seats=max_seats_)
+                for table_id, (number, min_seats_, max_seats_) in tables.items()
+                if min_seats_ <= min_seats <= max_seats_
+                and all(day.is_free(table_id, start_date, finish_date) for day in days)
+            ]
+
+    def get_tables(self, venue):
+        if venue not in self.tables:
+            rows = Table.objects.using(router.db_for_write(Table)).order_by('id').values_list('id', 'number', 'min_number_of_seats', 'max_number_of_seats')
+            self.tables[venue] = {row[0]: row[1:] for row in rows}
+        return self.tables[venue]
+
+    def get_day(self, venue, day):
+        day_index = self.days.get((venue, day))
+        if day_index is not None:
+            self.hits += 1
+            self.days.move_to_end((venue, day))
+            return day_index
+
+        self.misses += 1
+        day_index = DayIndex()
+        day_start, day_end = day_bounds(day)
+        # from the primary, a replica lagging behind would leave the day without rows signals will not re-add
+        reservations = Reservation.objects.using(router.db_for_write(Reservation))
+        rows = reservations.overlapping(day_start, day_end).values_list('id', 'table_id', 'date', 'end_date')
+        for reservation_id, table_id, start, finish in rows:
+            day_index.add(table_id, start, finish, reservation_id)
+        self.days[venue, day] = day_index
+        self.size += len(day_index)
+        self.evict(keep=(venue, day))
+        return day_index
+
+    def evict(self, keep=None):
+        max_days = self.config.get('MAX_DAYS', 64)
+        max_intervals = self.config.get('MAX_INTERVALS', 200000)
+        while len(self.days) > 1 and (len(self.days) > max_days or self.size > max_intervals):
+            key = next(iter(self.days))
+            if key == keep:
+                break
+            self.size -= len(self.days.pop(key))
+            self.evictions += 1
+
+    def reservation_saved(self, venue, reservation_id, table_id, start_date, finish_date):
+        start_date, finish_date = as_aware(start_date), as_aware(finish_date)
+        with self.lock:
+            self.reservation_deleted(venue, reservation_id)
+            for day in service_days(start_date, finish_date):
+                day_index = self.days.get((venue, day))
+                if day_index is not None:
+                    day_index.add(table_id, start_date, finish_date, reservation_id)
+                    self.size += 1
+
+    def reservation_deleted(self, venue, reservation_id):
+        with self.lock:
+            for (day_venue, _), day_index in self.days.items():
+                if day_venue == venue and day_index.remove(reservation_id):
+                    self.size -= 1
+
+    def table_saved(self, venue, table_id, number, min_seats, max_seats):
+        with self.lock:
+            if venue in self.tables:
+                self.tables[venue][table_id] = (number, min_seats, max_seats)
+
+    def table_deleted(self, venue, table_id):
+        with self.lock:
+            if venue in self.tables:
+                self.tables[venue].pop(table_id, None)
+
+
+availability_index = AvailabilityIndex()
@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from tables.archive import archive_config, archive_reservations
+from tables.venues import current_venue, is_venue, using_venue
+
+
+class Command(BaseCommand):
+    help = "Move reservations which ended more than --days ago to the archive, see GET /archive."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help="Horizon in days (default settings.ARCHIVE['HORIZON_DAYS']).")
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--pause', type=float, default=0, help="Seconds to wait between batches.")
+        parser.add_argument('--venue', default=None, help="Venue to archive (default settings.VENUES['DEFAULT']).")
+
+    def handle(self, *args, **options):
+        days = options['days'] if options['days'] is not None else archive_config().get('HORIZON_DAYS', 365)
+        if days < 1:
+            raise CommandError("--days must be positive")
+        if options['venue'] and not is_venue(options['venue']):
+            raise CommandError("Unknown venue {venue}".format(venue=options['venue']))
+        before = timezone.now() - timedelta(days=days)
+        with using_venue(options['venue']):
+            archived, skipped = archive_reservations(before, options['batch_size'], options['pause'])
+            self.stdout.write(self.style.SUCCESS("Archived {archived} reservations of {venue} which ended before {before}".format(
+                archived=archived, venue=current_venue(), before=before.strftime("%Y-%m-%d %H:%M"))))
+            if skipped:
+                self.stdout.write(self.style.WARNING(
+                    "Left {count} reservations in place, the archive holds their ids already: {ids}".format(
+                        count=len(skipped), ids=', '.join(map(str, skipped)))))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tables.models import Table
+from tables.rollups import rebuild_occupancy
+from tables.venues import is_venue, using_venue
+
+
+class Command(BaseCommand):
+    help = "Recompute the occupancy rollups (GET /analytics/occupancy) from the reservations, one table at a time."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--table', type=int, action='append', help="Table number, all tables by default.")
+        parser.add_argument('--venue', default=None, help="Venue of the tables (default settings.VENUES['DEFAULT']).")
+
+    def handle(self, *args, **options):
+        if options['venue'] and not is_venue(options['venue']):
+            raise CommandError("Unknown venue {venue}".format(venue=options['venue']))
+        with using_venue(options['venue']):
+            self.backfill(options)
+
+    def backfill(self, options):
+        tables = Table.objects.order_by('number')
+        if options['table']:
+            tables = tables.filter(number__in=options['table'])
+            if not tables.exists():
+                raise CommandError("No such tables")
+        counted = 0
+        for table in tables:
+            counted += rebuild_occupancy(table)
+        self.stdout.write(self.style.SUCCESS("Counted {counted} reservations of {tables} tables".format(
+            counted=counted, tables=tables.count())))
@@ -0,0 +1,62 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from tables.models import Reservation, Table
+from tables.serializers import FastReservationSerializer, ReservationSerializer
+
+
+class Command(BaseCommand):
+    help = "Compare ReservationSerializer with FastReservationSerializer on in-memory rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+        parser.add_argument('--repeat', type=int, default=3, help="Best of this many runs is reported.")
+
+    def handle(self, *args, **options):
+        renderer = JSONRenderer()
+        self.stdout.write("{:>8} {:>12} {:>12} {:>8}".format("rows", "drf [ms]", "fast [ms]", "speedup"))
+        for size in options['sizes']:
+            reservations = self.make_reservations(size)
+            rows = [
+                (r.table.number, r.date, r.duration, r.full_name, r.phone, r.email, r.number_of_seats)
+                for r in reservations
+            ]
+
+            drf, drf_json = self.measure(options['repeat'], lambda: renderer.render(ReservationSerializer(reservations, many=True).data))
+            fast, fast_json = self.measure(options['repeat'], lambda: renderer.render(FastReservationSerializer.from_rows(rows)))
+            if drf_json != fast_json:
+                raise CommandError("Serializers produced different JSON for {size} rows".format(size=size))
+
+            self.stdout.write("{:>8} {:>12.1f} {:>12.1f} {:>7.1f}x".format(size, drf * 1000, fast * 1000, drf / fast))
+
+    def measure(self, repeat, func):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    def make_reservations(self, size):
+        rng = random.Random(size)
+        tables = [Table(id=n, number=n, min_number_of_seats=2, max_number_of_seats=6) for n in range(1, 51)]
+        start = timezone.make_aware(datetime(2021, 10, 19, 12))
+        return [
+            Reservation(
+                id=i,
+                table=rng.choice(tables),
+                date=start + timedelta(minutes=15 * rng.randrange(40)),
+                duration=rng.randint(1, 4),
+                full_name="Guest {i}".format(i=i),
+                phone="997 {i:06d}".format(i=i),
+                email="guest{i}@email.com".format(i=i),
+                number_of_seats=rng.randint(2, 6),
+            )
+            for i in range(1, size + 1)
+        ]
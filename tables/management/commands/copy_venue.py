@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from tables.shards import copy_missing, copy_venue, purge_venue, unfreeze_venue
+from tables.venues import is_venue, venue_database
+
+
+class Command(BaseCommand):
+    help = (
+        "Move a venue to another shard while it is served: copy it and freeze it in the old one (--to), "
+        "switch settings.VENUES, then remove it from the old shard (--purge)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('venue')
+        actions = parser.add_mutually_exclusive_group(required=True)
+        actions.add_argument('--to', help="Database alias of the new shard, migrated already.")
+        actions.add_argument('--purge', help="Database alias to delete the venue's rows from, after the switch.")
+        actions.add_argument('--from', dest='source', help="Database alias to copy rows written past the freeze from, after the switch.")
+        actions.add_argument('--unfreeze', action='store_true', help="Call the move off before the switch.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        venue = options['venue']
+        if not is_venue(venue):
+            raise CommandError("Unknown venue {venue}".format(venue=venue))
+        alias = options['to'] or options['purge'] or options['source']
+        if alias and alias not in connections:
+            raise CommandError("Unknown database {alias}".format(alias=alias))
+
+        try:
+            if options['unfreeze']:
+                unfreeze_venue(venue)
+                self.stdout.write(self.style.SUCCESS("{venue} is written in {alias} again".format(
+                    venue=venue, alias=venue_database(venue))))
+                return
+            if options['purge']:
+                purge_venue(venue, alias)
+                self.stdout.write(self.style.SUCCESS("Deleted {venue} from {alias}".format(venue=venue, alias=alias)))
+                return
+            if options['source']:
+                counts = copy_missing(venue, alias, options['batch_size'])
+            else:
+                counts = copy_venue(venue, alias, options['batch_size'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        for model, count in counts.items():
+            self.stdout.write("{model}: {count}".format(model=model, count=count))
+        if options['source']:
+            self.stdout.write(self.style.SUCCESS("Copied the missing rows of {venue} from {alias}".format(venue=venue, alias=alias)))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            "Copied {venue} from {source} to {alias}, writes in {source} answer 503 now. "
+            "Set settings.VENUES['SHARDS']['{venue}'] = '{alias}', reload the workers, "
+            "then run copy_venue {venue} --purge {source}".format(venue=venue, source=venue_database(venue), alias=alias)))
@@ -0,0 +1,135 @@
+import random
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from tables.availability import TableSchedule
+from tables.models import DataVersion, OccupancyRollup, Reservation, ReservationSeries, Table
+from tables.venues import current_venue, is_venue, using_venue
+from tables.versions import TABLES_KEY, bump, day_key
+
+FIRST_NAMES = ["Paul", "Anna", "John", "Maria", "Piotr", "Kasia", "Tom", "Eva", "Marek", "Olga"]
+LAST_NAMES = ["Smith", "Nowak", "Kowalski", "Brown", "Wisniewska", "Taylor", "Lewandowski", "Green"]
+
+
+class Command(BaseCommand):
+    help = "Generate tables and non-overlapping reservations for load testing."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tables', type=int, default=50)
+        parser.add_argument('--per-day', type=int, default=200, help="Reservations attempted per day.")
+        parser.add_argument('--days', type=int, default=30)
+        parser.add_argument('--start', default=None, help="First day, YYYY-MM-DD (default today).")
+        parser.add_argument('--seats', type=int, nargs=2, default=[1, 12], metavar=('MIN', 'MAX'),
+                            help="Range of table sizes.")
+        parser.add_argument('--durations', type=int, nargs='+', default=[1, 2, 3], help="Durations in hours to pick from.")
+        parser.add_argument('--join-group-size', type=int, default=0,
+                            help="Put every this many consecutive tables in a join group (0 - no groups).")
+        parser.add_argument('--open-hours', type=int, nargs=2, default=[10, 23], metavar=('OPEN', 'CLOSE'))
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--clear', action='store_true', help="Delete existing tables and reservations of the venue first.")
+        parser.add_argument('--venue', default=None, help="Venue to seed (default settings.VENUES['DEFAULT']).")
+
+    def handle(self, *args, **options):
+        if options['venue'] and not is_venue(options['venue']):
+            raise CommandError("Unknown venue {venue}".format(venue=options['venue']))
+        with using_venue(options['venue']):
+            self.seed(options)
+
+    def seed(self, options):
+        rng = random.Random(options['seed'])
+        min_seats, max_seats = options['seats']
+        open_hour, close_hour = options['open_hours']
+        if not 1 <= min_seats <= max_seats or not 0 <= open_hour < close_hour <= 24:
+            raise CommandError("Invalid --seats or --open-hours")
+        if options['start']:
+            first_day = datetime.strptime(options['start'], "%Y-%m-%d")
+        else:
+            first_day = datetime.combine(timezone.localdate(), datetime.min.time())
+
+        if options['clear']:
+            self.clear()
+
+        tables = self.create_tables(rng, options['tables'], min_seats, max_seats, options['join_group_size'])
+        created = 0
+        batch = []
+        for day in range(options['days']):
+            day_start = timezone.make_aware(first_day + timedelta(days=day, hours=open_hour))
+            schedules = {table.id: TableSchedule() for table in tables}
+            for _ in range(options['per_day']):
+                table = rng.choice(tables)
+                duration = rng.choice(options['durations'])
+                slots = max((close_hour - open_hour - duration) * 4, 1)
+                date = day_start + timedelta(minutes=15 * rng.randrange(slots))
+                finish = date + timedelta(hours=duration)
+                if not schedules[table.id].is_free(date, finish):
+                    continue
+                schedules[table.id].add(date, finish, None)
+                batch.append(self.make_reservation(rng, table, date, duration))
+                if len(batch) >= options['batch_size']:
+                    created += self.flush(batch)
+            self.stdout.write("Day {day}: {created} reservations".format(day=(day_start.date()), created=created + len(batch)))
+        created += self.flush(batch)
+        bump([TABLES_KEY] + [day_key((first_day + timedelta(days=day)).date()) for day in range(options['days'] + 1)])
+        self.stdout.write(self.style.SUCCESS("Created {tables} tables and {created} reservations".format(
+            tables=len(tables), created=created)))
+        # bulk_create sent no signals, the occupancy rollups do not count the seeded rows yet
+        self.stdout.write("Run backfill_occupancy to count them in GET /analytics/occupancy")
+
+    def clear(self):
+        """
+            Plain DELETE statements - collecting and signalling a million rows one by one
+            would take longer than generating them. Every version is bumped instead.
+        """
+        using = router.db_for_write(Reservation)
+        venue = current_venue()
+        with transaction.atomic(using=using), connections[using].cursor() as cursor:
+            cursor.execute("DELETE FROM {} WHERE venue = %s".format(Reservation._meta.db_table), [venue])
+            cursor.execute("DELETE FROM {} WHERE venue = %s".format(ReservationSeries._meta.db_table), [venue])
+            cursor.execute("DELETE FROM {} WHERE table_id IN (SELECT id FROM {} WHERE venue = %s)".format(
+                OccupancyRollup._meta.db_table, Table._meta.db_table), [venue])
+            cursor.execute("DELETE FROM {} WHERE venue = %s".format(Table._meta.db_table), [venue])
+        DataVersion.objects.update(version=F('version') + 1, modified=timezone.now())
+
+    def create_tables(self, rng, count, min_seats, max_seats, join_group_size):
+        next_number = (Table.objects.order_by('-number').values_list('number', flat=True).first() or 0) + 1
+        tables = []
+        for number in range(next_number, next_number + count):
+            low = rng.randint(min_seats, max_seats)
+            high = min(low + rng.randint(0, 4), max_seats)
+            join_group = 'group-{}'.format((number - next_number) // join_group_size) if join_group_size else ''
+            tables.append(Table(number=number, min_number_of_seats=low, max_number_of_seats=high, join_group=join_group))
+        with transaction.atomic(using=router.db_for_write(Reservation)):
+            Table.objects.bulk_create(tables)
+        if any(table.id is None for table in tables):
+            tables = list(Table.objects.filter(number__gte=next_number))
+        return tables
+
+    def make_reservation(self, rng, table, date, duration):
+        name = "{} {}".format(rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES))
+        r = Reservation(
+            table=table,
+            date=date,
+            duration=duration,
+            full_name=name,
+            phone="{:03d} {:03d} {:03d}".format(rng.randrange(1000), rng.randrange(1000), rng.randrange(1000)),
+            email="{}@email.com".format(name.lower().replace(' ', '.')),
+            number_of_seats=rng.randint(table.min_number_of_seats, table.max_number_of_seats),
+        )
+        r.fill_derived_fields()
+        return r
+
+    def flush(self, batch):
+        """
+            Insert and empty the batch. bulk_create sends no signals, the seeded days'
+            versions are bumped once at the end.
+        """
+        count = len(batch)
+        with transaction.atomic(using=router.db_for_write(Reservation)):
+            Reservation.objects.bulk_create(batch)
+        batch.clear()
+        return count
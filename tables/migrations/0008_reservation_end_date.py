@@ -0,0 +1,42 @@
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+def backfill_end_date(apps, schema_editor):
+    Reservation = apps.get_model('tables', 'Reservation')
+    reservations = Reservation.objects.using(schema_editor.connection.alias).order_by('id')
+    last_id = 0
+    while True:
+        batch = list(reservations.filter(id__gt=last_id).only('id', 'date', 'duration')[:2000])
+        if not batch:
+            break
+        for reservation in batch:
+            reservation.end_date = reservation.date + timedelta(hours=int(reservation.duration))
+        reservations.bulk_update(batch, ['end_date'])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tables', '0007_reservation_verification_code'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reservation',
+            name='end_date',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_end_date, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='reservation',
+            name='end_date',
+            field=models.DateTimeField(editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['end_date', 'date'], name='reservation_end_date_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tables', '0008_reservation_end_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=32, unique=True)),
+                ('version', models.IntegerField(default=0)),
+                ('modified', models.DateTimeField()),
+            ],
+        ),
+    ]
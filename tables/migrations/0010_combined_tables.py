@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tables', '0009_dataversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reservation',
+            name='combined_with',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='combined_tables', to='tables.reservation'),
+        ),
+        migrations.AddField(
+            model_name='table',
+            name='join_group',
+            field=models.CharField(blank=True, default='', max_length=31),
+        ),
+    ]
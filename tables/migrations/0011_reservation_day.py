@@ -0,0 +1,65 @@
+from django.db import migrations, models
+from django.db.models import Count
+from django.utils import timezone
+
+
+def backfill_day(apps, schema_editor):
+    Reservation = apps.get_model('tables', 'Reservation')
+    reservations = Reservation.objects.using(schema_editor.connection.alias).order_by('id')
+    default_timezone = timezone.get_default_timezone()
+    last_id = 0
+    while True:
+        batch = list(reservations.filter(id__gt=last_id).only('id', 'date')[:2000])
+        if not batch:
+            break
+        for reservation in batch:
+            reservation.day = timezone.localtime(reservation.date, default_timezone).date()
+        reservations.bulk_update(batch, ['day'])
+        last_id = batch[-1].id
+
+
+def check_table_numbers(apps, schema_editor):
+    Table = apps.get_model('tables', 'Table')
+    duplicates = list(
+        Table.objects.using(schema_editor.connection.alias)
+        .values('number').annotate(count=Count('id')).filter(count__gt=1).values_list('number', flat=True)
+    )
+    if duplicates:
+        raise RuntimeError(
+            "Table numbers {numbers} are used more than once, renumber the tables before migrating".format(
+                numbers=sorted(duplicates)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tables', '0010_combined_tables'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reservation',
+            name='day',
+            field=models.DateField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_day, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='reservation',
+            name='day',
+            field=models.DateField(editable=False),
+        ),
+        migrations.RunPython(check_table_numbers, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='table',
+            name='number',
+            field=models.IntegerField(unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['table', 'date'], name='reservation_table_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['day', 'date'], name='reservation_day_date_idx'),
+        ),
+    ]
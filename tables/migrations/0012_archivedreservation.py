@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tables', '0011_reservation_day'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedReservation',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('table_number', models.IntegerField()),
+                ('date', models.DateTimeField()),
+                ('duration', models.IntegerField()),
+                ('end_date', models.DateTimeField()),
+                ('day', models.DateField()),
+                ('full_name', models.CharField(max_length=255)),
+                ('phone', models.CharField(max_length=31)),
+                ('email', models.EmailField(max_length=254)),
+                ('number_of_seats', models.IntegerField()),
+                ('combined_with_id', models.BigIntegerField(blank=True, null=True)),
+                ('archived', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day', 'date'], name='archived_day_date_idx')],
+            },
+        ),
+    ]
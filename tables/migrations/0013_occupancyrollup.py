@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tables', '0012_archivedreservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedreservation',
+            name='no_show',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='no_show',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='OccupancyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('seat_minutes', models.BigIntegerField(default=0)),
+                ('bookings', models.IntegerField(default=0)),
+                ('cancellations', models.IntegerField(default=0)),
+                ('no_shows', models.IntegerField(default=0)),
+                ('table', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tables.table')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hour'], name='occupancy_hour_idx')],
+                'constraints': [models.UniqueConstraint(fields=('table', 'hour'), name='occupancy_table_hour_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:58
+
+import tables.venues
+from django.db import migrations, models
+
+
+def assign_shard_venue(apps, schema_editor):
+    # a database which served one restaurant before becomes the shard of its venue in settings.VENUES
+    alias = schema_editor.connection.alias
+    venue = tables.venues.venue_databases().get(alias)
+    if venue is None or venue == tables.venues.current_venue():
+        return
+    for model in ('Table', 'Reservation', 'ArchivedReservation'):
+        apps.get_model('tables', model).objects.using(alias).update(venue=venue)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tables', '0013_occupancyrollup'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='archivedreservation',
+            name='archived_day_date_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='reservation',
+            name='reservation_day_date_idx',
+        ),
+        migrations.AddField(
+            model_name='archivedreservation',
+            name='venue',
+            field=models.CharField(default=tables.venues.current_venue, max_length=31),
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='venue',
+            field=models.CharField(default=tables.venues.current_venue, max_length=31),
+        ),
+        migrations.AddField(
+            model_name='table',
+            name='venue',
+            field=models.CharField(default=tables.venues.current_venue, max_length=31),
+        ),
+        migrations.RunPython(assign_shard_venue, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='table',
+            name='number',
+            field=models.IntegerField(),
+        ),
+        migrations.AddIndex(
+            model_name='archivedreservation',
+            index=models.Index(fields=['venue', 'day', 'date'], name='archived_day_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['venue', 'day', 'date'], name='reservation_day_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='table',
+            constraint=models.UniqueConstraint(fields=('venue', 'number'), name='table_venue_number_unique'),
+        ),
+    ]
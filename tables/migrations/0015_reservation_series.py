@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:03
+
+import django.db.models.deletion
+import tables.venues
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tables', '0014_venue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedreservation',
+            name='series_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ReservationSeries',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('venue', models.CharField(default=tables.venues.current_venue, max_length=31)),
+                ('date', models.DateTimeField()),
+                ('duration', models.IntegerField()),
+                ('frequency', models.CharField(blank=True, choices=[('daily', 'daily'), ('weekly', 'weekly')], default='', max_length=7)),
+                ('interval', models.IntegerField(default=1)),
+                ('full_name', models.CharField(max_length=255)),
+                ('phone', models.CharField(max_length=31)),
+                ('email', models.EmailField(max_length=254)),
+                ('number_of_seats', models.IntegerField()),
+                ('verification_code', models.IntegerField(default=0)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('table', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tables.table')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='series',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='tables.reservationseries'),
+        ),
+    ]
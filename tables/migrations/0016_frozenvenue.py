@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tables', '0015_reservation_series'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FrozenVenue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('venue', models.CharField(max_length=31, unique=True)),
+                ('since', models.DateTimeField(auto_now_add=True)),
+                ('copied', models.JSONField(default=dict)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tables', '0016_frozenvenue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='frozenvenue',
+            name='caught_up',
+            field=models.JSONField(default=dict),
+        ),
+    ]
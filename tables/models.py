@@ -1,27 +1,209 @@
 from django.db import models
 from django.db.models.deletion import CASCADE
-from django.db.models.fields import CharField, DateTimeField, EmailField, IntegerField
+from django.db.models.fields import CharField, DateField, DateTimeField, EmailField, IntegerField
 from django.db.models.fields.related import ForeignKey
+from django.utils import timezone
 from datetime import timedelta
 
+from .venues import current_venue
+
+class VenueManager(models.Manager):
+    """
+        Rows of the current venue (tables.venues.current_venue), _base_manager sees every venue of the shard.
+    """
+    def get_queryset(self):
+        return super().get_queryset().filter(venue=current_venue())
+
 class Table(models.Model):
+    # venues sharing a database (shard) are told apart by this column
+    venue = CharField(max_length=31, default=current_venue)
     number = models.IntegerField()
     min_number_of_seats = IntegerField()
     max_number_of_seats = IntegerField()
+    # tables of the same group can be pushed together for a larger party
+    join_group = CharField(max_length=31, blank=True, default='')
+
+    objects = VenueManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['venue', 'number'], name='table_venue_number_unique'),
+        ]
 
     def __str__(self):
         return str(self.number)
 
+class ReservationQuerySet(models.QuerySet):
+    def overlapping(self, start_date, finish_date):
+        """
+            Reservations which share any moment with <start_date, finish_date>.
+            Boundaries are inclusive, so a booking ending exactly at start_date is a conflict.
+        """
+        return self.filter(date__lte=finish_date, end_date__gte=start_date)
+
 class Reservation(models.Model):
+    venue = CharField(max_length=31, default=current_venue)
     table = ForeignKey("Table", on_delete=CASCADE)
     date = DateTimeField()
     duration = IntegerField()
+    end_date = DateTimeField(editable=False)
+    # service day of date in the default timezone, lists by day use the (day, date) index
+    day = DateField(editable=False)
     full_name = CharField(max_length=255)
     phone = CharField(max_length=31)
     email = EmailField()
     number_of_seats = IntegerField()
     verification_code = IntegerField(default=0)
+    no_show = models.BooleanField(default=False)
+    # set on the rows holding the other tables of a combined booking
+    combined_with = ForeignKey("self", on_delete=CASCADE, null=True, blank=True, related_name='combined_tables')
+    # occurrence of a recurring or multi-date booking
+    series = ForeignKey("ReservationSeries", on_delete=CASCADE, null=True, blank=True, related_name='reservations')
+
+    objects = VenueManager.from_queryset(ReservationQuerySet)()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['end_date', 'date'], name='reservation_end_date_idx'),
+            models.Index(fields=['table', 'date'], name='reservation_table_date_idx'),
+            models.Index(fields=['venue', 'day', 'date'], name='reservation_day_date_idx'),
+        ]
 
     def finish_hour(self):
         duration_time = timedelta(hours=int(self.duration))
         return self.date + duration_time 
+
+    def fill_derived_fields(self):
+        """
+            Keep stored columns computed from date and duration in sync.
+            Called on save; bulk_create callers have to call it themselves.
+        """
+        self.end_date = self.finish_hour()
+        self.day = service_day(self.date)
+
+    def save(self, *args, **kwargs):
+        self.fill_derived_fields()
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # days the reservation occupied when loaded, to notify them as well if it moves
+        instance.loaded_dates = (instance.__dict__.get('date'), instance.__dict__.get('end_date'))
+        # what it added to the occupancy rollups, see tables.rollups
+        instance.loaded_occupancy = tuple(
+            instance.__dict__.get(field) for field in ('table_id', 'date', 'end_date', 'number_of_seats', 'no_show'))
+        return instance
+
+class ArchivedReservation(models.Model):
+    """
+        Past reservation moved out of Reservation by tables.archive, keeping its id.
+        The table is stored by number, archived rows outlive the tables.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    venue = CharField(max_length=31, default=current_venue)
+    table_number = IntegerField()
+    date = DateTimeField()
+    duration = IntegerField()
+    end_date = DateTimeField()
+    day = DateField()
+    full_name = CharField(max_length=255)
+    phone = CharField(max_length=31)
+    email = EmailField()
+    number_of_seats = IntegerField()
+    no_show = models.BooleanField(default=False)
+    combined_with_id = models.BigIntegerField(null=True, blank=True)
+    series_id = models.BigIntegerField(null=True, blank=True)
+    archived = DateTimeField(auto_now_add=True)
+
+    objects = VenueManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['venue', 'day', 'date'], name='archived_day_date_idx'),
+        ]
+
+class ReservationSeries(models.Model):
+    """
+        Booking of one table for many dates, materialized as Reservation rows (its occurrences).
+        A rule repeats date every interval days or weeks, a series of listed dates has no frequency.
+    """
+    FREQUENCIES = {'daily': 1, 'weekly': 7}
+
+    venue = CharField(max_length=31, default=current_venue)
+    table = ForeignKey("Table", on_delete=CASCADE)
+    # first occurrence
+    date = DateTimeField()
+    duration = IntegerField()
+    frequency = CharField(max_length=7, blank=True, default='', choices=[(name, name) for name in FREQUENCIES])
+    interval = IntegerField(default=1)
+    full_name = CharField(max_length=255)
+    phone = CharField(max_length=31)
+    email = EmailField()
+    number_of_seats = IntegerField()
+    verification_code = IntegerField(default=0)
+    created = DateTimeField(auto_now_add=True)
+
+    objects = VenueManager()
+
+    def rule_dates(self, count):
+        """
+            The first count dates of the rule. Occurrences keep the wall clock time of date
+            in the default timezone across DST changes.
+        """
+        first = self.date if timezone.is_naive(self.date) else timezone.localtime(self.date).replace(tzinfo=None)
+        step = timedelta(days=self.FREQUENCIES[self.frequency] * self.interval)
+        return [timezone.make_aware(first + step * i) for i in range(count)]
+
+def service_day(value):
+    """
+        Day of value in the default timezone, naive values are taken as in it already.
+    """
+    if timezone.is_naive(value):
+        return value.date()
+    return timezone.localtime(value, timezone.get_default_timezone()).date()
+
+class OccupancyRollup(models.Model):
+    """
+        Bookings of a table in an hour (UTC), maintained by tables.rollups.
+        Cancelled reservations leave their booking and cancellation counted, but not their seat minutes.
+    """
+    table = ForeignKey("Table", on_delete=CASCADE)
+    hour = DateTimeField()
+    # seats times minutes of the hour they were booked for
+    seat_minutes = models.BigIntegerField(default=0)
+    # reservations starting in the hour
+    bookings = IntegerField(default=0)
+    cancellations = IntegerField(default=0)
+    no_shows = IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['table', 'hour'], name='occupancy_table_hour_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['hour'], name='occupancy_hour_idx'),
+        ]
+
+class FrozenVenue(models.Model):
+    """
+        Venue being moved away from this shard by tables.shards.copy_venue; its tables,
+        reservations and series are not written here meanwhile, see tables.signals.
+    """
+    venue = CharField(max_length=31, unique=True)
+    since = DateTimeField(auto_now_add=True)
+    # {model name: highest id copied}, rows above it were written past the freeze
+    copied = models.JSONField(default=dict)
+    # {model name: [ids]} of rows past the freeze copied since by copy_missing
+    caught_up = models.JSONField(default=dict)
+
+class DataVersion(models.Model):
+    """
+        Change counter of a part of the data, see tables.versions.
+    """
+    key = CharField(max_length=32, unique=True)
+    version = IntegerField(default=0)
+    modified = DateTimeField()
+
+    def __str__(self):
+        return "{key} v{version}".format(key=self.key, version=self.version)
@@ -0,0 +1,77 @@
+import asyncio
+import threading
+
+# sent instead of the backlog of a subscriber which fell behind, it should fetch the state again
+RESET = {'type': 'reset'}
+
+
+class Broker:
+    """
+        In-process fan-out of events to asyncio subscribers.
+
+        Subscribers live on event loops (ASGI), publishers are usually threads running
+        sync views, so events are handed over with call_soon_threadsafe - once per loop,
+        which then delivers to all of its queues. Queues are bounded, a subscriber
+        which falls behind gets RESET instead of an ever growing backlog.
+
+        Like the availability index, only writes of this process are published.
+    """
+    def __init__(self, max_queue=100):
+        self.lock = threading.Lock()
+        # key -> {loop: {queue}}
+        self.subscribers = {}
+        self.max_queue = max_queue
+
+    def subscribe(self, key):
+        queue = asyncio.Queue(self.max_queue)
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            self.subscribers.setdefault(key, {}).setdefault(loop, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, key, queue):
+        with self.lock:
+            loops = self.subscribers.get(key, {})
+            for loop, queues in list(loops.items()):
+                queues.discard(queue)
+                if not queues:
+                    del loops[loop]
+            if not loops:
+                self.subscribers.pop(key, None)
+
+    def publish(self, key, event):
+        """
+            Return:
+                number of subscribers the event was handed to
+        """
+        with self.lock:
+            targets = [(loop, list(queues)) for loop, queues in self.subscribers.get(key, {}).items()]
+        delivered = 0
+        for loop, queues in targets:
+            try:
+                loop.call_soon_threadsafe(deliver, queues, event)
+            except RuntimeError:
+                # the loop was closed without unsubscribing
+                continue
+            delivered += len(queues)
+        return delivered
+
+    def stats(self):
+        with self.lock:
+            return {
+                'keys': len(self.subscribers),
+                'subscribers': sum(len(queues) for loops in self.subscribers.values() for queues in loops.values()),
+            }
+
+
+def deliver(queues, event):
+    for queue in queues:
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(RESET)
+
+
+broker = Broker()
@@ -0,0 +1,197 @@
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import connections, router, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .availability import as_aware
+from .models import ArchivedReservation, OccupancyRollup, Reservation, Table
+from .venues import current_venue
+
+HOUR = timedelta(hours=1)
+
+# position of the counters in a delta
+SEAT_MINUTES, BOOKINGS, CANCELLATIONS, NO_SHOWS = range(4)
+
+
+def hour_start(value):
+    return as_aware(value).astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def add_occupancy(deltas, table_id, start_date, finish_date, seats, sign=1):
+    """
+        Add seats times the minutes of <start_date, finish_date> falling into every hour.
+        Rounded per hour, so taking a reservation away subtracts exactly what adding it added.
+    """
+    start, finish = as_aware(start_date), as_aware(finish_date)
+    hour = hour_start(start)
+    while hour < finish:
+        seconds = (min(finish, hour + HOUR) - max(start, hour)).total_seconds()
+        deltas.setdefault((table_id, hour), [0, 0, 0, 0])[SEAT_MINUTES] += sign * round(seats * seconds / 60)
+        hour += HOUR
+
+
+def add_count(deltas, table_id, start_date, counter, value=1):
+    deltas.setdefault((table_id, hour_start(start_date)), [0, 0, 0, 0])[counter] += value
+
+
+def apply_deltas(deltas, using):
+    """
+        Add the deltas to the rollup rows with one upsert per row, in (table, hour) order
+        so concurrent writers lock the rows in the same order.
+    """
+    if not deltas:
+        return
+    connection = connections[using]
+    table = OccupancyRollup._meta.db_table
+    sql = (
+        "INSERT INTO {table} (table_id, hour, seat_minutes, bookings, cancellations, no_shows) "
+        "VALUES (%s, %s, %s, %s, %s, %s) "
+        "ON CONFLICT (table_id, hour) DO UPDATE SET "
+        "seat_minutes = {table}.seat_minutes + excluded.seat_minutes, "
+        "bookings = {table}.bookings + excluded.bookings, "
+        "cancellations = {table}.cancellations + excluded.cancellations, "
+        "no_shows = {table}.no_shows + excluded.no_shows"
+    ).format(table=table)
+    rows = [
+        (table_id, connection.ops.adapt_datetimefield_value(hour), *delta)
+        for (table_id, hour), delta in sorted(deltas.items())
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def record_booked(reservations, using=None):
+    """
+        Called in the transaction which creates the reservations, the rollups commit with them.
+    """
+    deltas = {}
+    for r in reservations:
+        add_occupancy(deltas, r.table_id, r.date, r.end_date, r.number_of_seats)
+        add_count(deltas, r.table_id, r.date, BOOKINGS)
+        if r.no_show:
+            add_count(deltas, r.table_id, r.date, NO_SHOWS)
+    apply_deltas(deltas, using or router.db_for_write(OccupancyRollup))
+
+
+def record_changed(loaded, reservation, using=None):
+    """
+        Replace what the reservation counted when it was loaded, loaded is its
+        (table_id, date, end_date, number_of_seats, no_show) then.
+    """
+    table_id, date, end_date, seats, no_show = loaded
+    deltas = {}
+    add_occupancy(deltas, table_id, date, end_date, seats, sign=-1)
+    add_count(deltas, table_id, date, BOOKINGS, -1)
+    add_count(deltas, table_id, date, NO_SHOWS, -int(no_show))
+    add_occupancy(deltas, reservation.table_id, reservation.date, reservation.end_date, reservation.number_of_seats)
+    add_count(deltas, reservation.table_id, reservation.date, BOOKINGS)
+    add_count(deltas, reservation.table_id, reservation.date, NO_SHOWS, int(reservation.no_show))
+    apply_deltas({key: delta for key, delta in deltas.items() if any(delta)}, using or router.db_for_write(OccupancyRollup))
+
+
+def counted(reservation):
+    """
+        (table_id, date, end_date, number_of_seats, no_show) the reservation is counted with,
+        as it was loaded - see Reservation.from_db.
+    """
+    loaded = getattr(reservation, 'loaded_occupancy', None)
+    if loaded is None or None in loaded:
+        return (reservation.table_id, reservation.date, reservation.end_date, reservation.number_of_seats, reservation.no_show)
+    return loaded
+
+
+def record_cancelled(reservations, using=None):
+    """
+        Called in the transaction which deletes the reservations, by the post_delete and
+        reservations_bulk_deleted receivers; their seats are freed, the bookings stay
+        counted together with the cancellations.
+    """
+    deltas = {}
+    for r in reservations:
+        table_id, date, end_date, seats, _ = counted(r)
+        add_occupancy(deltas, table_id, date, end_date, seats, sign=-1)
+        add_count(deltas, table_id, date, CANCELLATIONS)
+    apply_deltas(deltas, using or router.db_for_write(OccupancyRollup))
+
+
+def rebuild_occupancy(table, using=None):
+    """
+        Recompute the rollups of a table from its reservations, archived ones included.
+
+        Runs under the lock of the table's row, which bookings take as well. Cancellations
+        cannot be recomputed from the deleted rows, their counts are kept and still count
+        as bookings.
+
+        Return:
+            number of reservations counted
+    """
+    using = using or router.db_for_write(OccupancyRollup)
+    with transaction.atomic(using=using):
+        list(Table.objects.using(using).select_for_update().filter(id=table.id).values_list('id'))
+        OccupancyRollup.objects.using(using).filter(table=table).update(
+            seat_minutes=0, bookings=F('cancellations'), no_shows=0)
+        deltas = {}
+        rows = [
+            Reservation.objects.using(using).filter(table=table).values_list(
+                'date', 'end_date', 'number_of_seats', 'no_show').iterator(chunk_size=2000),
+            ArchivedReservation.objects.using(using).filter(table_number=table.number).values_list(
+                'date', 'end_date', 'number_of_seats', 'no_show').iterator(chunk_size=2000),
+        ]
+        counted = 0
+        for queryset in rows:
+            for date, end_date, seats, no_show in queryset:
+                add_occupancy(deltas, table.id, date, end_date, seats)
+                add_count(deltas, table.id, date, BOOKINGS)
+                if no_show:
+                    add_count(deltas, table.id, date, NO_SHOWS)
+                counted += 1
+        apply_deltas(deltas, using)
+    return counted
+
+
+def occupancy_summary(start_date, end_date):
+    """
+        Totals, seat hours per table and an ISO weekday x hour heatmap (in the current timezone)
+        of the current venue's rollup rows in <start_date, end_date).
+    """
+    rollups = OccupancyRollup.objects.filter(table__venue=current_venue(), hour__gte=start_date, hour__lt=end_date)
+    hours = (end_date - start_date).total_seconds() / 3600
+
+    tables = []
+    per_table = rollups.values('table__number', 'table__max_number_of_seats').annotate(
+        seat_minutes=Sum('seat_minutes'), bookings=Sum('bookings'),
+        cancellations=Sum('cancellations'), no_shows=Sum('no_shows')).order_by('table__number')
+    totals = dict.fromkeys(['seat_minutes', 'bookings', 'cancellations', 'no_shows'], 0)
+    for row in per_table:
+        for key in totals:
+            totals[key] += row[key]
+        tables.append({
+            'table': row['table__number'],
+            'seat_hours': row['seat_minutes'] / 60,
+            # share of the table's seat hours in the range which were booked
+            'utilization': row['seat_minutes'] / 60 / (row['table__max_number_of_seats'] * hours) if hours else 0,
+            'bookings': row['bookings'],
+            'cancellations': row['cancellations'],
+            'no_shows': row['no_shows'],
+        })
+
+    # summed per hour in the database, at most 24 rows a day are converted to the local time here
+    heatmap = {}
+    for hour, seat_minutes in rollups.values('hour').annotate(seat_minutes=Sum('seat_minutes')).values_list('hour', 'seat_minutes'):
+        local = timezone.localtime(hour)
+        cell = (local.isoweekday(), local.hour)
+        heatmap[cell] = heatmap.get(cell, 0) + seat_minutes
+    return {
+        'seat_hours': totals['seat_minutes'] / 60,
+        'bookings': totals['bookings'],
+        'cancellations': totals['cancellations'],
+        'no_shows': totals['no_shows'],
+        'cancellation_rate': totals['cancellations'] / totals['bookings'] if totals['bookings'] else 0,
+        'no_show_rate': totals['no_shows'] / totals['bookings'] if totals['bookings'] else 0,
+        'tables': tables,
+        'heatmap': [
+            {'weekday': weekday, 'hour': hour, 'seat_hours': seat_minutes / 60}
+            for (weekday, hour), seat_minutes in sorted(heatmap.items())
+        ],
+    }
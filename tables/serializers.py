@@ -1,5 +1,8 @@
+from operator import attrgetter
+
 from rest_framework import serializers
 from .models import Reservation, Table
+from django.conf import settings
 from django.db import models
 
 
@@ -26,9 +29,118 @@ class ReservationSerializer(serializers.Serializer):
         instance.save()
         return instance
 
+class ArchivedReservationSerializer(serializers.Serializer):
+    table = serializers.CharField(source='table_number')
+    date = serializers.DateTimeField()
+    duration = serializers.IntegerField()
+    full_name = serializers.CharField(max_length=255)
+    phone = serializers.CharField(max_length=31)
+    email = serializers.EmailField()
+    number_of_seats = serializers.IntegerField()
+
+
 class TableSerializer(serializers.Serializer):
     number = serializers.IntegerField()
     min_number_of_seats = serializers.IntegerField()
     max_number_of_seats = serializers.IntegerField()
 
-    
\ No newline at end of file
+
+class CombinationSerializer(serializers.Serializer):
+    tables = serializers.ListField(child=serializers.IntegerField())
+    seats = serializers.IntegerField()
+
+
+class AvailabilitySlotSerializer(serializers.Serializer):
+    start = serializers.DateTimeField()
+    tables = serializers.ListField(child=serializers.IntegerField())
+
+
+class FastSerializer:
+    """
+        Read-only serializer for list endpoints which builds output straight from
+        .values_list() rows, skipping per-row Serializer and model instance work.
+        Each entry of fields is (output name, ORM lookup, DRF field), the DRF field
+        converts the value, so the JSON is byte-identical to the full serializer.
+    """
+    fields = ()
+
+    @classmethod
+    def lookups(cls):
+        return [lookup for _, lookup, _ in cls.fields]
+
+    @classmethod
+    def compile(cls):
+        """
+            Return:
+                function converting one values_list() row to the output dict
+        """
+        names = [name for name, _, _ in cls.fields]
+        converters = [cls.bind(field).to_representation for _, _, field in cls.fields]
+
+        def to_representation(row):
+            return dict(zip(names, [None if value is None else convert(value) for convert, value in zip(converters, row)]))
+        return to_representation
+
+    @staticmethod
+    def bind(field):
+        # DateTimeField looks up the current timezone for every value, resolve it once
+        if isinstance(field, serializers.DateTimeField) and not hasattr(field, 'timezone'):
+            return serializers.DateTimeField(default_timezone=field.default_timezone())
+        return field
+
+    @classmethod
+    def from_rows(cls, rows):
+        return list(map(cls.compile(), rows))
+
+    @classmethod
+    def rows(cls, data, chunk_size=None):
+        if isinstance(data, models.QuerySet):
+            rows = data.values_list(*cls.lookups())
+            return rows.iterator(chunk_size=chunk_size) if chunk_size else rows
+        getters = [attrgetter(lookup.replace('__', '.')) for lookup in cls.lookups()]
+        return ([getter(obj) for getter in getters] for obj in data)
+
+    @classmethod
+    def serialize(cls, data):
+        return cls.from_rows(cls.rows(data))
+
+
+class FastReservationSerializer(FastSerializer):
+    fields = (
+        ('table', 'table__number', serializers.CharField()),
+        ('date', 'date', serializers.DateTimeField()),
+        ('duration', 'duration', serializers.IntegerField()),
+        ('full_name', 'full_name', serializers.CharField()),
+        ('phone', 'phone', serializers.CharField()),
+        ('email', 'email', serializers.EmailField()),
+        ('number_of_seats', 'number_of_seats', serializers.IntegerField()),
+    )
+
+
+class ExportReservationSerializer(FastSerializer):
+    fields = (
+        ('id', 'id', serializers.IntegerField()),
+    ) + FastReservationSerializer.fields
+
+
+class FastTableSerializer(FastSerializer):
+    fields = (
+        ('number', 'number', serializers.IntegerField()),
+        ('min_number_of_seats', 'min_number_of_seats', serializers.IntegerField()),
+        ('max_number_of_seats', 'max_number_of_seats', serializers.IntegerField()),
+    )
+
+
+fast_serializers = {
+    ReservationSerializer: FastReservationSerializer,
+    TableSerializer: FastTableSerializer,
+}
+
+
+def serialize_many(serializer_class, data):
+    """
+        serializer_class(data, many=True).data, or its fast equivalent when settings.FAST_SERIALIZERS is on.
+    """
+    if getattr(settings, 'FAST_SERIALIZERS', False) and serializer_class in fast_serializers:
+        return fast_serializers[serializer_class].serialize(data)
+    return serializer_class(data, many=True).data
@@ -0,0 +1,324 @@
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from api.models import IdempotencyKey, OutboxEmail
+
+from .models import ArchivedReservation, DataVersion, FrozenVenue, OccupancyRollup, Reservation, ReservationSeries, Table
+from .venues import using_venue, venue_database
+from .versions import TABLES_KEY, bump
+
+# in dependency order, with the lookup selecting the rows of a venue
+VENUE_MODELS = (
+    (Table, 'venue'),
+    (ReservationSeries, 'venue'),
+    (Reservation, 'venue'),
+    (ArchivedReservation, 'venue'),
+    (OccupancyRollup, 'table__venue'),
+    (OutboxEmail, 'venue'),
+    (IdempotencyKey, 'venue'),
+)
+
+
+def venue_rows(model, lookup, venue, using):
+    return model._base_manager.using(using).filter(**{lookup: venue}).order_by('id')
+
+
+# rows clients never see the ids of are copied without them, matched in the target by a
+# unique key of their own venue - table ids remapped, see table_ids
+NATURAL_KEYS = {
+    Table: ('venue', 'number'),
+    OccupancyRollup: ('table_id', 'hour'),
+    IdempotencyKey: ('key', 'scope'),
+}
+# no unique key: the venue's rows in the target are replaced - a shard sends only the emails
+# of the venues it serves, so rows there are left by an earlier pass of this move
+REPLACED = (OutboxEmail,)
+
+
+def table_ids(venue, source, target):
+    """
+        Return:
+            {id of a table of the venue in source: id of the table with its number in target}
+    """
+    target_ids = dict(Table._base_manager.using(target).filter(venue=venue).values_list('number', 'id'))
+    return {
+        table_id: target_ids.get(number)
+        for table_id, number in Table._base_manager.using(source).filter(venue=venue).values_list('id', 'number')
+    }
+
+
+def natural_keys(model, rows):
+    return {tuple(getattr(row, field) for field in NATURAL_KEYS[model]) for row in rows}
+
+
+def taken_rows(model, lookup, venue, target, batch, insert_only=False):
+    """
+        Ids of rows in target which copying the batch of the venue's rows would overwrite:
+        rows of other venues sharing the shard holding their ids, or with insert_only any row
+        holding their ids or unique keys.
+    """
+    if model in REPLACED:
+        return []
+    if model in NATURAL_KEYS:
+        if not insert_only:
+            # the keys include the venue, or its tables
+            return []
+        query = Q()
+        for key in natural_keys(model, batch):
+            query |= Q(**dict(zip(NATURAL_KEYS[model], key)))
+        return list(model._base_manager.using(target).filter(query).values_list('id', flat=True))
+    rows = model._base_manager.using(target).filter(id__in=[row.id for row in batch])
+    if not insert_only:
+        # rows of the venue itself were copied by an earlier pass of this move
+        rows = rows.exclude(**{lookup: venue})
+    return list(rows.values_list('id', flat=True))
+
+
+def refuse_taken(model, venue, target, ids):
+    raise ValueError("{count} {model} rows of {venue} collide in {target} with other rows, e.g. ids {ids}; "
+        "the venue cannot keep its ids there".format(
+            count=len(ids), model=model.__name__, venue=venue, target=target, ids=', '.join(map(str, ids[:5]))))
+
+
+def copy_rows(model, lookup, venue, source, target, batch_size, tables=None, ids=None, insert_only=False):
+    """
+        Copy the venue's rows of model from source into target, in batches, only the rows
+        of ids if given. Reservations, series and the archive keep their ids, which clients
+        hold in URLs and emails: a row this move copied before is updated, any other row
+        holding the id in target (of another venue, or any with insert_only) refuses the copy.
+        Rows of NATURAL_KEYS are matched by their key instead, with table ids mapped by tables,
+        the outbox is replaced.
+
+        Return:
+            number of copied rows
+    """
+    fields = [field.name for field in model._meta.concrete_fields if not field.primary_key]
+    rows = venue_rows(model, lookup, venue, source)
+    if model in REPLACED and ids is None:
+        delete_ids(model, list(venue_rows(model, lookup, venue, target).values_list('id', flat=True)), target, batch_size)
+    copied = 0
+    last_id = None
+    while True:
+        if ids is not None:
+            batch = list(rows.filter(id__in=ids[copied:copied + batch_size]))
+        else:
+            batch = list((rows.filter(id__gt=last_id) if last_id is not None else rows)[:batch_size])
+        if not batch:
+            return copied
+        last_id = batch[-1].id
+        copied += len(batch)
+        if tables is not None and 'table' in fields:
+            for row in batch:
+                row.table_id = tables[row.table_id]
+        with transaction.atomic(using=target):
+            taken = taken_rows(model, lookup, venue, target, batch, insert_only)
+            if taken:
+                refuse_taken(model, venue, target, taken)
+            if model in REPLACED or model in NATURAL_KEYS:
+                for row in batch:
+                    row.id = None
+            if model in REPLACED:
+                model._base_manager.using(target).bulk_create(batch)
+            else:
+                unique_fields = list(NATURAL_KEYS.get(model, ['id']))
+                model._base_manager.using(target).bulk_create(
+                    batch, update_conflicts=True, unique_fields=unique_fields,
+                    update_fields=[field for field in fields if field not in unique_fields])
+
+
+def copy_models(venue, source, target, batch_size, final=False):
+    """
+        One pass of copy_venue over VENUE_MODELS. The final one also deletes the rows of
+        the venue in target which are gone from source.
+
+        Return:
+            ({model name: copied rows}, {model name: highest id of the venue's rows in source})
+    """
+    counts = {}
+    copied = {}
+    tables = None
+    for model, lookup in VENUE_MODELS:
+        counts[model.__name__] = copy_rows(model, lookup, venue, source, target, batch_size, tables=tables)
+        if model is Table:
+            tables = table_ids(venue, source, target)
+        if not final:
+            continue
+        source_rows = venue_rows(model, lookup, venue, source)
+        copied[model.__name__] = max(source_rows.values_list('id', flat=True), default=0)
+        if model in REPLACED:
+            continue
+        target_rows = venue_rows(model, lookup, venue, target)
+        if model in NATURAL_KEYS:
+            fields = NATURAL_KEYS[model]
+            current = {
+                tuple(tables[value] if field == 'table_id' else value for field, value in zip(fields, key))
+                for key in source_rows.values_list(*fields)
+            }
+            stale = [row[0] for row in target_rows.values_list('id', *fields) if row[1:] not in current]
+        else:
+            current = set(source_rows.values_list('id', flat=True))
+            stale = [row_id for row_id in target_rows.values_list('id', flat=True) if row_id not in current]
+        delete_ids(model, stale, target, batch_size)
+    return counts, copied
+
+
+def check_ids(venue, source, target, batch_size):
+    """
+        Refuse a move before copying anything when rows of other venues in target hold
+        ids of the venue's rows which keep their ids.
+    """
+    for model, lookup in VENUE_MODELS:
+        if model in NATURAL_KEYS or model in REPLACED:
+            continue
+        ids = list(venue_rows(model, lookup, venue, source).values_list('id', flat=True))
+        for i in range(0, len(ids), batch_size):
+            taken = taken_rows(model, lookup, venue, target, [model(id=row_id) for row_id in ids[i:i + batch_size]])
+            if taken:
+                refuse_taken(model, venue, target, taken)
+
+
+def delete_ids(model, ids, using, batch_size):
+    with connections[using].cursor() as cursor:
+        for i in range(0, len(ids), batch_size):
+            batch = ids[i:i + batch_size]
+            cursor.execute("DELETE FROM {table} WHERE id IN ({ids})".format(
+                table=model._meta.db_table, ids=', '.join(['%s'] * len(batch))), batch)
+
+
+def missing_rows(venue, source):
+    """
+        Rows of the venue written in source after copy_venue froze it there - the rows up to
+        then are in the target, or were deleted there since - and not caught up by copy_missing.
+
+        Return:
+            {model: sorted ids} of such rows
+    """
+    frozen = FrozenVenue.objects.using(source).filter(venue=venue).first()
+    if frozen is None:
+        raise ValueError("{venue} was not moved away from {source} with copy_venue".format(venue=venue, source=source))
+    missing = {}
+    for model, lookup in VENUE_MODELS:
+        caught_up = set(frozen.caught_up.get(model.__name__, ()))
+        rows = venue_rows(model, lookup, venue, source).filter(id__gt=frozen.copied.get(model.__name__, 0))
+        ids = [row_id for row_id in rows.values_list('id', flat=True) if row_id not in caught_up]
+        if ids:
+            missing[model] = ids
+    return missing
+
+
+def copy_venue(venue, target, batch_size=1000):
+    """
+        Copy the tables, reservations, series, archive, rollups, outbox and idempotency keys
+        of a venue to the target shard while it keeps serving from its current one.
+
+        The first pass runs online. The second one holds the locks of the venue's tables
+        in the source, which every booking and cancellation takes as well (on SQLite the
+        write lock of the file), freezes the venue there, copies the changes made meanwhile
+        and deletes the rows which were cancelled. From then on writes of the venue in the
+        source answer 503 (tables.signals.check_writable) and its emails are sent only from
+        the target - point settings.VENUES['SHARDS'] of the venue to target and reload the
+        workers, then remove the old rows with purge_venue.
+
+        Return:
+            {model name: rows in the target}
+    """
+    source = venue_database(venue)
+    if source == target:
+        raise ValueError("{venue} is stored in {target} already".format(venue=venue, target=target))
+    check_ids(venue, source, target, batch_size)
+
+    with using_venue(venue):
+        copy_models(venue, source, target, batch_size)
+
+        with transaction.atomic(using=source), transaction.atomic(using=target):
+            list(Table.objects.using(source).select_for_update().order_by('id').values_list('id'))
+            bump([TABLES_KEY])
+            counts, copied = copy_models(venue, source, target, batch_size, final=True)
+            # visible to writes of the venue once this commits and they get the tables' locks
+            FrozenVenue.objects.using(source).update_or_create(venue=venue, defaults={'copied': copied})
+
+    raise_versions(source, target)
+    return counts
+
+
+def raise_versions(source, target):
+    """
+        Set the version of every key in target above its versions in both shards: cached
+        responses of the moved venue carry versions of source, of the other venues of target.
+    """
+    now = timezone.now()
+    source_versions = dict(DataVersion.objects.using(source).values_list('key', 'version'))
+    DataVersion.objects.using(target).exclude(key__in=source_versions).update(version=F('version') + 1, modified=now)
+    for key, version in source_versions.items():
+        raised = Greatest(F('version'), Value(version)) + 1
+        if DataVersion.objects.using(target).filter(key=key).update(version=raised, modified=now):
+            continue
+        try:
+            with transaction.atomic(using=target):
+                DataVersion.objects.using(target).create(key=key, version=version + 1, modified=now)
+        except IntegrityError:
+            DataVersion.objects.using(target).filter(key=key).update(version=raised, modified=now)
+
+
+def copy_missing(venue, source, batch_size=1000):
+    """
+        Catch up after the switch: copy the rows of the venue written in the shard it was
+        moved away from past its freeze (missing_rows), e.g. by raw SQL which no freeze stops.
+        Refused when the venue's current shard gave any of their ids or unique keys to other rows since.
+
+        Return:
+            {model name: copied rows}
+    """
+    target = venue_database(venue)
+    if source == target:
+        raise ValueError("{venue} is stored in {source}, copy from the shard it was moved away from".format(
+            venue=venue, source=source))
+    counts = {}
+    caught_up = {}
+    missing = missing_rows(venue, source)
+    with transaction.atomic(using=target):
+        for model, lookup in VENUE_MODELS:
+            if model not in missing:
+                continue
+            ids = missing[model]
+            tables = table_ids(venue, source, target) if model is not Table else None
+            counts[model.__name__] = copy_rows(
+                model, lookup, venue, source, target, batch_size, tables=tables, ids=ids, insert_only=True)
+            caught_up[model.__name__] = ids
+    frozen = FrozenVenue.objects.using(source).get(venue=venue)
+    for name, ids in caught_up.items():
+        frozen.caught_up[name] = frozen.caught_up.get(name, []) + ids
+    frozen.save(update_fields=['caught_up'])
+    return counts
+
+
+def unfreeze_venue(venue):
+    """
+        Call off a move before the switch, writes of the venue in its shard go through again.
+    """
+    FrozenVenue.objects.using(venue_database(venue)).filter(venue=venue).delete()
+
+
+def purge_venue(venue, using):
+    """
+        Delete the rows of a venue from a shard it was moved away from, with plain DELETE
+        statements like the archive - no signals reach the moved venue. Refused while rows
+        written there past the freeze are missing in the venue's current shard, see copy_missing.
+    """
+    target = venue_database(venue)
+    if target == using:
+        raise ValueError("{venue} is still stored in {using}".format(venue=venue, using=using))
+    missing = missing_rows(venue, using)
+    if missing:
+        raise ValueError("{rows} rows of {venue} in {using} are missing in {target} ({models}), copy them with "
+            "copy_venue {venue} --from {using} first".format(
+                rows=sum(len(ids) for ids in missing.values()), venue=venue, using=using, target=target,
+                models=', '.join(model.__name__ for model in missing)))
+    tables = Table._meta.db_table
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute("DELETE FROM {rollups} WHERE table_id IN (SELECT id FROM {tables} WHERE venue = %s)".format(
+            rollups=OccupancyRollup._meta.db_table, tables=tables), [venue])
+        for model in (Reservation, ReservationSeries, ArchivedReservation, Table, OutboxEmail, IdempotencyKey, FrozenVenue):
+            cursor.execute("DELETE FROM {table} WHERE venue = %s".format(table=model._meta.db_table), [venue])
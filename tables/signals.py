@@ -0,0 +1,143 @@
+from functools import partial
+
+from django.db import router, transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+
+from .availability import as_aware, availability_index
+from .models import FrozenVenue, Reservation, ReservationSeries, Table
+from .pubsub import broker
+from .rollups import record_booked, record_cancelled, record_changed
+from .venues import VenueFrozen
+from .versions import TABLES_KEY, bump, reservation_keys
+
+# sent with reservations=[...] after bulk_create, which does not send post_save
+reservations_bulk_created = Signal()
+# sent with reservations=[...] after their rows were deleted with a plain DELETE, which sends no post_delete
+reservations_bulk_deleted = Signal()
+
+# Versions are bumped after commit in their own statement - bumping inside the booking
+# transaction would lock the day's row and serialize bookings of different tables.
+# Occupancy rollups are updated inside it: their rows belong to the booked table, which
+# the booking has locked already, and they commit or roll back with the reservation -
+# whichever way it was saved or deleted (admin, cascades, shell).
+
+
+def check_writable(venues, using):
+    """
+        Refuse writes of a venue frozen in this shard while copy_venue moves it. Runs in the
+        write's transaction, once the booking or cancellation holds its tables' locks, which
+        the final pass of copy_venue takes before it freezes the venue.
+    """
+    if FrozenVenue.objects.using(using).filter(venue__in=set(venues)).exists():
+        raise VenueFrozen
+
+
+@receiver(pre_save, sender=Table)
+@receiver(pre_save, sender=ReservationSeries)
+@receiver(pre_save, sender=Reservation)
+@receiver(pre_delete, sender=Table)
+@receiver(pre_delete, sender=ReservationSeries)
+@receiver(pre_delete, sender=Reservation)
+def venue_written(sender, instance, using, **kwargs):
+    check_writable([instance.venue], using)
+
+
+def event_key(venue, key):
+    return '{venue}:{key}'.format(venue=venue, key=key)
+
+
+def publish(venue, event_type, table_id, start_date, finish_date):
+    """
+        Tell subscribers of the venue's touched days (GET /tables/events) that the table
+        became busy ('booked') or free ('freed') for <start_date, finish_date>.
+    """
+    event = {'type': event_type, 'table_id': table_id, 'start': as_aware(start_date), 'end': as_aware(finish_date)}
+    for key in reservation_keys(start_date, finish_date):
+        broker.publish(event_key(venue, key), event)
+
+
+@receiver(post_save, sender=Reservation)
+def reservation_saved(sender, instance, created, using, **kwargs):
+    keys = reservation_keys(instance.date, instance.end_date)
+    loaded_date, loaded_end_date = getattr(instance, 'loaded_dates', (None, None))
+    if loaded_date and loaded_end_date:
+        keys += reservation_keys(loaded_date, loaded_end_date)
+    transaction.on_commit(partial(bump, sorted(set(keys))), using=using)
+    if availability_index.enabled:
+        transaction.on_commit(partial(availability_index.reservation_saved,
+            instance.venue, instance.id, instance.table_id, instance.date, instance.end_date), using=using)
+    if created:
+        record_booked([instance], using)
+        transaction.on_commit(partial(publish, instance.venue, 'booked', instance.table_id, instance.date, instance.end_date), using=using)
+        return
+    occupancy_changed(instance, using)
+    if loaded_date and loaded_end_date and (as_aware(loaded_date), as_aware(loaded_end_date)) != (as_aware(instance.date), as_aware(instance.end_date)):
+        transaction.on_commit(partial(publish, instance.venue, 'freed', instance.table_id, loaded_date, loaded_end_date), using=using)
+        transaction.on_commit(partial(publish, instance.venue, 'booked', instance.table_id, instance.date, instance.end_date), using=using)
+
+
+def occupancy_changed(instance, using):
+    loaded = getattr(instance, 'loaded_occupancy', None)
+    if loaded is None or None in loaded:
+        return
+    table_id, date, end_date, seats, no_show = loaded
+    current = (instance.table_id, as_aware(instance.date), as_aware(instance.end_date), instance.number_of_seats, instance.no_show)
+    if (table_id, as_aware(date), as_aware(end_date), seats, no_show) != current:
+        record_changed(loaded, instance, using)
+        instance.loaded_occupancy = current
+
+
+@receiver(reservations_bulk_created, sender=Reservation)
+def reservations_created(sender, reservations, using=None, **kwargs):
+    using = using or router.db_for_write(Reservation)
+    check_writable([r.venue for r in reservations], using)
+    record_booked(reservations, using)
+    keys = sorted({key for r in reservations for key in reservation_keys(r.date, r.end_date)})
+    transaction.on_commit(partial(bump, keys), using=using)
+    if availability_index.enabled:
+        for r in reservations:
+            transaction.on_commit(partial(availability_index.reservation_saved,
+                r.venue, r.id, r.table_id, r.date, r.end_date), using=using)
+    for r in reservations:
+        transaction.on_commit(partial(publish, r.venue, 'booked', r.table_id, r.date, r.end_date), using=using)
+
+
+@receiver(post_delete, sender=Reservation)
+def reservation_deleted(sender, instance, using, origin=None, **kwargs):
+    # the rollups of a deleted table are deleted with it
+    if not isinstance(origin, Table) and getattr(origin, 'model', None) is not Table:
+        record_cancelled([instance], using)
+    transaction.on_commit(partial(bump, reservation_keys(instance.date, instance.end_date)), using=using)
+    if availability_index.enabled:
+        transaction.on_commit(partial(availability_index.reservation_deleted, instance.venue, instance.id), using=using)
+    transaction.on_commit(partial(publish, instance.venue, 'freed', instance.table_id, instance.date, instance.end_date), using=using)
+
+
+@receiver(reservations_bulk_deleted, sender=Reservation)
+def reservations_deleted(sender, reservations, using=None, **kwargs):
+    using = using or router.db_for_write(Reservation)
+    check_writable([r.venue for r in reservations], using)
+    record_cancelled(reservations, using)
+    keys = sorted({key for r in reservations for key in reservation_keys(r.date, r.end_date)})
+    transaction.on_commit(partial(bump, keys), using=using)
+    if availability_index.enabled:
+        for r in reservations:
+            transaction.on_commit(partial(availability_index.reservation_deleted, r.venue, r.id), using=using)
+    for r in reservations:
+        transaction.on_commit(partial(publish, r.venue, 'freed', r.table_id, r.date, r.end_date), using=using)
+
+
+@receiver(post_save, sender=Table)
+def table_saved(sender, instance, using, **kwargs):
+    transaction.on_commit(partial(bump, [TABLES_KEY]), using=using)
+    if availability_index.enabled:
+        transaction.on_commit(partial(availability_index.table_saved,
+            instance.venue, instance.id, instance.number, instance.min_number_of_seats, instance.max_number_of_seats), using=using)
+
+
+@receiver(post_delete, sender=Table)
+def table_deleted(sender, instance, using, **kwargs):
+    transaction.on_commit(partial(bump, [TABLES_KEY]), using=using)
+    if availability_index.enabled:
+        transaction.on_commit(partial(availability_index.table_deleted, instance.venue, instance.id), using=using)
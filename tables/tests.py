@@ -1,3 +1,325 @@
-from django.test import TestCase
+from datetime import date, datetime, timedelta
+from importlib import import_module
+from itertools import combinations
+from types import SimpleNamespace
+from unittest import skipUnless
+import random
 
-# Create your tests here.
+from django.apps import apps
+from django.db import connection, connections
+from django.db.models import F
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from api.models import IdempotencyKey, OutboxEmail
+from api.views import AvailableTablesView
+from tables.archive import archive_reservations
+from tables.availability import availability_index, smallest_combination
+from tables.models import ArchivedReservation, DataVersion, FrozenVenue, OccupancyRollup, Reservation, Table
+from tables.shards import copy_missing, copy_venue, purge_venue
+from tables.venues import using_venue
+from tables.versions import TABLES_KEY
+
+
+class OverlapTest(TestCase):
+    def setUp(self):
+        self.table = Table.objects.create(number=1, min_number_of_seats=1, max_number_of_seats=4)
+
+    def reserve(self, date, duration):
+        return Reservation.objects.create(
+            table=self.table, date=date, duration=duration, full_name='Paul Smith', phone='997',
+            email='paul@email.com', number_of_seats=2)
+
+    def taken(self, start, hours=1):
+        return Reservation.objects.overlapping(start, start + timedelta(hours=hours)).exists()
+
+    @override_settings(THROTTLING={})
+    def test_booking_from_the_previous_day_runs_past_midnight(self):
+        self.reserve(timezone.make_aware(datetime(2030, 10, 18, 22)), 4)
+
+        self.assertTrue(self.taken(timezone.make_aware(datetime(2030, 10, 19, 1))))
+        self.assertFalse(self.taken(timezone.make_aware(datetime(2030, 10, 19, 3))))
+        response = Client().get('/tables/', {
+            'min_seats': 2, 'start_date': '2030-10-19 01:00:00.000', 'duration': 1, 'status': 'free'})
+        self.assertEqual(response.json(), [])
+
+    def test_boundaries_are_inclusive(self):
+        self.reserve(timezone.make_aware(datetime(2030, 10, 19, 16)), 2)
+
+        # ending exactly at the requested start, and starting exactly at its end
+        self.assertTrue(self.taken(timezone.make_aware(datetime(2030, 10, 19, 18))))
+        self.assertTrue(self.taken(timezone.make_aware(datetime(2030, 10, 19, 15))))
+        self.assertFalse(self.taken(timezone.make_aware(datetime(2030, 10, 19, 18, 1))))
+
+    def test_end_date_backfill(self):
+        migration = import_module('tables.migrations.0008_reservation_end_date')
+        ids = [self.reserve(timezone.make_aware(datetime(2030, 10, 19, hour)), hour % 3 + 1).id for hour in range(10, 15)]
+        Reservation.objects.update(end_date=F('date'))
+
+        migration.backfill_end_date(apps, SimpleNamespace(connection=connection))
+
+        for reservation in Reservation.objects.filter(id__in=ids):
+            self.assertEqual(reservation.end_date, reservation.date + timedelta(hours=reservation.duration))
+
+
+@override_settings(AVAILABILITY_INDEX={'ENABLED': True, 'MAX_DAYS': 2, 'MAX_INTERVALS': 1000})
+class AvailabilityIndexTest(TestCase):
+    def setUp(self):
+        availability_index.clear()
+        self.addCleanup(availability_index.clear)
+        self.before = availability_index.stats()
+        self.tables = [
+            Table.objects.create(number=number, min_number_of_seats=1, max_number_of_seats=4)
+            for number in (1, 2, 3)]
+
+    def reserve(self, table, date, duration=2):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Reservation.objects.create(
+                table=table, date=date, duration=duration, full_name='Paul Smith', phone='997',
+                email='paul@email.com', number_of_seats=2)
+
+    def free(self, start_date, duration=2, min_seats=2):
+        return sorted(table.number for table in availability_index.available_tables(min_seats, start_date, duration))
+
+    def counted(self, key):
+        # the counters are kept across clear()
+        return availability_index.stats()[key] - self.before[key]
+
+    def test_index_follows_saves_moves_and_deletes(self):
+        evening = timezone.make_aware(datetime(2030, 10, 19, 18))
+        self.assertEqual(self.free(evening), [1, 2, 3])
+
+        reservation = Reservation.objects.get(id=self.reserve(self.tables[0], evening).id)
+        self.assertEqual(self.free(evening), [2, 3])
+
+        reservation.table = self.tables[1]
+        with self.captureOnCommitCallbacks(execute=True):
+            reservation.save()
+        self.assertEqual(self.free(evening), [1, 3])
+
+        reservation.date = evening - timedelta(hours=6)
+        with self.captureOnCommitCallbacks(execute=True):
+            reservation.save()
+        self.assertEqual(self.free(evening), [1, 2, 3])
+        self.assertEqual(self.free(evening - timedelta(hours=5)), [1, 3])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reservation.delete()
+        self.assertEqual(self.free(evening - timedelta(hours=5)), [1, 2, 3])
+        # every answer came from the day loaded at first
+        self.assertEqual(self.counted('misses'), 1)
+
+    def test_least_recently_used_days_are_evicted(self):
+        days = [timezone.make_aware(datetime(2030, 10, day, 12)) for day in (19, 20, 21)]
+        for day in days:
+            self.free(day)
+        self.assertEqual(availability_index.stats()['days'], 2)
+        self.assertEqual((self.counted('evictions'), self.counted('misses')), (1, 3))
+
+        self.free(days[0])
+        self.assertEqual(self.counted('misses'), 4)
+
+        with self.settings(AVAILABILITY_INDEX={'ENABLED': True, 'MAX_DAYS': 64, 'MAX_INTERVALS': 3}):
+            availability_index.clear()
+            for day in days[:2]:
+                self.reserve(self.tables[0], day)
+                self.reserve(self.tables[1], day)
+            self.free(days[0])
+            self.assertEqual(availability_index.stats()['intervals'], 2)
+            # the day just loaded stays even though it goes over the limit alone
+            self.free(days[1])
+            stats = availability_index.stats()
+            self.assertEqual((stats['days'], stats['intervals']), (1, 2))
+
+    def test_index_agrees_with_the_database(self):
+        random.seed(7)
+        start = timezone.make_aware(datetime(2030, 10, 19))
+        for _ in range(30):
+            self.reserve(random.choice(self.tables), start + timedelta(minutes=30 * random.randrange(96)),
+                random.randint(1, 4))
+        for slot in range(0, 96):
+            start_date = start + timedelta(minutes=30 * slot)
+            expected = AvailableTablesView.get_available_tables(2, start_date, 2, use_index=False)
+            self.assertEqual(self.free(start_date), sorted(table.number for table in expected), start_date)
+
+
+class SmallestCombinationTest(SimpleTestCase):
+    def test_matches_exhaustive_search(self):
+        rng = random.Random(0)
+        for _ in range(200):
+            tables = [Table(number=n, max_number_of_seats=rng.randint(2, 8)) for n in range(1, rng.randint(2, 12))]
+            party = rng.randint(6, 30)
+            expected = None
+            for size in range(2, 5):
+                totals = [sum(t.max_number_of_seats for t in c) for c in combinations(tables, size)]
+                fitting = [total for total in totals if total >= party]
+                if fitting:
+                    expected = (size, min(fitting))
+                    break
+
+            found = smallest_combination(tables, party, 4)
+            self.assertEqual(found and (len(found), sum(t.max_number_of_seats for t in found)), expected)
+
+    def test_hundred_tables(self):
+        tables = [Table(number=n, max_number_of_seats=2 + n % 5) for n in range(1, 121)]
+        found = smallest_combination(tables, 23, 4)
+        self.assertEqual((len(found), sum(t.max_number_of_seats for t in found)), (4, 23))
+
+
+@skipUnless(connection.vendor == 'sqlite', "plans are checked on SQLite")
+class QueryPlanTest(TestCase):
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(index, plan)
+        self.assertNotRegex(plan, r'SCAN (tables_reservation|tables_table)\b(?! USING)')
+
+    def test_reservations_of_day(self):
+        reservations = Reservation.objects.filter(day=date(2030, 10, 19)).select_related('table').order_by('date', 'id')
+        self.assertUsesIndex(reservations, 'reservation_day_date_idx')
+
+    def test_overlap_check_of_table(self):
+        start = timezone.make_aware(datetime(2030, 10, 19, 16))
+        reservations = Reservation.objects.filter(table_id=1).overlapping(start, start + timedelta(hours=2))
+        self.assertUsesIndex(reservations, 'reservation_table_date_idx')
+
+    def test_table_by_number(self):
+        # the views look tables up by number within the venue of the request
+        with using_venue('harbour'):
+            tables = Table.objects.filter(number=5)
+        self.assertUsesIndex(tables, 'sqlite_autoindex_tables_table_1 (venue=? AND number=?)')
+
+
+class ArchiveTest(TestCase):
+    def reserve(self, table, day, **kwargs):
+        return Reservation.objects.create(
+            table=table, date=timezone.make_aware(datetime(2020, 10, day, 18)), duration=2, full_name='Paul Smith',
+            phone='997 123 997', email='paul@email.com', number_of_seats=2, **kwargs)
+
+    def test_past_reservations_are_moved(self):
+        tables = [Table.objects.create(number=n, min_number_of_seats=1, max_number_of_seats=4) for n in (1, 2)]
+        main = self.reserve(tables[0], 19)
+        self.reserve(tables[1], 19, combined_with=main)
+        self.reserve(tables[0], 25)
+
+        self.assertEqual(archive_reservations(timezone.make_aware(datetime(2020, 10, 20)), batch_size=1), (2, []))
+
+        self.assertEqual(list(Reservation.objects.values_list('date__day', flat=True)), [25])
+        self.assertEqual(ArchivedReservation.objects.get(combined_with_id=main.id).table_number, 2)
+        response = Client().get('/archive', {'start_date': '2020-10-19 00:00:00.000'})
+        self.assertEqual([r['table'] for r in response.data['results']], ['1', '2'])
+
+    def test_reservation_whose_id_is_archived_already_stays(self):
+        tables = [Table.objects.create(number=n, min_number_of_seats=1, max_number_of_seats=4) for n in (1, 2)]
+        main = self.reserve(tables[0], 19)
+        combined = self.reserve(tables[1], 19, combined_with=main)
+        other = self.reserve(tables[0], 18)
+        # archived by another venue of the shard
+        ArchivedReservation._base_manager.create(
+            id=main.id, venue='harbour', table_number=9, date=main.date, duration=2, end_date=main.end_date,
+            day=main.day, full_name='Anna Smith', phone='997', email='anna@email.com', number_of_seats=6)
+
+        self.assertEqual(archive_reservations(timezone.make_aware(datetime(2020, 10, 20))), (1, [main.id, combined.id]))
+
+        self.assertEqual(sorted(Reservation.objects.values_list('id', flat=True)), [main.id, combined.id])
+        self.assertEqual(list(ArchivedReservation.objects.values_list('id', flat=True)), [other.id])
+        self.assertEqual(ArchivedReservation._base_manager.get(id=main.id).full_name, 'Anna Smith')
+
+
+SHARD = 'shard_2'
+SHARDS = {'DEFAULT': 'main', 'SHARDS': {'main': 'default', 'harbour': 'default', 'pier': SHARD}}
+MOVED = {'DEFAULT': 'main', 'SHARDS': {'main': 'default', 'harbour': SHARD, 'pier': SHARD}}
+
+# a second shard for the venue moves, an in-memory database set up by the test runner like default
+connections.settings.setdefault(SHARD, connections.configure_settings({
+    'default': connections.settings['default'],
+    SHARD: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ''},
+})[SHARD])
+
+
+@override_settings(VENUES=SHARDS)
+class ShardMoveTest(TransactionTestCase):
+    databases = {'default', SHARD}
+
+    def populate(self, venue, table_id, reservation_id, full_name):
+        with using_venue(venue):
+            table = Table.objects.create(id=table_id, number=1, min_number_of_seats=1, max_number_of_seats=4)
+            Reservation.objects.create(
+                id=reservation_id, table=table, date=timezone.make_aware(datetime(2030, 10, 19, 18)), duration=2,
+                full_name=full_name, phone='997', email='guest@email.com', number_of_seats=2)
+            OutboxEmail.objects.create(subject='Reservation', message=full_name, from_email='venue@email.com',
+                recipient='guest@email.com')
+            IdempotencyKey.objects.create(key='retried', scope='POST /venues/{venue}/reservations 127.0.0.1'.format(
+                venue=venue), fingerprint='0' * 64, status_code=201, expires=timezone.now() + timedelta(days=1))
+
+    def rows(self, using):
+        # tables by their numbers, their ids differ between the shards
+        return (
+            list(Table._base_manager.using(using).order_by('venue', 'number').values_list('venue', 'number')),
+            list(Reservation._base_manager.using(using).order_by('id').values_list(
+                'id', 'venue', 'table__venue', 'table__number', 'full_name')),
+            list(OccupancyRollup.objects.using(using).order_by('table__venue', 'hour').values_list(
+                'table__venue', 'table__number', 'hour', 'bookings')),
+            list(OutboxEmail.objects.using(using).order_by('venue').values_list('venue', 'message')),
+            list(IdempotencyKey.objects.using(using).order_by('venue').values_list('venue', 'scope')),
+        )
+
+    def test_move_refused_when_another_venue_holds_its_ids(self):
+        self.populate('pier', 1, 1, 'Pier Guest')
+        self.populate('harbour', 1, 1, 'Harbour Guest')
+        pier, harbour = self.rows(SHARD), self.rows('default')
+
+        with self.assertRaisesMessage(ValueError, '1 Reservation rows of harbour collide in shard_2 with other rows'):
+            copy_venue('harbour', SHARD)
+
+        self.assertEqual(self.rows(SHARD), pier)
+        self.assertEqual(self.rows('default'), harbour)
+        self.assertFalse(FrozenVenue.objects.exists())
+
+    def test_venue_moves_into_a_shard_of_another_venue(self):
+        # both tables have id 1, the moved one gets a new id in the target
+        self.populate('pier', 1, 1, 'Pier Guest')
+        self.populate('harbour', 1, 5, 'Harbour Guest')
+        pier, harbour = self.rows(SHARD), self.rows('default')
+
+        copy_venue('harbour', SHARD)
+        # a re-run updates the rows the move copied already
+        copy_venue('harbour', SHARD)
+        # written past the freeze without signals, e.g. by raw SQL
+        Reservation._base_manager.using('default').bulk_create([Reservation(
+            id=7, venue='harbour', table_id=1, date=timezone.make_aware(datetime(2030, 10, 20, 18)), duration=2,
+            end_date=timezone.make_aware(datetime(2030, 10, 20, 20)), day=date(2030, 10, 20),
+            full_name='Late Guest', phone='997', email='guest@email.com', number_of_seats=2)])
+
+        with self.settings(VENUES=MOVED):
+            with self.assertRaisesMessage(ValueError, '1 rows of harbour in default are missing'):
+                purge_venue('harbour', 'default')
+            self.assertEqual(copy_missing('harbour', 'default'), {'Reservation': 1})
+            self.assertEqual(copy_missing('harbour', 'default'), {})
+            purge_venue('harbour', 'default')
+
+        self.assertEqual(self.rows(SHARD), (
+            [('harbour', 1), ('pier', 1)],
+            [(1, 'pier', 'pier', 1, 'Pier Guest'), (5, 'harbour', 'harbour', 1, 'Harbour Guest'),
+             (7, 'harbour', 'harbour', 1, 'Late Guest')],
+            harbour[2] + pier[2],
+            harbour[3] + pier[3],
+            harbour[4] + pier[4],
+        ))
+        self.assertEqual((len(harbour[2]), len(harbour[3]), len(harbour[4])), (2, 1, 1))
+        self.assertEqual(self.rows('default'), ([], [], [], [], []))
+
+    def test_versions_of_the_target_rise_above_both_shards(self):
+        self.populate('harbour', 1, 5, 'Harbour Guest')
+        now = timezone.now()
+        DataVersion.objects.using('default').update_or_create(key='day:2030-10-19', defaults={'version': 10, 'modified': now})
+        DataVersion.objects.using(SHARD).create(key='day:2030-10-19', version=9, modified=now)
+        DataVersion.objects.using(SHARD).create(key='day:2030-10-21', version=3, modified=now)
+        self.assertFalse(DataVersion.objects.using(SHARD).filter(key=TABLES_KEY).exists())
+
+        copy_venue('harbour', SHARD)
+
+        source = dict(DataVersion.objects.using('default').values_list('key', 'version'))
+        target = dict(DataVersion.objects.using(SHARD).values_list('key', 'version'))
+        self.assertEqual((target['day:2030-10-19'], target['day:2030-10-21']), (11, 4))
+        self.assertEqual(target[TABLES_KEY], source[TABLES_KEY] + 1)
+        self.assertTrue(all(target[key] > version for key, version in source.items()))
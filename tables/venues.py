@@ -0,0 +1,75 @@
+import contextvars
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+# set while a request of a venue-prefixed URL runs, see api.routers.for_venue
+venue = contextvars.ContextVar('venue', default=None)
+
+
+def venue_config():
+    return getattr(settings, 'VENUES', {})
+
+
+def default_venue():
+    return venue_config().get('DEFAULT', 'main')
+
+
+def current_venue():
+    """
+        The venue the current request or command works with, also the default of Table.venue.
+    """
+    return venue.get() or default_venue()
+
+
+def venue_database(name=None):
+    """
+        Alias of the database (shard) holding the tables and reservations of the venue.
+    """
+    return venue_config().get('SHARDS', {}).get(name or current_venue(), DEFAULT_DB_ALIAS)
+
+
+def is_venue(name):
+    return name in venue_config().get('SHARDS', {}) or name == default_venue()
+
+
+def shard_venues(alias):
+    """
+        Venues stored in the shard alias.
+    """
+    names = set(venue_config().get('SHARDS', {})) | {default_venue()}
+    return sorted(name for name in names if venue_database(name) == alias)
+
+
+def venue_databases():
+    """
+        Return:
+            {alias: one of its venues} of every shard, for jobs which go through all of them
+    """
+    shards = {venue_database(default_venue()): default_venue()}
+    for name, alias in sorted(venue_config().get('SHARDS', {}).items()):
+        shards.setdefault(alias, name)
+    return shards
+
+
+@contextmanager
+def using_venue(name):
+    token = venue.set(name)
+    try:
+        yield
+    finally:
+        venue.reset(token)
+
+
+class VenueFrozen(APIException):
+    """
+        A write of a venue while it is moved to another shard (tables.models.FrozenVenue).
+    """
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "The venue is being moved, retry in a moment."
+    default_code = 'venue_frozen'
+    # sent as Retry-After by the exception handler of REST framework
+    wait = 5
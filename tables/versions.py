@@ -0,0 +1,54 @@
+from django.db import IntegrityError, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .availability import service_days
+from .models import DataVersion
+
+TABLES_KEY = 'tables'
+
+
+def day_key(day):
+    return 'day:{day}'.format(day=day.isoformat())
+
+
+def reservation_keys(start_date, finish_date):
+    return [day_key(day) for day in service_days(start_date, finish_date)]
+
+
+def bump(keys):
+    """
+        Increment the versions of keys.
+    """
+    now = timezone.now()
+    for key in keys:
+        if DataVersion.objects.filter(key=key).update(version=F('version') + 1, modified=now):
+            continue
+        try:
+            with transaction.atomic(using=router.db_for_write(DataVersion)):
+                DataVersion.objects.create(key=key, version=1, modified=now)
+        except IntegrityError:
+            DataVersion.objects.filter(key=key).update(version=F('version') + 1, modified=now)
+
+
+def get_versions(keys):
+    """
+        Return:
+            (etag, last_modified) of keys, last_modified is None if none of them changed yet
+    """
+    rows = DataVersion.objects.filter(key__in=keys).values_list('key', 'version', 'modified')
+    versions = {key: version for key, version, _ in rows}
+    modified = max((modified for _, _, modified in rows), default=None)
+    etag = '"{}"'.format('-'.join(str(versions.get(key, 0)) for key in keys))
+    return etag, modified
+
+
+async def aget_versions(keys):
+    """
+        get_versions with the async ORM.
+    """
+    rows = [row async for row in DataVersion.objects.filter(key__in=keys).values_list('key', 'version', 'modified')]
+    versions = {key: version for key, version, _ in rows}
+    modified = max((modified for _, _, modified in rows), default=None)
+    etag = '"{}"'.format('-'.join(str(versions.get(key, 0)) for key in keys))
+    return etag, modified